@@ -4,16 +4,1837 @@ import pandas as pd
 import numpy as np
 import json
 import os
+import hashlib
 import time
-import random
-from datetime import datetime, timedelta
+import threading
+import argparse
+import copy
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from scipy import stats
-from scipy.stats import linregress
-from scipy.stats.mstats import winsorize
-import ta
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import ta
+except ImportError:
+    ta = None
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+YAHOO_CHART_URL = 'https://query2.finance.yahoo.com/v8/finance/chart/'
+
+class TokenBucketRateLimiter:
+    """
+    线程安全的令牌桶限流器 - 所有抓取线程共享同一个桶
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = max(float(capacity), 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self, n=1):
+        """预占 n 个令牌，返回需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+    
+    def acquire(self, n=1):
+        """阻塞直到拿到 n 个令牌"""
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+UNIVERSE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etf_universe.csv')
+
+# 名称关键词分类：命中多个类别时按 CATEGORY_PRIORITY 取优先的类别，都不命中为 DEFAULT_CATEGORY
+CATEGORY_KEYWORDS = {
+    '宽基指数': ['300', '50', '500', '1000', '创业板', '科创'],
+    '行业主题': ['医药', '医疗', '创新药', '半导体', '芯片', '新能源', '光伏', '电池', '碳中和', '消费', '酒', '券商', '证券',
+             '银行', '军工', '有色', '新材料', '基建', '农业', '人工智能', '机器人', '软件', '5G', 'TMT', '黄金'],
+    '跨境QDII': ['纳指', '标普', '美国', '恒生', '港股', '中概', '德国', '日经'],
+    '商品债券': ['国债', '黄金', '豆粕', '可转债'],
+}
+DEFAULT_CATEGORY = '其他'
+# 跨境与行业关键词比宽基的数字/板块关键词更具体：标普500 为跨境，医药50、创业板新能源为行业主题
+CATEGORY_PRIORITY = ['跨境QDII', '行业主题', '商品债券', '宽基指数']
+
+class CategoryMatcher:
+    """
+    名称多关键词匹配器 - 全部关键词编译成一个正则，一次扫描名称找出所有（含重叠）命中，取优先级最高的类别
+    
+    类别编号按 keywords 的顺序（即展示顺序），priority 只决定命中多个类别时的取舍，未列出的类别排在最后
+    """
+    def __init__(self, keywords=CATEGORY_KEYWORDS, default=DEFAULT_CATEGORY, priority=CATEGORY_PRIORITY):
+        self.categories = list(keywords) + [default]
+        self.default_code = len(keywords)
+        ranked = [name for name in priority if name in keywords] + [name for name in keywords if name not in priority]
+        self.priority = {self.categories.index(name): rank for rank, name in enumerate(ranked)}
+        self.priority[self.default_code] = len(ranked)
+        # 同一关键词出现在多个类别时归入优先的类别
+        self.keyword_codes = {}
+        for name in ranked:
+            for word in keywords[name]:
+                self.keyword_codes.setdefault(word, self.categories.index(name))
+        # 零宽前瞻在每个位置尝试匹配（长词优先），重叠的关键词也能命中
+        alternatives = '|'.join(re.escape(word) for word in sorted(self.keyword_codes, key=len, reverse=True))
+        self.pattern = re.compile(f'(?=({alternatives}))')
+    
+    def match(self, name):
+        codes = {self.keyword_codes[m.group(1)] for m in self.pattern.finditer(name)}
+        return min(codes, key=self.priority.get, default=self.default_code)
+
+class ETFUniverse:
+    """
+    ETF标的注册表 - 列式数组存储，按 ts_code O(1) 定位，支持按交易所、类别或自选列表筛选出子集
+    
+    交易所和类别以整数编码 + 取值表存储；list_date 缺失为 NaT
+    类别在载入时由 CategoryMatcher 按名称匹配，注册表 category 列非空时以其为准（人工指定）
+    """
+    def __init__(self, ts_codes, names, exchange_codes, exchanges, yf_symbols, category_codes, categories, list_dates):
+        self.ts_codes = ts_codes
+        self.names = names
+        self.exchange_codes = exchange_codes
+        self.exchanges = exchanges
+        self.yf_symbols = yf_symbols
+        self.category_codes = category_codes
+        self.categories = categories
+        self.list_dates = list_dates
+        self.index = {ts_code: i for i, ts_code in enumerate(self.ts_codes)}
+        self.code_index = pd.Index(self.ts_codes)
+    
+    @classmethod
+    def from_csv(cls, path=UNIVERSE_FILE):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        exchange = pd.Categorical(df['exchange'])
+        matcher = CategoryMatcher()
+        explicit = df['category'] != ''
+        categories = matcher.categories + sorted(set(df.loc[explicit, 'category']) - set(matcher.categories))
+        category_codes = np.array([matcher.match(name) for name in df['name']], dtype=np.int16)
+        category_codes[explicit.to_numpy()] = [categories.index(c) for c in df.loc[explicit, 'category']]
+        return cls(
+            ts_codes=df['ts_code'].to_numpy(dtype=str),
+            names=df['name'].to_numpy(dtype=str),
+            exchange_codes=exchange.codes.astype(np.int8),
+            exchanges=list(exchange.categories),
+            yf_symbols=df['yf_symbol'].to_numpy(dtype=str),
+            category_codes=category_codes,
+            categories=categories,
+            list_dates=pd.to_datetime(df['list_date'].replace('', None)).to_numpy(dtype='datetime64[D]'),
+        )
+    
+    def __len__(self):
+        return len(self.ts_codes)
+    
+    def __contains__(self, ts_code):
+        return ts_code in self.index
+    
+    def name_of(self, ts_code):
+        return self.names[self.index[ts_code]]
+    
+    def yf_symbol_of(self, ts_code):
+        return self.yf_symbols[self.index[ts_code]]
+    
+    def positions_of(self, ts_codes):
+        """一组 ts_code 在注册表中的位置（int32，一次向量化查找），不在注册表中的为 -1"""
+        return self.code_index.get_indexer(np.asarray(ts_codes, dtype=str)).astype(np.int32)
+    
+    def take(self, positions):
+        """按位置取子集（共享类别取值表）"""
+        positions = np.asarray(positions, dtype=np.intp)
+        return ETFUniverse(
+            self.ts_codes[positions], self.names[positions],
+            self.exchange_codes[positions], self.exchanges,
+            self.yf_symbols[positions],
+            self.category_codes[positions], self.categories,
+            self.list_dates[positions],
+        )
+    
+    def view(self, exchange=None, category=None, watchlist=None):
+        """
+        筛选子集：exchange / category 为取值或取值列表，watchlist 为 ts_code 列表（保持注册表顺序）
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if exchange is not None:
+            wanted = [self.exchanges.index(e) for e in np.atleast_1d(exchange) if e in self.exchanges]
+            mask &= np.isin(self.exchange_codes, wanted)
+        if category is not None:
+            wanted = [self.categories.index(c) for c in np.atleast_1d(category) if c in self.categories]
+            mask &= np.isin(self.category_codes, wanted)
+        if watchlist is not None:
+            mask &= np.isin(self.ts_codes, list(watchlist))
+        return self.take(np.flatnonzero(mask))
+    
+    def to_frame(self):
+        return pd.DataFrame({
+            'ts_code': self.ts_codes,
+            'name': self.names,
+            'exchange': np.asarray(self.exchanges, dtype=object)[self.exchange_codes],
+            'yf_symbol': self.yf_symbols,
+            'category': np.asarray(self.categories, dtype=object)[self.category_codes],
+            'list_date': self.list_dates,
+        })
+
+_UNIVERSE_CACHE = {}
+
+def load_universe(path=UNIVERSE_FILE):
+    """载入注册表（每个进程每个文件只解析一次）"""
+    if path not in _UNIVERSE_CACHE:
+        _UNIVERSE_CACHE[path] = ETFUniverse.from_csv(path)
+    return _UNIVERSE_CACHE[path]
+
+def to_yf_code(ts_code):
+    """将 ts_code (如 510300.SH) 转换为 yfinance 代码 (如 510300.SS)，优先使用注册表中的映射"""
+    universe = load_universe()
+    if ts_code in universe:
+        return universe.yf_symbol_of(ts_code)
+    code_clean = ts_code.split('.')[0]
+    if ts_code.endswith('.SH'):
+        return f"{code_clean}.SS"
+    return f"{code_clean}.SZ"
+
+def normalize_daily_frame(df):
+    """
+    将yfinance返回的行情规范为 trade_date/open/high/low/close/volume 六列
+    """
+    df = df.reset_index()
+    df = df.rename(columns={
+        'Date': 'trade_date', 
+        'Open': 'open', 
+        'High': 'high', 
+        'Low': 'low', 
+        'Close': 'close', 
+        'Volume': 'volume'
+    })
+    df = df[['trade_date', 'open', 'high', 'low', 'close', 'volume']]
+    df = df.dropna(subset=['close']).reset_index(drop=True)
+    # 单只和批量接口的时区处理不同，统一为不带时区的交易日
+    trade_date = pd.to_datetime(df['trade_date'])
+    if trade_date.dt.tz is not None:
+        trade_date = trade_date.dt.tz_localize(None)
+    df['trade_date'] = trade_date.dt.normalize()
+    return df
+
+def parse_chart_response(payload):
+    """
+    解析 chart 接口返回的JSON，输出与 normalize_daily_frame 相同的六列数据（前复权，同 auto_adjust）
+    """
+    chart = payload.get('chart') or {}
+    if chart.get('error'):
+        raise ValueError(chart['error'].get('description') or chart['error'])
+    results = chart.get('result') or []
+    if not results or not results[0].get('timestamp'):
+        return None
+    result = results[0]
+    quote = result['indicators']['quote'][0]
+    df = pd.DataFrame({
+        'open': quote.get('open'),
+        'high': quote.get('high'),
+        'low': quote.get('low'),
+        'close': quote.get('close'),
+        'volume': quote.get('volume'),
+    }, dtype='float64')
+    # 时间戳为UTC秒，按交易所时区偏移换算为交易日
+    offset = result.get('meta', {}).get('gmtoffset', 8 * 3600)
+    df.insert(0, 'trade_date', pd.to_datetime(np.asarray(result['timestamp']) + offset, unit='s').normalize())
+    adjclose = result['indicators'].get('adjclose')
+    if adjclose and adjclose[0].get('adjclose'):
+        ratio = np.asarray(adjclose[0]['adjclose'], dtype='float64') / df['close'].to_numpy()
+        for col in ['open', 'high', 'low', 'close']:
+            df[col] = df[col] * ratio
+    df = df.dropna(subset=['close']).drop_duplicates(subset='trade_date', keep='last')
+    return df.reset_index(drop=True) if not df.empty else None
+
+def serve_recorded_charts(record_dir, host='127.0.0.1', port=8765):
+    """
+    本地桩服务器：按 /v8/finance/chart/<代码> 返回 record_dir 中录制的原始响应
+    """
+    if aiohttp is None:
+        raise ImportError("桩服务器需要安装 aiohttp: pip install aiohttp")
+    from aiohttp import web
+    
+    async def handle(request):
+        path = os.path.join(record_dir, f"{request.match_info['symbol']}.json")
+        if not os.path.exists(path):
+            return web.json_response({'chart': {'result': None, 'error': {'code': 'Not Found'}}}, status=404)
+        with open(path, 'rb') as f:
+            return web.Response(body=f.read(), content_type='application/json')
+    
+    app = web.Application()
+    app.router.add_get('/v8/finance/chart/{symbol}', handle)
+    print(f"🧪 桩服务器已启动: http://{host}:{port}/v8/finance/chart/ (数据目录: {record_dir})")
+    web.run_app(app, host=host, port=port, print=None)
+
+HOLIDAY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cn_exchange_holidays.csv')
+EXCHANGE_TZ = 'Asia/Shanghai'
+
+def exchange_now():
+    """交易所当地时间（不带时区），与收盘时间、交易日比较时不受本机时区影响"""
+    return pd.Timestamp.now(tz=EXCHANGE_TZ).tz_localize(None)
+
+class TradingCalendar:
+    """
+    沪深交易所交易日历 - 周一至周五扣除本地维护的休市日（cn_exchange_holidays.csv）
+    """
+    def __init__(self, holiday_file=HOLIDAY_FILE):
+        holidays = pd.read_csv(holiday_file, parse_dates=['date'])['date']
+        self.first_year = int(holidays.dt.year.min())
+        self.last_year = int(holidays.dt.year.max())
+        self.busdaycal = np.busdaycalendar(weekmask='1111100',
+                                           holidays=holidays.values.astype('datetime64[D]'))
+        self.warned = False
+    
+    def _check_range(self, date):
+        if not self.warned and not (self.first_year <= date.year <= self.last_year):
+            print(f"⚠️ {date.year}年不在休市表范围({self.first_year}-{self.last_year})内，按工作日近似")
+            self.warned = True
+    
+    def is_trading_day(self, date):
+        date = pd.Timestamp(date)
+        self._check_range(date)
+        return bool(np.is_busday(np.datetime64(date.date(), 'D'), busdaycal=self.busdaycal))
+    
+    def trading_days(self, start, end):
+        """[start, end] 区间内的全部交易日"""
+        days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D')
+        mask = np.is_busday(days.values.astype('datetime64[D]'), busdaycal=self.busdaycal)
+        return days[mask]
+    
+    def shift(self, date, n):
+        """从 date 所在交易日（非交易日取之前最近一个）起平移 n 个交易日"""
+        date = pd.Timestamp(date)
+        self._check_range(date)
+        shifted = np.busday_offset(np.datetime64(date.date(), 'D'), n, roll='backward', busdaycal=self.busdaycal)
+        return pd.Timestamp(shifted)
+    
+    def last_session(self, now, close_time=(15, 0)):
+        """最近一个已收盘的交易日"""
+        now = pd.Timestamp(now)
+        close = now.normalize() + pd.Timedelta(hours=close_time[0], minutes=close_time[1])
+        if self.is_trading_day(now) and now >= close:
+            return now.normalize()
+        return self.shift(now.normalize(), 0 if not self.is_trading_day(now) else -1)
+
+class OHLCVStore:
+    """
+    本地增量行情库 - 每只ETF一个Parquet文件，另记录每只ETF最近一次联网检查的时间
+    
+    每只ETF下载完即落盘，是中断后重跑的续传机制：文件先写临时文件再原子替换，中途被杀不会留下半截文件；
+    --refresh 的开始时间记录在 refresh_session.json，中断后重跑只重新下载本轮尚未刷新的ETF
+    """
+    def __init__(self, root='ohlcv_store'):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self.meta_file = os.path.join(self.root, 'store_meta.json')
+        self.refresh_file = os.path.join(self.root, 'refresh_session.json')
+        self.lock = threading.Lock()
+        self.meta = {}
+        if os.path.exists(self.meta_file):
+            try:
+                with open(self.meta_file, 'r', encoding='utf-8') as f:
+                    self.meta = json.load(f)
+            except json.JSONDecodeError:
+                # 旧版本非原子写入留下的损坏文件：视为没有覆盖记录，各ETF重新全量下载
+                print(f"⚠️ 行情库元数据损坏，已忽略: {self.meta_file}")
+    
+    @staticmethod
+    def write_json(path, data):
+        """写临时文件后原子替换"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    def path(self, ts_code):
+        return os.path.join(self.root, f'{ts_code}.parquet')
+    
+    def load(self, ts_code):
+        """读取本地行情，不存在时返回None"""
+        path = self.path(ts_code)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path)
+    
+    def save(self, ts_code, df, coverage_start, checked_at):
+        """覆盖写入行情，并记录覆盖起点与检查时间"""
+        df = df.sort_values('trade_date').reset_index(drop=True)
+        tmp_path = f'{self.path(ts_code)}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path(ts_code))
+        with self.lock:
+            self.meta[ts_code] = {
+                'coverage_start': coverage_start.strftime('%Y-%m-%d'),
+                'checked_at': checked_at.strftime('%Y-%m-%d %H:%M:%S.%f')
+            }
+            self.write_json(self.meta_file, self.meta)
+        return df
+    
+    def append(self, ts_code, cached, new_df, coverage_start, checked_at):
+        """将新下载的行情追加到本地，重复日期以新数据为准"""
+        if cached is not None and not cached.empty:
+            frames = [cached] if new_df is None or new_df.empty else [cached, new_df]
+            merged = pd.concat(frames, ignore_index=True)
+            merged = merged.drop_duplicates(subset='trade_date', keep='last')
+        else:
+            merged = new_df
+        return self.save(ts_code, merged, coverage_start, checked_at)
+    
+    def coverage_start(self, ts_code):
+        info = self.meta.get(ts_code)
+        return pd.Timestamp(info['coverage_start']) if info else None
+    
+    def checked_at(self, ts_code):
+        info = self.meta.get(ts_code)
+        return pd.Timestamp(info['checked_at']) if info else None
+    
+    def begin_refresh(self, now):
+        """开始（或接续上次中断的）全量刷新，返回本轮刷新的开始时间"""
+        if os.path.exists(self.refresh_file):
+            with open(self.refresh_file, 'r', encoding='utf-8') as f:
+                return pd.Timestamp(json.load(f)['started_at'])
+        started_at = pd.Timestamp(now)
+        self.write_json(self.refresh_file, {'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S.%f')})
+        return started_at
+    
+    def finish_refresh(self):
+        if os.path.exists(self.refresh_file):
+            os.remove(self.refresh_file)
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+class PricePanel:
+    """
+    对齐的行情面板 - 每个字段一个 float32 矩阵（ETF × 交易日），所有字段共享同一日期轴，缺失为NaN
+    
+    save() 将每个字段写为 .npy，open() 以内存映射方式零拷贝打开，多个进程可同时读取
+    """
+    def __init__(self, symbols, dates, fields):
+        self.symbols = list(symbols)
+        self.dates = pd.DatetimeIndex(dates)
+        self.fields = fields
+        self.symbol_index = {ts_code: i for i, ts_code in enumerate(self.symbols)}
+    
+    @classmethod
+    def from_frames(cls, frames, symbols=None):
+        """由 {ts_code: 日线DataFrame} 构建面板，日期轴为所有ETF交易日的并集"""
+        if symbols is None:
+            symbols = [ts_code for ts_code, df in frames.items() if df is not None]
+        valid = [frames[ts_code] for ts_code in symbols if frames.get(ts_code) is not None]
+        dates = pd.DatetimeIndex(sorted(set().union(*[df['trade_date'] for df in valid]))) \
+            if valid else pd.DatetimeIndex([])
+        fields = {field: np.full((len(symbols), len(dates)), np.nan, dtype=np.float32) for field in PANEL_FIELDS}
+        for i, ts_code in enumerate(symbols):
+            df = frames.get(ts_code)
+            if df is None:
+                continue
+            positions = dates.get_indexer(df['trade_date'])
+            for field in PANEL_FIELDS:
+                fields[field][i, positions] = df[field].to_numpy(dtype=np.float32)
+        return cls(symbols, dates, fields)
+    
+    @classmethod
+    def open(cls, root, mode='r'):
+        """内存映射打开已保存的面板（默认只读）"""
+        with open(os.path.join(root, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        dates = np.load(os.path.join(root, 'dates.npy'))
+        fields = {field: np.load(os.path.join(root, f'{field}.npy'), mmap_mode=mode) for field in meta['fields']}
+        return cls(meta['symbols'], dates, fields)
+    
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        for field, values in self.fields.items():
+            np.save(os.path.join(root, f'{field}.npy'), np.ascontiguousarray(values, dtype=np.float32))
+        np.save(os.path.join(root, 'dates.npy'), self.dates.values.astype('datetime64[D]'))
+        with open(os.path.join(root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'symbols': self.symbols, 'fields': list(self.fields)}, f, ensure_ascii=False)
+    
+    @property
+    def shape(self):
+        return len(self.symbols), len(self.dates)
+    
+    def __getitem__(self, field):
+        return self.fields[field]
+    
+    def slice_dates(self, start, stop):
+        """按交易日位置截取 [start, stop) 的子面板（数组为视图，不复制）"""
+        return PricePanel(self.symbols, self.dates[start:stop],
+                          {field: values[:, start:stop] for field, values in self.fields.items()})
+    
+    def row_digest(self, ts_code, end=None, bars=None):
+        """
+        单只ETF有效K线（日期+五个字段）的内容哈希，不受其他ETF日期的影响
+        
+        end/bars 限定为截至 end 日（含）的最近 bars 根K线
+        """
+        i = self.symbol_index[ts_code]
+        close = np.asarray(self.fields['close'][i])
+        valid = ~np.isnan(close)
+        if end is not None:
+            valid &= self.dates <= pd.Timestamp(end)
+        if bars is not None:
+            valid &= np.cumsum(valid[::-1])[::-1] <= bars
+        digest = hashlib.sha1(self.dates.values[valid].astype('datetime64[D]').tobytes())
+        for field in PANEL_FIELDS:
+            digest.update(np.ascontiguousarray(self.fields[field][i][valid], dtype=np.float32).tobytes())
+        return digest.hexdigest()
+    
+    def frame(self, ts_code):
+        """还原单只ETF的日线DataFrame（去掉无数据的交易日）"""
+        i = self.symbol_index[ts_code]
+        df = pd.DataFrame({'trade_date': self.dates})
+        for field in PANEL_FIELDS:
+            df[field] = np.asarray(self.fields[field][i], dtype=np.float64)
+        return df.dropna(subset=['close']).reset_index(drop=True)
+
+class SharedPricePanel:
+    """
+    把面板各字段复制到共享内存，供进程池中的工作进程按名称挂载，避免逐个进程序列化行情数据
+    
+    with SharedPricePanel(panel) as shared: 把 shared.spec 传给子进程，子进程用 attach(spec) 得到只读面板；
+    退出 with 时释放共享内存
+    """
+    def __init__(self, panel):
+        self.blocks = []
+        self.spec = {'symbols': panel.symbols,
+                     'dates': panel.dates.values.astype('datetime64[D]'),
+                     'fields': {}}
+        for field, values in panel.fields.items():
+            values = np.ascontiguousarray(values, dtype=np.float32)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=np.float32, buffer=block.buf)[:] = values
+            self.blocks.append(block)
+            self.spec['fields'][field] = (block.name, values.shape)
+    
+    @staticmethod
+    def attach(spec):
+        """按 spec 挂载共享内存，返回 (PricePanel, 共享内存句柄列表)，句柄需在使用期间保持引用"""
+        blocks = []
+        fields = {}
+        for field, (name, shape) in spec['fields'].items():
+            block = shared_memory.SharedMemory(name=name)
+            values = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+            values.flags.writeable = False
+            fields[field] = values
+            blocks.append(block)
+        return PricePanel(spec['symbols'], spec['dates'], fields), blocks
+    
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+# 评级结果表的数值列及类型（顺序即输出文件中 ts_code / name 之后的列顺序）；
+# 参与打分与挂单价计算的列用 float64，仅用于展示的列用 float32
+RATING_COLUMNS = {
+    'current_price': np.float64,
+    'prev_close': np.float64,
+    'price_change_pct': np.float32,
+    'momentum_score': np.float64,
+    'volatility': np.float64,
+    'sharpe': np.float64,
+    'trend_quality': np.float64,
+    'atr': np.float64,
+    'mom_1m': np.float32,
+    'mom_3m': np.float32,
+    'mom_6m': np.float32,
+}
+
+class RatingTable:
+    """
+    评级结果表 - 列式存储，每列一个定类型的 numpy 数组；ts_code / name 不逐行保存字符串，
+    只存 ETFUniverse 中的位置（int32），取值共用注册表的数组
+    
+    table['列名'] 取列，table[切片或位置数组] 取子表（切片为视图）
+    """
+    def __init__(self, universe, positions, columns):
+        self.universe = universe
+        self.positions = np.asarray(positions, dtype=np.int32)
+        self.columns = columns
+    
+    @classmethod
+    def empty(cls, universe):
+        return cls(universe, np.empty(0, dtype=np.int32),
+                   {key: np.empty(0, dtype=dtype) for key, dtype in RATING_COLUMNS.items()})
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        return RatingTable(self.universe, self.positions[key],
+                           {name: values[key] for name, values in self.columns.items()})
+    
+    def __setitem__(self, name, values):
+        self.columns[name] = np.asarray(values)
+    
+    @property
+    def ts_codes(self):
+        return self.universe.ts_codes[self.positions]
+    
+    @property
+    def names(self):
+        return self.universe.names[self.positions]
+    
+    def sort_by(self, column, descending=True):
+        """按列稳定排序（降序时得分相同的保持原顺序，与 list.sort(reverse=True) 一致）"""
+        values = self.columns[column]
+        return self[np.argsort(-values if descending else values, kind='stable')]
+    
+    def to_frame(self):
+        return pd.DataFrame({'ts_code': self.ts_codes, 'name': self.names, **self.columns})
+    
+    def write(self, path):
+        """按扩展名写出 CSV（utf-8-sig）或 Parquet"""
+        if path.endswith('.parquet'):
+            self.to_frame().to_parquet(path, index=False)
+        else:
+            self.to_frame().to_csv(path, index=False, encoding='utf-8-sig')
+
+class RatingHistory:
+    """
+    历史评级矩阵 - 交易日 × ETF 的综合得分（float32）和名次（int16，1为最高，0表示当天未参与评级），
+    以及用于回测的日收益率（float32，收盘价对上一根有效收盘价，无K线为NaN）、
+    BASE_FACTORS 的逐日标准化值和 SCORE_FACTORS 的原始值（用于权重扫描与因子IC分析）
+    
+    与 PricePanel 相同的落盘格式：每个矩阵一个 .npy，另有 dates.npy 和 meta.json
+    """
+    def __init__(self, dates, symbols, scores, ranks, returns=None, factor_zscores=None, score_factors=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.symbols = list(symbols)
+        self.scores = scores
+        self.ranks = ranks
+        self.returns = returns if returns is not None else np.full(np.shape(scores), np.nan, dtype=np.float32)
+        # 交易日 × ETF × BASE_FACTORS 的逐日标准化因子
+        self.factor_zscores = factor_zscores if factor_zscores is not None else \
+            np.full(np.shape(scores) + (len(BASE_FACTORS),), np.nan, dtype=np.float32)
+        # 交易日 × ETF × SCORE_FACTORS 的组合因子（标准化前）
+        self.score_factors = score_factors if score_factors is not None else \
+            np.full(np.shape(scores) + (len(SCORE_FACTORS),), np.nan, dtype=np.float32)
+        self.symbol_index = {ts_code: i for i, ts_code in enumerate(self.symbols)}
+    
+    @classmethod
+    def open(cls, root):
+        with open(os.path.join(root, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        optional = {}
+        for name in ['returns', 'factor_zscores', 'score_factors']:
+            path = os.path.join(root, f'{name}.npy')
+            optional[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        return cls(np.load(os.path.join(root, 'dates.npy')), meta['symbols'],
+                   np.load(os.path.join(root, 'scores.npy'), mmap_mode='r'),
+                   np.load(os.path.join(root, 'ranks.npy'), mmap_mode='r'), **optional)
+    
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        np.save(os.path.join(root, 'scores.npy'), np.ascontiguousarray(self.scores, dtype=np.float32))
+        np.save(os.path.join(root, 'ranks.npy'), np.ascontiguousarray(self.ranks, dtype=np.int16))
+        np.save(os.path.join(root, 'returns.npy'), np.ascontiguousarray(self.returns, dtype=np.float32))
+        np.save(os.path.join(root, 'factor_zscores.npy'), np.ascontiguousarray(self.factor_zscores, dtype=np.float32))
+        np.save(os.path.join(root, 'score_factors.npy'), np.ascontiguousarray(self.score_factors, dtype=np.float32))
+        np.save(os.path.join(root, 'dates.npy'), self.dates.values.astype('datetime64[D]'))
+        with open(os.path.join(root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'symbols': self.symbols, 'factors': BASE_FACTORS, 'score_factors': SCORE_FACTORS}, f,
+                      ensure_ascii=False)
+    
+    @property
+    def last_date(self):
+        return self.dates[-1] if len(self.dates) else None
+    
+    def merge(self, other):
+        """用 other 覆盖其起始日及之后的日期，ETF取两者并集"""
+        symbols = self.symbols + [ts_code for ts_code in other.symbols if ts_code not in self.symbol_index]
+        keep = self.dates < other.dates[0]
+        dates = self.dates[keep].append(other.dates)
+        scores = np.full((len(dates), len(symbols)), np.nan, dtype=np.float32)
+        ranks = np.zeros((len(dates), len(symbols)), dtype=np.int16)
+        returns = np.full((len(dates), len(symbols)), np.nan, dtype=np.float32)
+        factor_zscores = np.full((len(dates), len(symbols), len(BASE_FACTORS)), np.nan, dtype=np.float32)
+        score_factors = np.full((len(dates), len(symbols), len(SCORE_FACTORS)), np.nan, dtype=np.float32)
+        n_old = int(keep.sum())
+        scores[:n_old, :len(self.symbols)] = self.scores[keep]
+        ranks[:n_old, :len(self.symbols)] = self.ranks[keep]
+        returns[:n_old, :len(self.symbols)] = self.returns[keep]
+        factor_zscores[:n_old, :len(self.symbols)] = self.factor_zscores[keep]
+        score_factors[:n_old, :len(self.symbols)] = self.score_factors[keep]
+        columns = [symbols.index(ts_code) for ts_code in other.symbols]
+        scores[n_old:, columns] = other.scores
+        ranks[n_old:, columns] = other.ranks
+        returns[n_old:, columns] = other.returns
+        factor_zscores[n_old:, columns] = other.factor_zscores
+        score_factors[n_old:, columns] = other.score_factors
+        return RatingHistory(dates, symbols, scores, ranks, returns, factor_zscores, score_factors)
+    
+    def top(self, date, n=3):
+        """某交易日排名前 n 的 (ts_code, 得分)"""
+        row = self.dates.get_loc(pd.Timestamp(date))
+        ranks = np.asarray(self.ranks[row])
+        order = [i for i in np.argsort(np.where(ranks > 0, ranks, np.iinfo(np.int16).max), kind='stable')[:n]
+                 if ranks[i] > 0]
+        return [(self.symbols[i], float(self.scores[row, i])) for i in order]
+
+def select_top_n(scores, top_n=3, max_weight=0.35):
+    """
+    每个调仓日选出得分最高的 top_n 只ETF，等权且单只不超过 max_weight（余下为现金）
+    
+    scores 形状 (..., K, n)，NaN为未参与评级；返回 (selected, weights)，形状均为 (..., K, top_n)，
+    空位（含ETF总数不足 top_n）的 selected 为 -1、权重为0
+    """
+    filled = np.where(np.isnan(scores), -np.inf, scores)
+    # ETF总数不足 top_n 时先全部入选，再补空位
+    k = min(top_n, filled.shape[-1])
+    if k < top_n:
+        filled = np.concatenate([filled, np.full(filled.shape[:-1] + (top_n - k,), -np.inf)], axis=-1)
+    top = np.argpartition(-filled, top_n - 1, axis=-1)[..., :top_n]
+    top_scores = np.take_along_axis(filled, top, axis=-1)
+    # 组内按得分从高到低排列，便于查看
+    order = np.argsort(-top_scores, axis=-1, kind='stable')
+    top = np.take_along_axis(top, order, axis=-1)
+    valid = np.isfinite(np.take_along_axis(top_scores, order, axis=-1))
+    selected = np.where(valid, top, -1)
+    weights = np.where(valid, min(1.0 / top_n, max_weight), 0.0)
+    return selected, weights
+
+def simulate_rotation(returns, trade_idx, selected, weights, cost_rate=0.001):
+    """
+    轮动组合的逐日模拟，对交易日方向完全向量化，前导维可批量模拟多组配置
+    
+    returns 为 交易日 × ETF 的日收益率（NaN按0计）；trade_idx 为各次调仓成交所在交易日的位置（当日收盘成交），
+    第k期持仓从 trade_idx[k] 的下一交易日开始计收益，期内权重随价格漂移；
+    换手 = Σ|目标权重 - 调仓前漂移后的权重|，成本 = 换手 × cost_rate，在每期第一天扣除
+    返回 {'daily': (..., T), 'nav': (..., T), 'turnover': (..., K)}
+    """
+    returns = np.nan_to_num(np.asarray(returns, dtype=np.float64), nan=0.0)
+    t_len = returns.shape[0]
+    trade_idx = np.asarray(trade_idx)
+    days = np.arange(t_len)
+    segment = np.searchsorted(trade_idx, days, side='left') - 1
+    active = segment >= 0
+    segment = np.maximum(segment, 0)
+    
+    held = selected[..., segment, :]
+    held_weights = weights[..., segment, :]
+    asset_returns = np.where(active[:, np.newaxis] & (held >= 0), returns[days[:, np.newaxis], held], 0.0)
+    
+    # 期内累计增长：对数收益累加后减去上期末的累加值
+    log_growth = np.cumsum(np.log1p(asset_returns), axis=-2)
+    growth = np.exp(log_growth - log_growth[..., trade_idx[segment], :])
+    value = (1 - held_weights.sum(axis=-1)) + (held_weights * growth).sum(axis=-1)
+    
+    # 调仓前（上期末）漂移后的权重
+    period_end = np.concatenate([[0], trade_idx[1:]])
+    end_value = value[..., period_end]
+    prev_weights = np.concatenate([np.zeros_like(weights[..., :1, :]), weights[..., :-1, :]], axis=-2)
+    prev_weights = prev_weights * growth[..., period_end, :] / end_value[..., np.newaxis]
+    prev_selected = np.concatenate([np.full_like(selected[..., :1, :], -1), selected[..., :-1, :]], axis=-2)
+    match = (selected[..., :, np.newaxis] == prev_selected[..., np.newaxis, :]) & (selected[..., :, np.newaxis] >= 0)
+    carried = (match * prev_weights[..., np.newaxis, :]).sum(axis=-1)
+    dropped = np.where(match.any(axis=-2), 0.0, prev_weights).sum(axis=-1)
+    turnover = np.abs(weights - carried).sum(axis=-1) + dropped
+    
+    first_day = active & (days == trade_idx[segment] + 1)
+    prev_value = np.concatenate([np.ones_like(value[..., :1]), value[..., :-1]], axis=-1)
+    prev_value = np.where(first_day, 1.0, prev_value)
+    cost = np.where(first_day, 1 - cost_rate * turnover[..., segment], 1.0)
+    daily = np.where(active, cost * value / prev_value - 1, 0.0)
+    return {'daily': daily, 'nav': np.cumprod(1 + daily, axis=-1), 'turnover': turnover}
+
+def rotation_metrics(daily, turnover, annualization=252):
+    """收益、回撤与换手指标，前导维逐组计算"""
+    nav = np.cumprod(1 + daily, axis=-1)
+    years = daily.shape[-1] / annualization
+    mean = daily.mean(axis=-1)
+    std = daily.std(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.where(std > 0, mean / std * np.sqrt(annualization), np.nan)
+    return {
+        'total_return': nav[..., -1] - 1,
+        'annual_return': nav[..., -1] ** (1 / years) - 1,
+        'annual_volatility': std * np.sqrt(annualization),
+        'sharpe': sharpe,
+        'max_drawdown': (nav / np.maximum.accumulate(nav, axis=-1) - 1).min(axis=-1),
+        'avg_turnover': turnover.mean(axis=-1),
+        'annual_turnover': turnover.sum(axis=-1) / years,
+    }
+
+def sweep_weight_configs(factor_zscores, returns, trade_idx, configs, top_n=3, max_weight=0.35,
+                         cost_rate=0.001, eval_start=0, chunk_size=32, workers=4):
+    """
+    批量评估权重配置：每批配置的得分是一次矩阵乘 (K, n, 8) @ (8, B)，随后批量选股并模拟轮动
+    
+    factor_zscores 为各信号日的基础因子标准化值；各批在线程池中并行（numpy 运算期间释放GIL）；
+    返回各配置的回测指标 {指标名: (C,)}
+    """
+    weights = base_factor_weights(configs)
+    zscores = np.asarray(factor_zscores, dtype=np.float32)
+    
+    def run_chunk(start):
+        batch = weights[start:start + chunk_size].astype(np.float32)
+        scores = np.moveaxis(zscores @ batch.T, -1, 0)
+        selected, position_weights = select_top_n(scores, top_n, max_weight)
+        result = simulate_rotation(returns, trade_idx, selected, position_weights, cost_rate)
+        return rotation_metrics(result['daily'][..., eval_start:], result['turnover'])
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(run_chunk, range(0, len(weights), chunk_size)))
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+def forward_returns(returns, horizon, lag=0):
+    """
+    交易日 × ETF 的前瞻收益：第t行为 (t+lag, t+lag+horizon] 区间的累计收益（NaN日收益按0计），
+    区间超出最后一个交易日时为NaN
+    """
+    returns = np.nan_to_num(np.asarray(returns, dtype=np.float64), nan=0.0)
+    t_len = returns.shape[0]
+    cum = np.concatenate([np.zeros((1,) + returns.shape[1:]), np.cumsum(np.log1p(returns), axis=0)])
+    result = np.full(returns.shape, np.nan)
+    last = t_len - lag - horizon
+    if last > 0:
+        result[:last] = np.expm1(cum[lag + horizon + 1:] - cum[lag + 1:lag + 1 + last])
+    return result
+
+def rank_ic(factor, forward, min_count=10):
+    """
+    逐日截面秩相关（Spearman rank IC），交易日 × ETF 矩阵一次排名（并列取平均名次）；
+    两者都有值的ETF少于 min_count 的交易日为NaN
+    """
+    valid = ~np.isnan(factor) & ~np.isnan(forward)
+    count = valid.sum(axis=1)
+    x = stats.rankdata(np.where(valid, factor, np.nan), axis=1, nan_policy='omit')
+    y = stats.rankdata(np.where(valid, forward, np.nan), axis=1, nan_policy='omit')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 有效值的名次为 1..count，均值为 (count+1)/2
+        center = ((count + 1) / 2)[:, np.newaxis]
+        x = np.where(valid, x - center, 0.0)
+        y = np.where(valid, y - center, 0.0)
+        ic = (x * y).sum(axis=1) / np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1))
+    return np.where(count >= min_count, ic, np.nan)
+
+def quantile_returns(factor, forward, quantiles=5, min_count=10):
+    """按因子逐日分成 quantiles 组（第0组因子最低），返回各组等权前瞻收益 (T, quantiles)"""
+    valid = ~np.isnan(factor) & ~np.isnan(forward)
+    count = valid.sum(axis=1)
+    ranks = stats.rankdata(np.where(valid, factor, np.nan), axis=1, nan_policy='omit', method='ordinal')
+    with np.errstate(invalid='ignore'):
+        bucket = np.where(valid, (ranks - 1) * quantiles // np.maximum(count, 1)[:, np.newaxis], -1)
+    result = np.full((len(factor), quantiles), np.nan)
+    values = np.where(valid, forward, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for q in range(quantiles):
+            members = bucket == q
+            result[:, q] = (values * members).sum(axis=1) / members.sum(axis=1)
+    result[count < min_count] = np.nan
+    return result
+
+class FactorAnalytics:
+    """
+    因子有效性分析 - 各因子逐日的 rank IC（按持有期）与分组收益，随历史评级增量更新
+    
+    ic 形状 交易日 × 因子 × 持有期，quantiles 形状 交易日 × 因子 × 分组（1日前瞻收益）；
+    更新时只重算新增交易日和此前前瞻区间未走完的交易日，digest 为计算所用因子值与收益率的内容哈希，
+    历史评级被改写（重新回填、数据修正）时哈希不符，全部重算
+    """
+    def __init__(self, dates, factors, horizons, lag, ic, quantiles, digest=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.factors = list(factors)
+        self.horizons = list(horizons)
+        self.lag = lag
+        self.ic = ic
+        self.quantiles = quantiles
+        self.digest = digest
+    
+    @classmethod
+    def open(cls, root):
+        with open(os.path.join(root, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(np.load(os.path.join(root, 'dates.npy')), meta['factors'], meta['horizons'], meta['lag'],
+                   np.load(os.path.join(root, 'ic.npy')), np.load(os.path.join(root, 'quantiles.npy')),
+                   meta.get('digest'))
+    
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        np.save(os.path.join(root, 'ic.npy'), np.ascontiguousarray(self.ic))
+        np.save(os.path.join(root, 'quantiles.npy'), np.ascontiguousarray(self.quantiles))
+        np.save(os.path.join(root, 'dates.npy'), self.dates.values.astype('datetime64[D]'))
+        with open(os.path.join(root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'factors': self.factors, 'horizons': self.horizons, 'lag': self.lag, 'digest': self.digest},
+                      f, ensure_ascii=False)
+    
+    @staticmethod
+    def input_digest(factor_values, returns, rows):
+        """前 rows 个交易日的因子值与收益率（含ETF列数）的内容哈希"""
+        digest = hashlib.sha1()
+        for values in list(factor_values.values()) + [returns]:
+            values = np.ascontiguousarray(values[:rows], dtype=np.float64)
+            digest.update(str(values.shape).encode('utf-8'))
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+    
+    @classmethod
+    def update(cls, previous, dates, factor_values, returns, horizons=(1, 5, 20), lag=1, quantiles=5):
+        """
+        factor_values 为 {因子名: 交易日 × ETF 矩阵}；previous 与本次的日期、因子、参数以及
+        previous 覆盖区间的输入内容（digest）都一致时，沿用其前瞻区间已完整的交易日，返回 (新结果, 重算的起始位置)
+        """
+        dates = pd.DatetimeIndex(dates)
+        factors = list(factor_values)
+        t_len = len(dates)
+        start = 0
+        if (previous is not None and previous.factors == factors and previous.horizons == list(horizons)
+                and previous.lag == lag and previous.quantiles.shape[2] == quantiles
+                and len(previous.dates) <= t_len and previous.dates.equals(dates[:len(previous.dates)])
+                and previous.digest == cls.input_digest(factor_values, returns, len(previous.dates))):
+            start = max(0, len(previous.dates) - lag - max(horizons))
+        ic = np.full((t_len, len(factors), len(horizons)), np.nan)
+        groups = np.full((t_len, len(factors), quantiles), np.nan)
+        if start:
+            ic[:start] = previous.ic[:start]
+            groups[:start] = previous.quantiles[:start]
+        
+        forward = {h: forward_returns(returns, h, lag)[start:] for h in horizons}
+        for f, values in enumerate(factor_values.values()):
+            values = np.asarray(values[start:], dtype=np.float64)
+            for k, h in enumerate(horizons):
+                ic[start:, f, k] = rank_ic(values, forward[h])
+            groups[start:, f] = quantile_returns(values, forward[horizons[0]], quantiles)
+        return cls(dates, factors, horizons, lag, ic, groups, cls.input_digest(factor_values, returns, t_len)), start
+    
+    def summary(self, annualization=252):
+        """
+        每个因子一行：各持有期 IC 均值（IC衰减）、IC信息比率（均值/标准差）、IC为正的比例，
+        各组年化收益及最高组减最低组的多空收益
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(self.ic, axis=0)
+            std = np.nanstd(self.ic, axis=0)
+            positive = (self.ic > 0).sum(axis=0) / np.maximum((~np.isnan(self.ic)).sum(axis=0), 1)
+            group_mean = np.nanmean(self.quantiles, axis=0) * annualization
+        report = pd.DataFrame({'factor': self.factors})
+        for k, h in enumerate(self.horizons):
+            report[f'ic_{h}d'] = mean[:, k]
+        for k, h in enumerate(self.horizons):
+            report[f'ic_ir_{h}d'] = mean[:, k] / std[:, k]
+        report[f'ic_positive_{self.horizons[0]}d'] = positive[:, 0]
+        for q in range(group_mean.shape[1]):
+            report[f'q{q + 1}_annual'] = group_mean[:, q]
+        report['long_short_annual'] = group_mean[:, -1] - group_mean[:, 0]
+        return report
+
+def standardized_returns(close, window=120, min_periods=None):
+    """
+    最近 window 个日收益率逐行去均值并缩放为单位长度（缺失按0），返回 (z, usable)；
+    有效收益率少于 min_periods（默认 window 的一半）或无波动的ETF不可用，其行为0
+    """
+    min_periods = min_periods or window // 2
+    close = np.asarray(close, dtype=np.float64)[:, -(window + 1):]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = close[:, 1:] / close[:, :-1] - 1
+    valid = ~np.isnan(returns)
+    count = valid.sum(axis=1)
+    mean = np.where(valid, returns, 0.0).sum(axis=1) / np.maximum(count, 1)
+    centered = np.where(valid, returns - mean[:, np.newaxis], 0.0)
+    norm = np.sqrt((centered ** 2).sum(axis=1))
+    usable = (count >= min_periods) & (norm > 0)
+    z = np.where(usable[:, np.newaxis], centered / np.where(usable, norm, 1)[:, np.newaxis], 0.0)
+    return z.astype(np.float32), usable
+
+def correlation_matrix(close, window=120, min_periods=None):
+    """
+    ETF两两收益率相关系数：标准化收益率矩阵一次矩阵乘 z @ z.T 得到
+    
+    缺失日按0参与计算，相关系数会略微偏向0（对去重而言偏保守）；不可用的ETF所在行列为0
+    """
+    z, usable = standardized_returns(close, window, min_periods)
+    return z @ z.T, usable
+
+def correlation_clusters(corr, usable, threshold=0.9):
+    """
+    按相关系数阈值聚类（全连接：同一簇内任意两只ETF的相关系数都不低于 threshold），
+    返回每只ETF的簇编号（0起连续编号），不可用的ETF各自成簇
+    """
+    n = len(corr)
+    labels = np.arange(n)
+    rows = np.flatnonzero(usable)
+    if len(rows) > 1:
+        distance = np.clip(1 - np.asarray(corr, dtype=np.float64)[np.ix_(rows, rows)], 0, 2)
+        distance = (distance + distance.T) / 2
+        np.fill_diagonal(distance, 0)
+        tree = hierarchy.linkage(squareform(distance, checks=False), method='complete')
+        labels[rows] = n + hierarchy.fcluster(tree, t=1 - threshold, criterion='distance')
+    return np.unique(labels, return_inverse=True)[1]
+
+def _ffill_2d(values):
+    """沿交易日方向（axis=1）前向填充NaN"""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = np.take_along_axis(values, idx, axis=1)
+    filled[~np.maximum.accumulate(valid, axis=1)] = np.nan
+    return filled
+
+def _prev_valid(values):
+    """每个位置之前最近一个有效值"""
+    prev = np.full_like(values, np.nan)
+    prev[:, 1:] = _ffill_2d(values)[:, :-1]
+    return prev
+
+def _next_valid(values):
+    """每个位置之后最近一个有效值"""
+    return _prev_valid(values[:, ::-1])[:, ::-1]
+
+def clean_price_panel(panel, max_abs_return=0.25, stale_days=5):
+    """
+    向量化数据质量检查与修复，一次处理整个面板，返回 (修复后的面板, 每只ETF的问题计数表)
+    
+    - 非正价格：收盘价<=0 的K线剔除；开/高/低价<=0 用收盘价代替
+    - 高低价异常：high<low 或未包住开收盘价时，按四价重设最高/最低价
+    - 停牌：成交量为0且收盘价与前一根相同的K线剔除（yfinance 对停牌日的填充）
+    - 收盘价长时间不变：连续 stale_days 根相同收盘价，只标记
+    - 异常收益：单日涨跌幅超过 max_abs_return 标记；次日反向回归的单根尖峰剔除
+    """
+    o, h, l, c, v = (np.array(panel[field], dtype=np.float32) for field in PANEL_FIELDS)
+    present = ~np.isnan(c)
+    
+    # 1. 非正价格
+    drop = present & ~(c > 0)
+    non_positive = drop.copy()
+    for values in (o, h, l):
+        bad = present & ~drop & ~(values > 0)
+        values[bad] = c[bad]
+        non_positive |= bad
+    
+    # 2. 高低价异常
+    bad_high_low = present & ~drop & ((h < l) | (h < np.fmax(o, c)) | (l > np.fmin(o, c)))
+    h, l = (np.where(bad_high_low, np.fmax(np.fmax(o, h), np.fmax(l, c)), h),
+            np.where(bad_high_low, np.fmin(np.fmin(o, h), np.fmin(l, c)), l))
+    
+    # 3. 停牌填充
+    close = np.where(drop, np.nan, c)
+    prev_close = _prev_valid(close)
+    suspended = present & ~drop & (v == 0) & (c == prev_close)
+    drop |= suspended
+    
+    # 4. 收盘价长时间不变
+    close = np.where(drop, np.nan, c)
+    prev_close = _prev_valid(close)
+    same = close == prev_close
+    idx = np.arange(close.shape[1])
+    last_change = np.maximum.accumulate(np.where(same, -1, idx), axis=1)
+    stale = same & (idx - last_change >= stale_days - 1)
+    
+    # 5. 异常收益与单根尖峰
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ret = close / prev_close - 1
+        ret_next = _next_valid(close) / close - 1
+    outlier = np.abs(ret) > max_abs_return
+    spike = outlier & (np.abs(ret_next) > max_abs_return) & (np.sign(ret) != np.sign(ret_next))
+    drop |= spike
+    
+    fields = {'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}
+    for values in fields.values():
+        values[drop] = np.nan
+    
+    report = pd.DataFrame({
+        'non_positive': non_positive.sum(axis=1),
+        'bad_high_low': bad_high_low.sum(axis=1),
+        'suspended': suspended.sum(axis=1),
+        'stale_close': stale.sum(axis=1),
+        'outlier_return': outlier.sum(axis=1),
+        'spike_removed': spike.sum(axis=1),
+        'valid_bars': (~np.isnan(c)).sum(axis=1),
+    }, index=pd.Index(panel.symbols, name='ts_code'))
+    return PricePanel(panel.symbols, panel.dates, fields), report
+
+def right_align_panel(values, order=None):
+    """
+    把每只ETF的有效K线移到矩阵右端并保持先后顺序，使最后一列为各自的最新K线
+    
+    等价于逐只ETF去掉缺失日后按位置取数（.iloc[-p]），短历史的缺口集中在左侧为NaN；
+    order 为按收盘价算出的排列，传入时其他字段按同一排列对齐
+    """
+    if order is None:
+        order = np.argsort(~np.isnan(values), axis=1, kind='stable')
+    return np.take_along_axis(values, order, axis=1), order
+
+def _rolling_sum(values, window):
+    """沿 axis=1 的滚动求和，窗口内有NaN或不足 window 时为NaN"""
+    n, t = values.shape
+    out = np.full((n, t), np.nan)
+    if t < window:
+        return out
+    zero_filled = np.concatenate([np.zeros((n, 1)), np.cumsum(np.nan_to_num(values), axis=1)], axis=1)
+    nan_count = np.concatenate([np.zeros((n, 1)), np.cumsum(np.isnan(values), axis=1)], axis=1)
+    sums = zero_filled[:, window:] - zero_filled[:, :-window]
+    has_nan = (nan_count[:, window:] - nan_count[:, :-window]) > 0
+    out[:, window - 1:] = np.where(has_nan, np.nan, sums)
+    return out
+
+def ols_slope(values, period=60, rolling=False):
+    """
+    以 arange(period) 为自变量的OLS斜率及R²，所有ETF一次矩阵-向量乘完成
+    
+    斜率是窗口内数值的固定线性组合 w·y，w = (x - x̄) / Σ(x - x̄)²；
+    rolling=False 时取每行最后 period 个值，返回形状 (n,)；
+    rolling=True 时对每个截止日计算，返回形状与输入相同（前 period-1 列为NaN）
+    窗口内有NaN时斜率为NaN，窗口内数值恒定时R²为NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, t = values.shape
+    x = np.arange(period, dtype=np.float64)
+    centered = x - x.mean()
+    sxx = np.sum(centered ** 2)
+    weights = centered / sxx
+    
+    if not rolling:
+        if t < period:
+            return np.full(n, np.nan), np.full(n, np.nan)
+        window = values[:, -period:]
+        slope = window @ weights
+        syy = np.sum((window - window.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    else:
+        slope = np.full((n, t), np.nan)
+        syy = np.full((n, t), np.nan)
+        if t < period:
+            return slope, syy
+        windows = np.lib.stride_tricks.sliding_window_view(values, period, axis=1)
+        # 分块计算，长历史面板上窗口展开后的临时内存保持在数十MB
+        chunk = max(1, 2 ** 22 // max(t * period, 1))
+        for i in range(0, n, chunk):
+            block = windows[i:i + chunk]
+            slope[i:i + chunk, period - 1:] = block @ weights
+            syy[i:i + chunk, period - 1:] = np.sum((block - block.mean(axis=2, keepdims=True)) ** 2, axis=2)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r2 = np.where(syy > 0, np.clip(slope ** 2 * sxx / syy, 0, 1), np.nan)
+    return slope, r2
+
+WILDER_STATE_FIELDS = ['bar', 'prev_high', 'prev_low', 'prev_close', 'trs', 'dip', 'din',
+                       'atr', 'adx', 'plus_di', 'minus_di']
+
+def wilder_state(n):
+    """n只ETF的Wilder递推初始状态（bar 为已处理的有效K线序号，-1表示尚无数据）"""
+    state = {field: np.zeros(n) for field in WILDER_STATE_FIELDS}
+    state['bar'] = np.full(n, -1, dtype=np.int64)
+    for field in ['prev_high', 'prev_low', 'prev_close', 'plus_di', 'minus_di']:
+        state[field] = np.full(n, np.nan)
+    return state
+
+def wilder_update(state, h, l, c, period=14):
+    """
+    用一根新K线推进Wilder递推，全部ETF一次向量化完成；缺失的ETF保持原状态
+    
+    返回 (valid, k)：本步有数据的ETF掩码及其K线序号
+    """
+    w = float(period)
+    prev_high, prev_low, prev_close = state['prev_high'], state['prev_low'], state['prev_close']
+    trs, dip, din, atr, adx = state['trs'], state['dip'], state['din'], state['atr'], state['adx']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = ~(np.isnan(h) | np.isnan(l) | np.isnan(c))
+        state['bar'] = state['bar'] + valid
+        k = np.where(valid, state['bar'], -1)
+        has_prev = k >= 1
+        
+        # ADX使用的真实波幅与方向变动（首根K线无前值，不参与累加）
+        tr_dm = np.where(has_prev, np.maximum(h, prev_close) - np.minimum(l, prev_close), 0)
+        up = h - prev_high
+        down = prev_low - l
+        pos = np.where(has_prev & (up > down) & (up > 0), up, 0)
+        neg = np.where(has_prev & (down > up) & (down > 0), down, 0)
+        
+        accumulate = (k >= 1) & (k <= period)
+        smooth = k > period
+        trs = np.where(accumulate, trs + tr_dm, np.where(smooth, trs - trs / w + tr_dm, trs))
+        dip = np.where(accumulate, dip + pos, np.where(smooth, dip - dip / w + pos, dip))
+        din = np.where(accumulate, din + neg, np.where(smooth, din - din / w + neg, din))
+        
+        di_ready = k >= period
+        pdi = np.where(trs != 0, 100 * dip / trs, 0)
+        mdi = np.where(trs != 0, 100 * din / trs, 0)
+        dx = np.where(pdi + mdi != 0, 100 * np.abs((pdi - mdi) / (pdi + mdi)), 0)
+        state['plus_di'] = np.where(di_ready, pdi, state['plus_di'])
+        state['minus_di'] = np.where(di_ready, mdi, state['minus_di'])
+        
+        adx_seed = (k >= period) & (k < 2 * period - 1)
+        adx_init = k == 2 * period - 1
+        adx_smooth = k > 2 * period - 1
+        adx = np.where(adx_seed, adx + dx,
+              np.where(adx_init, (adx + dx) / w,
+              np.where(adx_smooth, (adx * (w - 1) + dx) / w, adx)))
+        
+        # ATR的真实波幅首根K线取 high - low
+        tr_atr = np.where(has_prev,
+                          np.fmax(h - l, np.fmax(np.abs(h - prev_close), np.abs(l - prev_close))),
+                          h - l)
+        atr_seed = (k >= 0) & (k < period - 1)
+        atr_init = k == period - 1
+        atr_smooth = k > period - 1
+        atr = np.where(atr_seed, atr + tr_atr,
+              np.where(atr_init, (atr + tr_atr) / w,
+              np.where(atr_smooth, (atr * (w - 1) + tr_atr) / w, atr)))
+    
+    state.update(trs=trs, dip=dip, din=din, atr=atr, adx=adx,
+                 prev_high=np.where(valid, h, prev_high),
+                 prev_low=np.where(valid, l, prev_low),
+                 prev_close=np.where(valid, c, prev_close))
+    return valid, k
+
+def wilder_values(state, period=14):
+    """当前状态下的 ADX / +DI / -DI / ATR，未满足起算条件为NaN"""
+    bar = state['bar']
+    return {
+        'adx': np.where(bar >= 2 * period - 1, state['adx'], np.nan),
+        'plus_di': np.where(bar >= period, state['plus_di'], np.nan),
+        'minus_di': np.where(bar >= period, state['minus_di'], np.nan),
+        'atr': np.where(bar >= period - 1, state['atr'], np.nan),
+    }
+
+def wilder_adx_atr(high, low, close, period=14, history=False):
+    """
+    Wilder平滑的 ADX / +DI / -DI / ATR，按时间推进、每步对全部ETF向量化计算
+    
+    各指标的起算位置和平滑方式与 ta 库的 ADXIndicator、AverageTrueRange 一致：
+    TR/+DM/-DM 从第2根K线起累加 period 根后按 Wilder 方式递推，ADX 取前 period 个DX的均值后递推，
+    ATR 取前 period 个真实波幅的均值后递推
+    每行的缺失K线（左侧短历史或停牌）直接跳过，等价于逐只ETF去掉缺失日后计算；
+    history=False 返回每只ETF最后一根有效K线的值 (n,)，history=True 返回 (n, T)，未满足起算条件处为NaN
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    n, t_len = close.shape
+    state = wilder_state(n)
+    if history:
+        out = {key: np.full((n, t_len), np.nan) for key in ['adx', 'plus_di', 'minus_di', 'atr']}
+    
+    for t in range(t_len):
+        valid, _ = wilder_update(state, high[:, t], low[:, t], close[:, t], period)
+        if history:
+            for key, values in wilder_values(state, period).items():
+                out[key][:, t] = np.where(valid, values, np.nan)
+    
+    if history:
+        return out
+    return wilder_values(state, period)
+
+# 权重扫描使用的基础因子（波动率取负值，均为越大越好），逐日标准化后按线性权重打分
+BASE_FACTORS = ['mom_1m', 'mom_3m', 'mom_6m', 'slope', 'volatility', 'sharpe', 'adx', 'ma200_filter']
+
+# 可扫描的权重，与 CompleteETFDailyRating 的同名属性对应
+SWEEP_WEIGHT_NAMES = ['weight_momentum', 'weight_volatility', 'weight_risk_adjusted', 'weight_trend_quality',
+                      'weight_mom_1m', 'weight_mom_3m', 'weight_mom_6m', 'weight_adx', 'weight_ma200']
+
+def base_factor_weights(configs):
+    """
+    把 (C, 9) 的权重配置（SWEEP_WEIGHT_NAMES 顺序）展开为 BASE_FACTORS 上的 (C, 8) 线性权重
+    
+    动量得分 = 0.7·(1/3/6月动量加权) + 0.3·斜率，趋势质量 = ADX与200日均线加权，与 composite_factors 的组合方式相同
+    """
+    configs = np.atleast_2d(np.asarray(configs, dtype=np.float64))
+    momentum, volatility, sharpe, trend, mom_1m, mom_3m, mom_6m, adx, ma200 = configs.T
+    return np.stack([momentum * 0.7 * mom_1m, momentum * 0.7 * mom_3m, momentum * 0.7 * mom_6m,
+                     momentum * 0.3, volatility, sharpe, trend * adx, trend * ma200], axis=1)
+
+def sample_weight_configs(n, seed=0, baseline=None):
+    """
+    随机生成 n 组权重：四大类权重与动量子权重各自在单纯形上均匀分布，ADX/均线权重和为1；
+    baseline 给定时作为第0组
+    """
+    rng = np.random.default_rng(seed)
+    top = rng.dirichlet(np.ones(4), n)
+    momentum = rng.dirichlet(np.ones(3), n)
+    adx = rng.uniform(0, 1, (n, 1))
+    configs = np.hstack([top, momentum, adx, 1 - adx])
+    if baseline is not None:
+        configs[0] = baseline
+    return configs
+
+# 参与综合打分的组合因子（历史评级中保存原始值，波动率为正向数值）
+SCORE_FACTORS = ['momentum_score', 'volatility', 'sharpe', 'trend_quality']
+
+# 滚动验证时参与比较的因子窗口组合（默认窗口在第0组）
+WALK_FORWARD_WINDOWS = [
+    {'momentum_periods': (20, 60, 120), 'vol_period': 60, 'slope_period': 60},
+    {'momentum_periods': (10, 40, 90), 'vol_period': 40, 'slope_period': 40},
+    {'momentum_periods': (30, 90, 180), 'vol_period': 90, 'slope_period': 90},
+]
+
+class PanelFactorEngine:
+    """
+    面板因子引擎 - 以 ETF × 交易日 矩阵一次性计算全部ETF的动量、波动率、夏普、趋势斜率、200日均线以及ADX/ATR
+    
+    latest() 输入右对齐的收盘价（见 right_align_panel），结果与逐只ETF的 calculate_* 函数一致；
+    history() 输入按日期对齐的收盘价，给出每个交易日的因子值（窗口内有缺失即为NaN）
+    同时传入最高价和最低价时附带 adx / plus_di / minus_di / atr
+    """
+    def __init__(self, momentum_periods=(20, 60, 120), vol_period=60, slope_period=60, ma_period=200,
+                 adx_period=14, annualization=252):
+        self.momentum_periods = momentum_periods
+        self.vol_period = vol_period
+        self.slope_period = slope_period
+        self.adx_period = adx_period
+        self.ma_period = ma_period
+        self.annualization = annualization
+    
+    def latest(self, close, high=None, low=None):
+        close = np.asarray(close, dtype=np.float64)
+        n, t = close.shape
+        last = close[:, -1]
+        result = {}
+        for label, p in zip(['mom_1m', 'mom_3m', 'mom_6m'], self.momentum_periods):
+            result[label] = last / close[:, -p] - 1 if t >= p else np.full(n, np.nan)
+        
+        # 最近 vol_period 个收益率，历史不足时窗口内含NaN，结果自然为NaN
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = close[:, 1:] / close[:, :-1] - 1
+            if returns.shape[1] >= self.vol_period:
+                window = returns[:, -self.vol_period:]
+                mean = window.mean(axis=1)
+                std = window.std(axis=1)
+            else:
+                mean = std = np.full(n, np.nan)
+            result['volatility'] = std * np.sqrt(self.annualization)
+            result['sharpe'] = np.where(std == 0, np.nan, mean / std * np.sqrt(self.annualization))
+            result['slope'], result['slope_r2'] = ols_slope(np.log(close), self.slope_period)
+            
+            if t >= self.ma_period:
+                ma = close[:, -self.ma_period:].mean(axis=1)
+                result['ma200_filter'] = np.where(np.isnan(ma), np.nan, (last > ma).astype(np.float64))
+            else:
+                result['ma200_filter'] = np.full(n, np.nan)
+        if high is not None and low is not None:
+            result.update(wilder_adx_atr(high, low, close, self.adx_period))
+        return result
+    
+    def history(self, close, high=None, low=None):
+        close = np.asarray(close, dtype=np.float64)
+        n, t = close.shape
+        result = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for label, p in zip(['mom_1m', 'mom_3m', 'mom_6m'], self.momentum_periods):
+                mom = np.full((n, t), np.nan)
+                if t >= p:
+                    mom[:, p - 1:] = close[:, p - 1:] / close[:, :t - p + 1] - 1
+                result[label] = mom
+            
+            returns = np.full((n, t), np.nan)
+            returns[:, 1:] = close[:, 1:] / close[:, :-1] - 1
+            k = self.vol_period
+            mean = _rolling_sum(returns, k) / k
+            # 方差 = E[r²] - E[r]²，收益率量级很小，浮点抵消误差可忽略
+            var = np.maximum(_rolling_sum(returns ** 2, k) / k - mean ** 2, 0)
+            std = np.sqrt(var)
+            result['volatility'] = std * np.sqrt(self.annualization)
+            result['sharpe'] = np.where(std == 0, np.nan, mean / std * np.sqrt(self.annualization))
+            result['slope'], result['slope_r2'] = ols_slope(np.log(close), self.slope_period, rolling=True)
+            
+            ma = _rolling_sum(close, self.ma_period) / self.ma_period
+            result['ma200_filter'] = np.where(np.isnan(ma), np.nan, (close > ma).astype(np.float64))
+        if high is not None and low is not None:
+            result.update(wilder_adx_atr(high, low, close, self.adx_period, history=True))
+        return result
+
+def cross_sectional_normalize(values, limits=(0.05, 0.05), axis=0):
+    """
+    截面去极值 + 标准化，一次处理整个因子矩阵
+    
+    axis 为截面（ETF）所在的轴，其余轴逐列独立处理：ETF × 因子矩阵即逐因子标准化，
+    ETF × 交易日（或 ETF × 交易日 × 因子）的历史面板即逐日标准化
+    去极值与 scipy.stats.mstats.winsorize 一致：按有效值排序，两端各 int(limit·m) 个截断到相邻次序统计量；
+    标准差为总体标准差；NaN保持NaN；有效值不足2个的列原样返回，标准差为0的列全部为0
+    """
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    valid = ~np.isnan(values)
+    m = valid.sum(axis=0)
+    
+    # NaN 排在最后，前 m 个为升序的有效值
+    ordered = np.sort(values, axis=0)
+    low_idx = (limits[0] * m).astype(np.int64)
+    up_idx = m - (limits[1] * m).astype(np.int64)
+    lower = np.take_along_axis(ordered, np.minimum(low_idx, np.maximum(m - 1, 0))[np.newaxis], axis=0)
+    upper = np.take_along_axis(ordered, np.maximum(up_idx - 1, 0)[np.newaxis], axis=0)
+    clipped = np.clip(values, lower, upper)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = np.maximum(m, 1)
+        mean = np.where(valid, clipped, 0).sum(axis=0) / count
+        std = np.sqrt(np.where(valid, (clipped - mean) ** 2, 0).sum(axis=0) / count)
+        z = (clipped - mean) / std
+    z = np.where(std == 0, 0.0, z)
+    z = np.where(m < 2, values, z)
+    return np.moveaxis(z, 0, axis)
+
+class FactorState:
+    """
+    增量因子状态 - 为每只ETF保存Wilder递推量、收益率滚动和与平方和、收盘价环形缓冲区和斜率回归矩，
+    每来一根新K线以 O(1) 更新全部因子，结果与 PanelFactorEngine 在同一段K线上的计算一致
+    
+    ADX/ATR 为无限记忆的递推，增量更新相当于从首次构建时起持续平滑，与按固定回看窗口重算仅有极小差异；
+    数据修正或参数变化时需对相应ETF重建（reset 后从面板重新灌入K线）
+    """
+    def __init__(self, symbols, momentum_periods=(20, 60, 120), vol_period=60, slope_period=60,
+                 ma_period=200, adx_period=14, annualization=252):
+        self.momentum_periods = tuple(momentum_periods)
+        self.vol_period = vol_period
+        self.slope_period = slope_period
+        self.ma_period = ma_period
+        self.adx_period = adx_period
+        self.annualization = annualization
+        # 环形缓冲区需覆盖动量、均线的最长回看以及斜率窗口移出的那根K线
+        self.ring_size = max(ma_period, max(self.momentum_periods), slope_period + 1)
+        self.symbols = []
+        self.symbol_index = {}
+        self.arrays = {}
+        self.wilder = wilder_state(0)
+        self.add_symbols(symbols)
+    
+    def config(self):
+        return {
+            'momentum_periods': list(self.momentum_periods),
+            'vol_period': self.vol_period,
+            'slope_period': self.slope_period,
+            'ma_period': self.ma_period,
+            'adx_period': self.adx_period,
+            'annualization': self.annualization,
+        }
+    
+    def _initial_arrays(self, n):
+        arrays = {
+            'closes': np.full((n, self.ring_size), np.nan),
+            'returns': np.full((n, self.vol_period), np.nan),
+            'count': np.zeros(n, dtype=np.int64),
+            'last_date': np.full(n, np.datetime64('NaT'), dtype='datetime64[D]'),
+            'check_digest': np.full(n, '', dtype='<U40'),
+        }
+        for field in ['sum_ma', 'sum_ret', 'sumsq_ret', 'sum_y', 'sumsq_y', 'sum_xy']:
+            arrays[field] = np.zeros(n)
+        return arrays
+    
+    def add_symbols(self, symbols):
+        """追加尚未跟踪的ETF（初始为空状态）"""
+        new_symbols = [ts_code for ts_code in dict.fromkeys(symbols) if ts_code not in self.symbol_index]
+        if not new_symbols:
+            return
+        fresh = self._initial_arrays(len(new_symbols))
+        self.arrays = {key: np.concatenate([self.arrays[key], fresh[key]]) if self.arrays else fresh[key]
+                       for key in fresh}
+        fresh_wilder = wilder_state(len(new_symbols))
+        self.wilder = {key: np.concatenate([self.wilder[key], fresh_wilder[key]]) for key in fresh_wilder}
+        self.symbols.extend(new_symbols)
+        self.symbol_index = {ts_code: i for i, ts_code in enumerate(self.symbols)}
+    
+    def reset(self, rows):
+        """清空指定行的状态，用于全量重建"""
+        fresh = self._initial_arrays(len(rows))
+        for key, values in fresh.items():
+            self.arrays[key][rows] = values
+        fresh_wilder = wilder_state(len(rows))
+        for key, values in fresh_wilder.items():
+            self.wilder[key][rows] = values
+    
+    def update(self, high, low, close, date):
+        """
+        推进一根K线：high/low/close 为全部ETF在 date 的取值，NaN表示该ETF本步没有新K线
+        """
+        a = self.arrays
+        close = np.asarray(close, dtype=np.float64)
+        high = np.asarray(high, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64)
+        valid = ~(np.isnan(close) | np.isnan(high) | np.isnan(low))
+        idx = np.flatnonzero(valid)
+        if len(idx) == 0:
+            return
+        c = close[idx]
+        cnt = a['count'][idx]
+        ring = a['closes']
+        size = self.ring_size
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # 200日均线：加入新收盘价，移出窗口外的那一根
+            leaving = np.where(cnt >= self.ma_period, ring[idx, (cnt - self.ma_period) % size], 0)
+            a['sum_ma'][idx] += c - leaving
+            
+            # 收益率滚动和与平方和
+            has_prev = cnt >= 1
+            prev = ring[idx, (cnt - 1) % size]
+            r = c / prev - 1
+            r_count = cnt - 1
+            r_slot = np.maximum(r_count, 0) % self.vol_period
+            old_r = np.where(r_count >= self.vol_period, a['returns'][idx, r_slot], 0)
+            a['sum_ret'][idx] += np.where(has_prev, r - old_r, 0)
+            a['sumsq_ret'][idx] += np.where(has_prev, r ** 2 - old_r ** 2, 0)
+            a['returns'][idx[has_prev], r_slot[has_prev]] = r[has_prev]
+            
+            # 斜率回归矩：窗口满后整体左移一位，Σxy' = Σxy - (Σy - y_old) + (S-1)·y_new
+            y = np.log(c)
+            full = cnt >= self.slope_period
+            y_old = np.where(full, np.log(ring[idx, (cnt - self.slope_period) % size]), 0)
+            sum_y = a['sum_y'][idx]
+            a['sum_xy'][idx] = np.where(full,
+                                        a['sum_xy'][idx] - (sum_y - y_old) + (self.slope_period - 1) * y,
+                                        a['sum_xy'][idx] + cnt * y)
+            a['sum_y'][idx] = sum_y + y - y_old
+            a['sumsq_y'][idx] += y ** 2 - y_old ** 2
+        
+        ring[idx, cnt % size] = c
+        a['count'][idx] = cnt + 1
+        a['last_date'][idx] = np.datetime64(pd.Timestamp(date).date(), 'D')
+        wilder_update(self.wilder, high, low, close, self.adx_period)
+    
+    def values(self, rows=None):
+        """当前状态下的全部因子（与 PanelFactorEngine.latest 同名），另附最新价、前收盘价和K线数"""
+        if rows is None:
+            rows = np.arange(len(self.symbols))
+        a = self.arrays
+        size = self.ring_size
+        count = a['count'][rows]
+        ring = a['closes'][rows]
+        
+        def lag(bars_back):
+            """每行倒数第 bars_back+1 根收盘价，历史不足为NaN"""
+            values = np.take_along_axis(ring, ((count - 1 - bars_back) % size)[:, np.newaxis], axis=1)[:, 0]
+            return np.where(count > bars_back, values, np.nan)
+        
+        last = lag(0)
+        result = {'n_bars': count, 'current_price': last, 'prev_close': lag(1)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for label, p in zip(['mom_1m', 'mom_3m', 'mom_6m'], self.momentum_periods):
+                result[label] = last / lag(p - 1) - 1
+            
+            k = self.vol_period
+            ready = count - 1 >= k
+            mean = a['sum_ret'][rows] / k
+            std = np.sqrt(np.maximum(a['sumsq_ret'][rows] / k - mean ** 2, 0))
+            result['volatility'] = np.where(ready, std * np.sqrt(self.annualization), np.nan)
+            result['sharpe'] = np.where(ready & (std != 0), mean / std * np.sqrt(self.annualization), np.nan)
+            
+            s = self.slope_period
+            x = np.arange(s, dtype=np.float64)
+            sxx = np.sum((x - x.mean()) ** 2)
+            sum_y = a['sum_y'][rows]
+            slope = (a['sum_xy'][rows] - x.mean() * sum_y) / sxx
+            syy = a['sumsq_y'][rows] - sum_y ** 2 / s
+            ready = count >= s
+            result['slope'] = np.where(ready, slope, np.nan)
+            result['slope_r2'] = np.where(ready & (syy > 0), np.clip(slope ** 2 * sxx / syy, 0, 1), np.nan)
+            
+            ma = a['sum_ma'][rows] / self.ma_period
+            result['ma200_filter'] = np.where(count >= self.ma_period, (last > ma).astype(np.float64), np.nan)
+        
+        wilder = {key: values[rows] for key, values in self.wilder.items()}
+        result.update(wilder_values(wilder, self.adx_period))
+        return result
+    
+    def save(self, path):
+        np.savez(path, symbols=np.array(self.symbols), config=json.dumps(self.config()),
+                 **self.arrays, **{f'wilder_{key}': values for key, values in self.wilder.items()})
+    
+    @classmethod
+    def load(cls, path, **params):
+        """读取已保存的状态，文件不存在或参数不一致时返回None"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            state = cls([], **params)
+            if json.loads(str(data['config'])) != state.config():
+                return None
+            state.symbols = [str(ts_code) for ts_code in data['symbols']]
+            state.symbol_index = {ts_code: i for i, ts_code in enumerate(state.symbols)}
+            state.arrays = {key: data[key] for key in state._initial_arrays(0)}
+            state.wilder = {key: data[f'wilder_{key}'] for key in WILDER_STATE_FIELDS}
+        return state
+
+class MarketDataProvider:
+    """
+    行情数据源接口 - 返回 normalize_daily_frame 格式的单只ETF数据，无数据时返回None
+    
+    offline=True 表示不联网（本地行情库直接视为最新）；max_batch_size 为一次 fetch_batch 的最大ETF数，None 表示不限
+    """
+    name = 'base'
+    offline = False
+    max_batch_size = 1
+    
+    def fetch(self, ts_code, start_date, end_date):
+        raise NotImplementedError
+    
+    def fetch_batch(self, ts_codes, start_date, end_date):
+        """批量获取同一区间的多只ETF，返回 {ts_code: DataFrame或None}"""
+        return {ts_code: self.fetch(ts_code, start_date, end_date) for ts_code in ts_codes}
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    yfinance数据源 - 单只用 Ticker.history，多只用 yf.download 批量下载
+    
+    yf.download 内部仍按代码逐只请求，批量只是合并调用，因此每只ETF各计一个令牌
+    """
+    name = 'yfinance'
+    
+    def __init__(self, rate_limiter=None, batch_size=50):
+        self.rate_limiter = rate_limiter
+        self.max_batch_size = max(batch_size, 1)
+    
+    def fetch(self, ts_code, start_date, end_date):
+        # 共享令牌桶限流，避免请求过快
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        
+        # 使用yfinance获取数据
+        stock = yf.Ticker(to_yf_code(ts_code))
+        df = stock.history(start=start_date, end=end_date)
+        if df.empty:
+            return None
+        
+        # 重置索引并规范列名
+        return normalize_daily_frame(df)
+    
+    def fetch_batch(self, ts_codes, start_date, end_date):
+        """整批失败时抛出异常，由调用方决定是否逐只重试"""
+        if len(ts_codes) == 1:
+            return {ts_codes[0]: self.fetch(ts_codes[0], start_date, end_date)}
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(len(ts_codes))
+        
+        yf_codes = {to_yf_code(ts_code): ts_code for ts_code in ts_codes}
+        wide = yf.download(
+            list(yf_codes), start=start_date, end=end_date,
+            group_by='ticker', auto_adjust=True, threads=False, progress=False
+        )
+        
+        results = {}
+        for yf_code, ts_code in yf_codes.items():
+            if wide is None or wide.empty:
+                results[ts_code] = None
+                continue
+            # 多只下载时列为 (代码, 字段) 两级索引
+            if isinstance(wide.columns, pd.MultiIndex):
+                if yf_code not in wide.columns.get_level_values(0):
+                    results[ts_code] = None
+                    continue
+                df = wide[yf_code]
+            else:
+                df = wide
+            # 批量结果按所有代码的日期并集对齐，需去掉该ETF无数据的行
+            df = df.dropna(how='all')
+            results[ts_code] = normalize_daily_frame(df) if not df.empty else None
+        return results
+
+class AsyncChartProvider(MarketDataProvider):
+    """
+    异步数据源 - 基于aiohttp长连接池直接调用chart接口，带并发上限和单请求超时
+    
+    base_url 可指向本地桩服务器（见 serve_recorded_charts），用于无网络的吞吐测试
+    """
+    name = 'async'
+    max_batch_size = None
+    
+    def __init__(self, base_url=YAHOO_CHART_URL, concurrency=16, timeout=10, retries=1,
+                 rate_limiter=None, record_dir=None):
+        if aiohttp is None:
+            raise ImportError("异步抓取需要安装 aiohttp: pip install aiohttp")
+        self.base_url = base_url.rstrip('/') + '/'
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.rate_limiter = rate_limiter
+        # 保存原始响应，供本地桩服务器回放
+        self.record_dir = record_dir
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+    
+    async def _fetch_one(self, session, semaphore, ts_code, start_date, end_date):
+        yf_code = to_yf_code(ts_code)
+        params = {
+            'period1': int(pd.Timestamp(start_date).timestamp()),
+            'period2': int(pd.Timestamp(end_date).timestamp()),
+            'interval': '1d',
+            'events': 'div,splits',
+            'includeAdjustedClose': 'true',
+        }
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    if self.rate_limiter is not None:
+                        wait = self.rate_limiter.reserve()
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    async with session.get(self.base_url + yf_code, params=params) as resp:
+                        payload = await resp.json(content_type=None)
+                if self.record_dir:
+                    with open(os.path.join(self.record_dir, f'{yf_code}.json'), 'w', encoding='utf-8') as f:
+                        json.dump(payload, f)
+                return parse_chart_response(payload)
+            except Exception as e:
+                if attempt == self.retries:
+                    print(f"  ❌ 数据获取失败 {ts_code}: {e!r}")
+                    return None
+    
+    async def _fetch_many(self, requests):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            frames = await asyncio.gather(*[
+                self._fetch_one(session, semaphore, ts_code, start_date, end_date)
+                for ts_code, start_date, end_date in requests
+            ])
+        return {request[0]: df for request, df in zip(requests, frames)}
+    
+    def fetch_many(self, requests):
+        """
+        requests 为 [(ts_code, start_date, end_date), ...]，返回 {ts_code: DataFrame或None}
+        """
+        if not requests:
+            return {}
+        return asyncio.run(self._fetch_many(requests))
+    
+    def fetch(self, ts_code, start_date, end_date):
+        return self.fetch_many([(ts_code, start_date, end_date)])[ts_code]
+    
+    def fetch_batch(self, ts_codes, start_date, end_date):
+        return self.fetch_many([(ts_code, start_date, end_date) for ts_code in ts_codes])
+
+def slice_daily_frame(df, start_date, end_date):
+    """截取 [start_date, end_date] 区间的行情"""
+    if df is None:
+        return None
+    mask = (df['trade_date'] >= pd.Timestamp(start_date).normalize()) & \
+           (df['trade_date'] <= pd.Timestamp(end_date))
+    df = df[mask].reset_index(drop=True)
+    return df if not df.empty else None
+
+class LocalStoreProvider(MarketDataProvider):
+    """
+    本地行情库数据源 - 只读取 OHLCVStore，不联网
+    """
+    name = 'store'
+    offline = True
+    max_batch_size = None
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def fetch(self, ts_code, start_date, end_date):
+        return slice_daily_frame(self.store.load(ts_code), start_date, end_date)
+
+class ReplayProvider(MarketDataProvider):
+    """
+    录制回放数据源 - 从目录读取录制的 <ts_code>.parquet，按区间截取返回
+    
+    latency 为每次请求（单只或一批）的人为延迟秒数，用于在无网络环境下稳定复现抓取耗时
+    """
+    name = 'replay'
+    
+    def __init__(self, root, latency=0.0, batch_size=50):
+        if not os.path.isdir(root):
+            raise FileNotFoundError(f"回放目录不存在: {root}")
+        self.root = root
+        self.latency = latency
+        self.max_batch_size = max(batch_size, 1)
+    
+    def _load(self, ts_code, start_date, end_date):
+        path = os.path.join(self.root, f'{ts_code}.parquet')
+        if not os.path.exists(path):
+            return None
+        return slice_daily_frame(pd.read_parquet(path), start_date, end_date)
+    
+    def fetch(self, ts_code, start_date, end_date):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self._load(ts_code, start_date, end_date)
+    
+    def fetch_batch(self, ts_codes, start_date, end_date):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return {ts_code: self._load(ts_code, start_date, end_date) for ts_code in ts_codes}
+
+class RecordingProvider(MarketDataProvider):
+    """
+    录制包装 - 透传内层数据源的结果，同时合并保存到 root/<ts_code>.parquet 供 ReplayProvider 回放
+    """
+    def __init__(self, inner, root):
+        self.inner = inner
+        self.root = root
+        self.name = f'{inner.name}+record'
+        self.offline = inner.offline
+        self.max_batch_size = inner.max_batch_size
+        os.makedirs(self.root, exist_ok=True)
+    
+    def _record(self, ts_code, df):
+        if df is None:
+            return
+        path = os.path.join(self.root, f'{ts_code}.parquet')
+        if os.path.exists(path):
+            df = pd.concat([pd.read_parquet(path), df], ignore_index=True)
+            df = df.drop_duplicates(subset='trade_date', keep='last')
+        df.sort_values('trade_date').to_parquet(path, index=False)
+    
+    def fetch(self, ts_code, start_date, end_date):
+        df = self.inner.fetch(ts_code, start_date, end_date)
+        self._record(ts_code, df)
+        return df
+    
+    def fetch_batch(self, ts_codes, start_date, end_date):
+        results = self.inner.fetch_batch(ts_codes, start_date, end_date)
+        for ts_code, df in results.items():
+            self._record(ts_code, df)
+        return results
+
+BLAS_THREAD_ENV = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# 工作进程内的全局状态：挂载的面板与因子参数
+_FACTOR_WORKER = {}
+
+def _factor_worker_init(spec, settings, blas_threads):
+    """进程池初始化：限制BLAS线程数，挂载共享内存面板，构建只带因子参数的评级对象"""
+    if threadpool_limits is not None:
+        _FACTOR_WORKER['limits'] = threadpool_limits(limits=blas_threads)
+    panel, blocks = SharedPricePanel.attach(spec)
+    rating = CompleteETFDailyRating.__new__(CompleteETFDailyRating)
+    rating.__dict__.update(settings)
+    _FACTOR_WORKER.update(panel=panel, blocks=blocks, rating=rating)
+
+def _factor_worker_run(ts_codes):
+    return _FACTOR_WORKER['rating'].compute_factor_columns(_FACTOR_WORKER['panel'], ts_codes)
+
+def _walk_forward_worker_run(fold):
+    return _FACTOR_WORKER['rating'].walk_forward_fold(_FACTOR_WORKER['panel'], **fold)
 
 class CompleteETFDailyRating:
-    def __init__(self):
+    def __init__(self, fetch_workers=8, fetch_rate=3.0, batch_size=50, refresh=False,
+                 provider='yfinance', chart_url=YAHOO_CHART_URL, fetch_timeout=10, record_charts=None,
+                 replay_dir=None, replay_latency=0.0, record_dir=None, store_folder='ohlcv_store',
+                 exchange=None, category=None, watchlist=None, incremental=False,
+                 rebuild_state=False, processes=0, blas_threads=1, correlation_threshold=0.9, output_format='csv'):
         """
         初始化完整版ETF每日评级系统
         """
@@ -32,14 +1853,117 @@ class CompleteETFDailyRating:
         self.weight_adx = 0.6
         self.weight_ma200 = 0.4
         
+        # ETF标的注册表及筛选条件
+        self.universe = load_universe()
+        self.universe_exchange = exchange
+        self.universe_category = category
+        self.watchlist = watchlist
+        
         # 选股数量
         self.top_n = 50  # 显示前50名
+        # 结果文件格式：csv / parquet
+        self.output_formats = ['csv', 'parquet'] if output_format == 'both' else [output_format]
         self.recommend_n = 3
         
         # 数据参数
-        self.max_days = 250
         self.min_required_days = 60
         
+        # 各因子所需的最少K线数量，回看窗口按其中最大值并结合交易日历规划
+        self.factor_bar_requirements = {
+            'mom_1m': 20,
+            'mom_3m': 60,
+            'mom_6m': 120,
+            'slope': 60,
+            'volatility': 61,
+            'sharpe': 61,
+            'adx': 14 + 10,
+            'atr': 14 + 1,
+            'ma200': 200,
+        }
+        # 预留停牌等原因缺失的K线
+        self.lookback_buffer_bars = 10
+        self.calendar = TradingCalendar()
+        self.lookback_bars = self.plan_lookback_bars()
+        self.factor_engine = PanelFactorEngine()
+        
+        # 抓取参数：线程池大小 + 全局每秒请求数上限（原逐只串行+随机休眠的上限约为3次/秒）
+        self.fetch_workers = fetch_workers
+        self.fetch_rate = fetch_rate
+        self.rate_limiter = TokenBucketRateLimiter(self.fetch_rate, capacity=self.fetch_workers)
+        # 批量下载：每次调用包含的ETF数量，<=1 时退回逐只下载（限流仍按ETF个数计）
+        self.batch_size = batch_size
+        
+        # 本地增量行情库：只下载缺失的日期区间；refresh=True 时强制全量重新下载，
+        # 中断后再次 --refresh 时，本轮开始之后已重新下载的ETF不再下载
+        self.store_folder = store_folder
+        self.store = OHLCVStore(self.store_folder)
+        self.refresh = refresh
+        self.refresh_started = self.store.begin_refresh(exchange_now()) if refresh else None
+        self.market_close_time = (15, 0)
+        
+        # 行情数据源：可传入 MarketDataProvider 实例或名称（yfinance/async/store/replay）
+        if isinstance(provider, MarketDataProvider):
+            self.provider = provider
+        elif provider == 'yfinance':
+            self.provider = YFinanceProvider(self.rate_limiter, batch_size=self.batch_size)
+        elif provider == 'async':
+            self.provider = AsyncChartProvider(
+                base_url=chart_url, concurrency=self.fetch_workers, timeout=fetch_timeout,
+                rate_limiter=self.rate_limiter, record_dir=record_charts
+            )
+        elif provider == 'store':
+            self.provider = LocalStoreProvider(self.store)
+        elif provider == 'replay':
+            self.provider = ReplayProvider(replay_dir, latency=replay_latency, batch_size=self.batch_size)
+        else:
+            raise ValueError(f"未知的数据源: {provider}")
+        if record_dir:
+            self.provider = RecordingProvider(self.provider, record_dir)
+        
+        # 对齐的内存映射行情面板（ETF × 交易日）
+        self.panel_folder = 'price_panel'
+        
+        # 历史评级回填：交易日 × ETF 的得分与名次矩阵
+        self.rating_history_folder = 'rating_history'
+        
+        # 轮动回测：每 rebalance_days 个交易日调仓到前 recommend_n 名，信号日的下一交易日收盘成交，
+        # 单只仓位上限与调仓建议一致，成本按单边换手计
+        self.backtest_folder = 'backtests'
+        self.rebalance_days = 5
+        self.max_position_weight = 0.35
+        self.transaction_cost = 0.001
+        self.execution_lag = 1
+        
+        # 相关性去重：最近 correlation_window 个交易日收益率相关系数不低于阈值的ETF视为同一敞口，
+        # 推荐持仓每簇只取得分最高的一只；相关矩阵相对缓存的均方根变化超过 correlation_drift 才重新聚类
+        self.correlation_threshold = correlation_threshold
+        self.correlation_window = 120
+        self.correlation_drift = 0.02
+        self.cluster_file = 'correlation_clusters.npz'
+        
+        # 因子IC分析：各组合因子与综合得分对 1/5/20 日前瞻收益的 rank IC 与五分组收益
+        self.analytics_folder = 'factor_analytics'
+        self.ic_horizons = (1, 5, 20)
+        self.ic_quantiles = 5
+        
+        # 数据质量阈值：单日涨跌幅上限、收盘价连续不变的天数
+        self.max_abs_daily_return = 0.25
+        self.stale_close_days = 5
+        
+        # 因子缓存：按列记录每只ETF最后K线日期、输入数据哈希和上次的因子结果，输入未变时直接复用
+        self.factor_cache_file = 'factor_cache.npz'
+        
+        # 增量因子状态：每只ETF的滚动窗口与递推量，开启后每天只推进新K线；
+        # 截至上次K线的最近 state_check_bars 根数据有变化视为数据修正，对该ETF重建
+        self.incremental_factors = incremental
+        self.rebuild_factor_state = rebuild_state or refresh
+        self.factor_state_file = 'factor_state.npz'
+        self.state_check_bars = 20
+        
+        # 多进程因子计算：ETF分片交给进程池，工作进程挂载共享内存面板，每个进程的BLAS线程数受限
+        self.factor_processes = processes
+        self.blas_threads = blas_threads
+        
         # 存储当前持仓
         self.holdings_file = 'etf_holdings.json'
         self.current_holdings = self.load_holdings()
@@ -74,581 +1998,234 @@ class CompleteETFDailyRating:
         with open(self.holdings_file, 'w', encoding='utf-8') as f:
             json.dump(holdings, f, ensure_ascii=False, indent=2)
     
+    def factor_config_key(self):
+        """影响单只ETF因子结果的参数指纹，参数变化时缓存自动失效"""
+        config = {
+            'weights': [self.weight_mom_1m, self.weight_mom_3m, self.weight_mom_6m,
+                        self.weight_adx, self.weight_ma200],
+            'bars': self.lookback_bars,
+            'min_required_days': self.min_required_days,
+            'quality': [self.max_abs_daily_return, self.stale_close_days],
+            'incremental': self.incremental_factors,
+        }
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def load_factor_cache(self):
+        """读取因子缓存：ts_code / last_date / digest / config 与 RATING_COLUMNS 各一列，文件不存在或列不全时为空"""
+        columns = {'ts_code': str, 'last_date': 'datetime64[D]', 'digest': str, 'config': str, **RATING_COLUMNS}
+        if os.path.exists(self.factor_cache_file):
+            with np.load(self.factor_cache_file, allow_pickle=False) as data:
+                if set(columns) <= set(data.files):
+                    return {key: data[key] for key in columns}
+        return {key: np.empty(0, dtype=dtype) for key, dtype in columns.items()}
+    
+    def save_factor_cache(self, cache):
+        """写临时文件后原子替换"""
+        tmp_path = f'{self.factor_cache_file}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **cache)
+        os.replace(tmp_path, self.factor_cache_file)
+    
     def get_all_etf_list(self):
         """
-        获取全市场ETF列表 - 使用完整的备用列表
+        获取全市场ETF列表 - 按交易所/类别/自选列表筛选注册表
         """
         print("📋 使用完整ETF列表...")
-        return self.get_complete_etf_list()
+        universe = self.universe.view(exchange=self.universe_exchange, category=self.universe_category,
+                                      watchlist=self.watchlist)
+        if len(universe) < len(self.universe):
+            print(f"🔎 筛选后ETF数量: {len(universe)}/{len(self.universe)}")
+        return universe.to_frame()
     
     def get_complete_etf_list(self):
         """
-        完整的ETF列表 - 包含所有提供的ETF
+        完整的ETF列表 - 来自注册表 etf_universe.csv
         """
-        complete_etfs = [
-            
-            {'ts_code': '159994.SZ', 'name': '5GETF'},
-            {'ts_code': '159509.SZ', 'name': '纳指科技ETF'},
-            {'ts_code': '159796.SZ', 'name': '电池50ETF'},
-            {'ts_code': '159583.SZ', 'name': '通信设备ETF'},
-            {'ts_code': '159783.SZ', 'name': '科创创业50ETF'},
-            {'ts_code': '159781.SZ', 'name': '科创创业ETF'},
-            {'ts_code': '159603.SZ', 'name': '双创龙头ETF'},
-            {'ts_code': '159811.SZ', 'name': '5G50ETF'},
-            {'ts_code': '159780.SZ', 'name': '双创ETF'},
-            {'ts_code': '159782.SZ', 'name': '双创50ETF'},
-            {'ts_code': '159368.SZ', 'name': '创业板新能源ETF华夏'},
-            {'ts_code': '159383.SZ', 'name': '创业板50ETF华泰柏瑞'},
-            {'ts_code': '159566.SZ', 'name': '储能电池ETF'},
-            {'ts_code': '159305.SZ', 'name': '储能电池ETF广发'},
-            {'ts_code': '159773.SZ', 'name': '创业板科技ETF'},
-            {'ts_code': '159652.SZ', 'name': '有色50ETF'},
-            {'ts_code': '159375.SZ', 'name': '创业板50ETF国泰'},
-            {'ts_code': '159370.SZ', 'name': '创50ETF工银'},
-            {'ts_code': '159777.SZ', 'name': '创科技ETF'},
-            {'ts_code': '159373.SZ', 'name': '创业板50ETF嘉实'},
-            {'ts_code': '159681.SZ', 'name': '创50ETF'},
-            {'ts_code': '159779.SZ', 'name': '消费电子50ETF'},
-            {'ts_code': '159371.SZ', 'name': '创业板50ETF富国'},
-            {'ts_code': '159682.SZ', 'name': '创业50ETF'},
-            {'ts_code': '159949.SZ', 'name': '创业板50ETF'},
-            {'ts_code': '159752.SZ', 'name': '新能源龙头ETF'},
-            {'ts_code': '159597.SZ', 'name': '创业板成长ETF易方达'},
-            {'ts_code': '159320.SZ', 'name': '电网ETF'},
-            {'ts_code': '159880.SZ', 'name': '有色ETF基金'},
-            {'ts_code': '159690.SZ', 'name': '矿业ETF'},
-            {'ts_code': '159367.SZ', 'name': '创业板50ETF华夏'},
-            {'ts_code': '159676.SZ', 'name': '创业板增强ETF富国'},
-            {'ts_code': '159881.SZ', 'name': '有色60ETF'},
-            {'ts_code': '159814.SZ', 'name': '创业大盘ETF'},
-            {'ts_code': '159871.SZ', 'name': '有色金属ETF'},
-            {'ts_code': '159675.SZ', 'name': '创业板增强ETF'},
-            {'ts_code': '159502.SZ', 'name': '标普生物科技ETF'},
-            {'ts_code': '159381.SZ', 'name': '创业板人工智能ETF华夏'},
-            {'ts_code': '159507.SZ', 'name': '通信ETF广发'},
-            {'ts_code': '159363.SZ', 'name': '创业板人工智能ETF华宝'},
-            {'ts_code': '159991.SZ', 'name': '创大盘ETF'},
-            {'ts_code': '159755.SZ', 'name': '电池ETF'},
-            {'ts_code': '159767.SZ', 'name': '电池龙头ETF'},
-            {'ts_code': '159808.SZ', 'name': '创100ETF融通'},
-            {'ts_code': '159819.SZ', 'name': '人工智能ETF'},
-            {'ts_code': '159909.SZ', 'name': 'TMT50ETF'},
-            {'ts_code': '159757.SZ', 'name': '电池ETF景顺'},
-            {'ts_code': '159388.SZ', 'name': '创业板人工智能ETF国泰'},
-            {'ts_code': '159840.SZ', 'name': '锂电池ETF'},
-            {'ts_code': '159695.SZ', 'name': '通信ETF'},
-            {'ts_code': '159906.SZ', 'name': '深成长龙头ETF'},
-            {'ts_code': '159958.SZ', 'name': '创业板ETF工银'},
-            {'ts_code': '159964.SZ', 'name': '创业板ETF平安'},
-            {'ts_code': '159511.SZ', 'name': '通信ETF南方'},
-            {'ts_code': '159861.SZ', 'name': '碳中和50ETF'},
-            {'ts_code': '159956.SZ', 'name': '创业板ETF建信'},
-            {'ts_code': '159875.SZ', 'name': '新能源ETF'},
-            {'ts_code': '159824.SZ', 'name': '新能车ETF'},
-            {'ts_code': '159821.SZ', 'name': 'BOCI创业板ETF'},
-            {'ts_code': '159810.SZ', 'name': '创业板ETF浦银'},
-            {'ts_code': '159948.SZ', 'name': '创业板ETF南方'},
-            {'ts_code': '159915.SZ', 'name': '创业板ETF'},
-            {'ts_code': '159908.SZ', 'name': '创业板ETF博时'},
-            {'ts_code': '159709.SZ', 'name': '物联网ETF工银'},
-            {'ts_code': '159640.SZ', 'name': '碳中和龙头ETF'},
-            {'ts_code': '159885.SZ', 'name': '碳中和ETF基金'},
-            {'ts_code': '159957.SZ', 'name': '创业板ETF华夏'},
-            {'ts_code': '159896.SZ', 'name': '物联网ETF南方'},
-            {'ts_code': '159952.SZ', 'name': '创业板ETF广发'},
-            {'ts_code': '159806.SZ', 'name': '新能源车ETF'},
-            {'ts_code': '159895.SZ', 'name': '物联网ETF易方达'},
-            {'ts_code': '159831.SZ', 'name': '上海金ETF嘉实'},
-            {'ts_code': '159671.SZ', 'name': '稀有金属ETF基金'},
-            {'ts_code': '159834.SZ', 'name': '金ETF'},
-            {'ts_code': '159934.SZ', 'name': '黄金ETF'},
-            {'ts_code': '159830.SZ', 'name': '上海金ETF'},
-            {'ts_code': '159812.SZ', 'name': '黄金基金ETF'},
-            {'ts_code': '159637.SZ', 'name': '新能源车龙头ETF'},
-            {'ts_code': '159997.SZ', 'name': '电子ETF'},
-            {'ts_code': '159937.SZ', 'name': '黄金ETF基金'},
-            {'ts_code': '159790.SZ', 'name': '碳中和ETF'},
-            {'ts_code': '159641.SZ', 'name': '双碳ETF'},
-            {'ts_code': '159639.SZ', 'name': '碳中和ETF南方'},
-            {'ts_code': '159807.SZ', 'name': '科技ETF'},
-            {'ts_code': '159602.SZ', 'name': '中国A50ETF'},
-            {'ts_code': '159701.SZ', 'name': '物联网ETF招商'},
-            {'ts_code': '159716.SZ', 'name': '深证100ETF华宝'},
-            {'ts_code': '159642.SZ', 'name': '碳中和100ETF'},
-            {'ts_code': '159601.SZ', 'name': 'A50ETF'},
-            {'ts_code': '159608.SZ', 'name': '稀有金属ETF'},
-            {'ts_code': '159582.SZ', 'name': '半导体产业ETF'},
-            {'ts_code': '159501.SZ', 'name': '纳指ETF嘉实'},
-            {'ts_code': '159973.SZ', 'name': '民企ETF'},
-            {'ts_code': '159941.SZ', 'name': '纳指ETF'},
-            {'ts_code': '159944.SZ', 'name': '材料ETF'},
-            {'ts_code': '159665.SZ', 'name': '半导体龙头ETF'},
-            {'ts_code': '159721.SZ', 'name': '深证100ETF永赢'},
-            {'ts_code': '159836.SZ', 'name': '创业板300ETF天弘'},
-            {'ts_code': '159660.SZ', 'name': '纳指100ETF'},
-            {'ts_code': '159713.SZ', 'name': '稀土ETF'},
-            {'ts_code': '159715.SZ', 'name': '稀土ETF易方达'},
-            {'ts_code': '159995.SZ', 'name': '芯片ETF'},
-            {'ts_code': '159310.SZ', 'name': '芯片ETF天弘'},
-            {'ts_code': '159886.SZ', 'name': '机械ETF'},
-            {'ts_code': '159599.SZ', 'name': '芯片ETF基金'},
-            {'ts_code': '159212.SZ', 'name': '深100ETF南方'},
-            {'ts_code': '159738.SZ', 'name': '云计算ETF华泰柏瑞'},
-            {'ts_code': '159211.SZ', 'name': '深证100ETF富国'},
-            {'ts_code': '159813.SZ', 'name': '半导体ETF'},
-            {'ts_code': '159720.SZ', 'name': '智能车ETF泰康'},
-            {'ts_code': '159961.SZ', 'name': '深100ETF方正富邦'},
-            {'ts_code': '159656.SZ', 'name': '300成长ETF'},
-            {'ts_code': '159775.SZ', 'name': '电池ETF基金'},
-            {'ts_code': '159912.SZ', 'name': '深300ETF'},
-            {'ts_code': '159576.SZ', 'name': '深证100ETF广发'},
-            {'ts_code': '159801.SZ', 'name': '芯片ETF龙头'},
-            {'ts_code': '159560.SZ', 'name': '芯片ETF景顺'},
-            {'ts_code': '159696.SZ', 'name': '纳指ETF易方达'},
-            {'ts_code': '159939.SZ', 'name': '信息技术ETF'},
-            {'ts_code': '159546.SZ', 'name': '集成电路ETF'},
-            {'ts_code': '159325.SZ', 'name': '半导体ETF南方'},
-            {'ts_code': '159706.SZ', 'name': '深证100ETF华安'},
-            {'ts_code': '159969.SZ', 'name': '深100ETF银华'},
-            {'ts_code': '159975.SZ', 'name': '深100ETF招商'},
-            {'ts_code': '159150.SZ', 'name': '深证50ETF易方达'},
-            {'ts_code': '159632.SZ', 'name': '纳斯达克ETF'},
-            {'ts_code': '159513.SZ', 'name': '纳斯达克100指数ETF'},
-            {'ts_code': '159659.SZ', 'name': '纳斯达克100ETF'},
-            {'ts_code': '159350.SZ', 'name': '深证50ETF富国'},
-            {'ts_code': '159763.SZ', 'name': '新材料ETF基金'},
-            {'ts_code': '159901.SZ', 'name': '深证100ETF'},
-            {'ts_code': '159653.SZ', 'name': 'ESG300ETF'},
-            {'ts_code': '159216.SZ', 'name': '深证100ETF大成'},
-            {'ts_code': '159631.SZ', 'name': '中证A100ETF'},
-            {'ts_code': '159609.SZ', 'name': '光伏龙头ETF'},
-            {'ts_code': '159362.SZ', 'name': 'A500ETF工银'},
-            {'ts_code': '159553.SZ', 'name': '2000ETF增强'},
-            {'ts_code': '159685.SZ', 'name': '1000增强ETF天弘'},
-            {'ts_code': '159943.SZ', 'name': '深证成指ETF'},
-            {'ts_code': '159380.SZ', 'name': 'A500ETF东财'},
-            {'ts_code': '159386.SZ', 'name': 'A500ETF永赢'},
-            {'ts_code': '159717.SZ', 'name': 'ESGETF'},
-            {'ts_code': '159778.SZ', 'name': '工业互联ETF'},
-            {'ts_code': '159703.SZ', 'name': '新材料ETF'},
-            {'ts_code': '159970.SZ', 'name': '深100ETF工银'},
-            {'ts_code': '159866.SZ', 'name': '日经ETF'},
-            {'ts_code': '159627.SZ', 'name': 'A100ETF'},
-            {'ts_code': '159215.SZ', 'name': '中证A500ETF指数基金'},
-            {'ts_code': '159903.SZ', 'name': '深成ETF'},
-            {'ts_code': '159360.SZ', 'name': '中证A500ETF天弘'},
-            {'ts_code': '159863.SZ', 'name': '光伏ETF基金'},
-            {'ts_code': '159661.SZ', 'name': 'A100ETF嘉实'},
-            {'ts_code': '159356.SZ', 'name': 'A500ETF基金'},
-            {'ts_code': '159339.SZ', 'name': 'A500ETF'},
-            {'ts_code': '159376.SZ', 'name': 'A500ETF指数基金'},
-            {'ts_code': '159923.SZ', 'name': '中证A100ETF基金'},
-            {'ts_code': '159864.SZ', 'name': '光伏50ETF'},
-            {'ts_code': '159351.SZ', 'name': 'A500ETF嘉实'},
-            {'ts_code': '159379.SZ', 'name': 'A500ETF融通'},
-            {'ts_code': '159678.SZ', 'name': '中证500增强ETF'},
-            {'ts_code': '159577.SZ', 'name': '美国50ETF'},
-            {'ts_code': '159358.SZ', 'name': '中证A500ETF基金'},
-            {'ts_code': '159610.SZ', 'name': '500ETF增强'},
-            {'ts_code': '159618.SZ', 'name': '光伏ETF指数基金'},
-            {'ts_code': '159761.SZ', 'name': '新材料50ETF'},
-            {'ts_code': '159393.SZ', 'name': '沪深300指数ETF'},
-            {'ts_code': '159353.SZ', 'name': '中证A500ETF景顺'},
-            {'ts_code': '159330.SZ', 'name': '沪深300ETF基金'},
-            {'ts_code': '159902.SZ', 'name': '中小100ETF'},
-            {'ts_code': '159359.SZ', 'name': '中证A500ETF华安'},
-            {'ts_code': '159563.SZ', 'name': '创业板综ETF华夏'},
-            {'ts_code': '159686.SZ', 'name': 'A100ETF易方达'},
-            {'ts_code': '159630.SZ', 'name': 'A100ETF基金'},
-            {'ts_code': '159732.SZ', 'name': '消费电子ETF'},
-            {'ts_code': '159673.SZ', 'name': '沪深300ETF鹏华'},
-            {'ts_code': '159357.SZ', 'name': '中证A500指数ETF'},
-            {'ts_code': '159857.SZ', 'name': '光伏ETF'},
-            {'ts_code': '159361.SZ', 'name': 'A500ETF易方达'},
-            {'ts_code': '159352.SZ', 'name': 'A500ETF南方'},
-            {'ts_code': '159982.SZ', 'name': '中证500ETF鹏华'},
-            {'ts_code': '159338.SZ', 'name': '中证A500ETF'},
-            {'ts_code': '159326.SZ', 'name': '电网设备ETF'},
-            {'ts_code': '159606.SZ', 'name': '中证500成长ETF'},
-            {'ts_code': '159562.SZ', 'name': '黄金股ETF'},
-            {'ts_code': '159300.SZ', 'name': '300ETF'},
-            {'ts_code': '159523.SZ', 'name': '沪深300成长ETF'},
-            {'ts_code': '159925.SZ', 'name': '沪深300ETF南方'},
-            {'ts_code': '159558.SZ', 'name': '半导体设备ETF易方达'},
-            {'ts_code': '159327.SZ', 'name': '半导体设备ETF基金'},
-            {'ts_code': '159596.SZ', 'name': 'A50ETF华宝'},
-            {'ts_code': '159919.SZ', 'name': '沪深300ETF'},
-            {'ts_code': '159315.SZ', 'name': '黄金股ETF基金'},
-            {'ts_code': '159968.SZ', 'name': '中证500ETF博时'},
-            {'ts_code': '159621.SZ', 'name': 'MSCIESGETF'},
-            {'ts_code': '159967.SZ', 'name': '创业板成长ETF'},
-            {'ts_code': '159655.SZ', 'name': '标普ETF'},
-            {'ts_code': '159516.SZ', 'name': '半导体设备ETF'},
-            {'ts_code': '159322.SZ', 'name': '黄金股票ETF基金'},
-            {'ts_code': '159623.SZ', 'name': '成渝经济圈ETF'},
-            {'ts_code': '159540.SZ', 'name': '信创ETF易方达'},
-            {'ts_code': '159791.SZ', 'name': '300ESGETF'},
-            {'ts_code': '159800.SZ', 'name': '中证800ETF'},
-            {'ts_code': '159820.SZ', 'name': '中证500ETF天弘'},
-            {'ts_code': '159935.SZ', 'name': '中证500ETF景顺'},
-            {'ts_code': '159922.SZ', 'name': '中证500ETF'},
-            {'ts_code': '159966.SZ', 'name': '创业板价值ETF'},
-            {'ts_code': '159552.SZ', 'name': '中证2000增强ETF'},
-            {'ts_code': '159337.SZ', 'name': '中证500ETF基金'},
-            {'ts_code': '159537.SZ', 'name': '信创ETF'},
-            {'ts_code': '159658.SZ', 'name': '数字经济ETF'},
-            {'ts_code': '159222.SZ', 'name': '自由现金流ETF易方达'},
-            {'ts_code': '159538.SZ', 'name': '信创ETF富国'},
-            {'ts_code': '159663.SZ', 'name': '机床ETF'},
-            {'ts_code': '159541.SZ', 'name': '创业板综ETF万家'},
-            {'ts_code': '159201.SZ', 'name': '自由现金流ETF'},
-            {'ts_code': '159890.SZ', 'name': '云计算ETF'},
-            {'ts_code': '159687.SZ', 'name': '亚太精选ETF'},
-            {'ts_code': '159539.SZ', 'name': '信创ETF广发'},
-            {'ts_code': '159691.SZ', 'name': '港股红利ETF'},
-            {'ts_code': '159667.SZ', 'name': '工业母机ETF'},
-            {'ts_code': '159617.SZ', 'name': '500价值ETF'},
-            {'ts_code': '159739.SZ', 'name': '大数据ETF'},
-            {'ts_code': '159225.SZ', 'name': '现金流ETF基金'},
-            {'ts_code': '159565.SZ', 'name': '汽车零部件ETF'},
-            {'ts_code': '159591.SZ', 'name': '中证A50ETF'},
-            {'ts_code': '159321.SZ', 'name': '黄金股票ETF'},
-            {'ts_code': '159588.SZ', 'name': '石油天然气ETF'},
-            {'ts_code': '159592.SZ', 'name': 'A50ETF基金'},
-            {'ts_code': '159521.SZ', 'name': '国证2000ETF指数基金'},
-            {'ts_code': '159543.SZ', 'name': '国证2000ETF基金'},
-            {'ts_code': '159390.SZ', 'name': 'A50指数ETF'},
-            {'ts_code': '159697.SZ', 'name': '油气ETF'},
-            {'ts_code': '159532.SZ', 'name': '中证2000ETF易方达'},
-            {'ts_code': '159593.SZ', 'name': '中证A50指数ETF'},
-            {'ts_code': '159595.SZ', 'name': '中证A50ETF基金'},
-            {'ts_code': '159306.SZ', 'name': '汽车零件ETF'},
-            {'ts_code': '159555.SZ', 'name': '2000增强ETF'},
-            {'ts_code': '159309.SZ', 'name': '油气资源ETF'},
-            {'ts_code': '159976.SZ', 'name': '湾创ETF'},
-            {'ts_code': '159527.SZ', 'name': '云计算ETF广发'},
-            {'ts_code': '159620.SZ', 'name': '500成长ETF'},
-            {'ts_code': '159679.SZ', 'name': '中证1000增强ETF'},
-            {'ts_code': '159870.SZ', 'name': '化工ETF'},
-            {'ts_code': '159910.SZ', 'name': '基本面120ETF'},
-            {'ts_code': '159510.SZ', 'name': '沪深300价值ETF'},
-            {'ts_code': '159677.SZ', 'name': '1000增强ETF'},
-            {'ts_code': '159519.SZ', 'name': '港股国企ETF'},
-            {'ts_code': '159505.SZ', 'name': '国证2000指数ETF'},
-            {'ts_code': '159249.SZ', 'name': 'A500增强ETF工银'},
-            {'ts_code': '159517.SZ', 'name': '800增强ETF'},
-            {'ts_code': '159945.SZ', 'name': '能源ETF广发'},
-            {'ts_code': '159930.SZ', 'name': '能源ETF'},
-            {'ts_code': '159209.SZ', 'name': '中证红利质量ETF'},
-            {'ts_code': '159680.SZ', 'name': '1000ETF增强'},
-            {'ts_code': '159723.SZ', 'name': '科技龙头ETF'},
-            {'ts_code': '159535.SZ', 'name': '中证2000ETF嘉实'},
-            {'ts_code': '159633.SZ', 'name': '中证1000ETF易方达'},
-            {'ts_code': '159328.SZ', 'name': '家电ETF易方达'},
-            {'ts_code': '159786.SZ', 'name': 'VRETF'},
-            {'ts_code': '159731.SZ', 'name': '石化ETF'},
-            {'ts_code': '159918.SZ', 'name': '中创400ETF'},
-            {'ts_code': '159536.SZ', 'name': '中证2000指数ETF'},
-            {'ts_code': '159533.SZ', 'name': '中证2000ETF基金'},
-            {'ts_code': '159203.SZ', 'name': '大盘成长ETF'},
-            {'ts_code': '159528.SZ', 'name': '国企改革ETF'},
-            {'ts_code': '159207.SZ', 'name': '高股息ETF'},
-            {'ts_code': '159845.SZ', 'name': '中证1000ETF'},
-            {'ts_code': '159399.SZ', 'name': '现金流ETF'},
-            {'ts_code': '159629.SZ', 'name': '1000ETF'},
-            {'ts_code': '159758.SZ', 'name': '红利质量ETF'},
-            {'ts_code': '159980.SZ', 'name': '有色ETF'},
-            {'ts_code': '159240.SZ', 'name': '中证A500增强ETF天弘'},
-            {'ts_code': '159888.SZ', 'name': '智能车ETF'},
-            {'ts_code': '159730.SZ', 'name': '龙头家电ETF'},
-            {'ts_code': '159889.SZ', 'name': '智能汽车ETF'},
-            {'ts_code': '159805.SZ', 'name': '传媒ETF'},
-            {'ts_code': '159611.SZ', 'name': '电力ETF'},
-            {'ts_code': '159726.SZ', 'name': '恒生红利ETF'},
-            {'ts_code': '159301.SZ', 'name': '公用事业ETF'},
-            {'ts_code': '159795.SZ', 'name': '智能汽车ETF基金'},
-            {'ts_code': '159226.SZ', 'name': '中证A500增强ETF'},
-            {'ts_code': '159236.SZ', 'name': '自由现金流ETF工银'},
-            {'ts_code': '159959.SZ', 'name': '央企ETF'},
-            {'ts_code': '159238.SZ', 'name': '300ETF增强'},
-            {'ts_code': '159531.SZ', 'name': '中证2000ETF'},
-            {'ts_code': '159916.SZ', 'name': '深F60ETF'},
-            {'ts_code': '159869.SZ', 'name': '游戏ETF'},
-            {'ts_code': '159333.SZ', 'name': '港股央企红利ETF'},
-            {'ts_code': '159578.SZ', 'name': '深证主板50ETF南方'},
-            {'ts_code': '159743.SZ', 'name': '湖北ETF'},
-            {'ts_code': '159556.SZ', 'name': '中证2000ETF增强'},
-            {'ts_code': '159235.SZ', 'name': '中证现金流ETF'},
-            {'ts_code': '159708.SZ', 'name': '红利ETF'},
-            {'ts_code': '159996.SZ', 'name': '家电ETF'},
-            {'ts_code': '159628.SZ', 'name': '国证2000ETF'},
-            {'ts_code': '159219.SZ', 'name': '深证100ETF融通'},
-            {'ts_code': '159616.SZ', 'name': '农牧ETF'},
-            {'ts_code': '159232.SZ', 'name': '现金流ETF南方'},
-            {'ts_code': '159669.SZ', 'name': '绿电ETF'},
-            {'ts_code': '159905.SZ', 'name': '深红利ETF'},
-            {'ts_code': '159625.SZ', 'name': '绿色电力ETF'},
-            {'ts_code': '159804.SZ', 'name': '创中盘88ETF'},
-            {'ts_code': '159221.SZ', 'name': '现金流ETF嘉实'},
-            {'ts_code': '159233.SZ', 'name': '自由现金流ETF基金'},
-            {'ts_code': '159965.SZ', 'name': '央视50ETF'},
-            {'ts_code': '159223.SZ', 'name': '现金流ETF永赢'},
-            {'ts_code': '159332.SZ', 'name': '央企红利ETF'},
-            {'ts_code': '159220.SZ', 'name': '港股通红利ETF'},
-            {'ts_code': '159206.SZ', 'name': '卫星ETF'},
-            {'ts_code': '159229.SZ', 'name': '自由现金流ETF广发'},
-            {'ts_code': '159707.SZ', 'name': '地产ETF'},
-            {'ts_code': '159261.SZ', 'name': '创业板新能源ETF鹏华'},
-            {'ts_code': '159387.SZ', 'name': '创业板新能源ETF国泰'},
-            {'ts_code': '159768.SZ', 'name': '房地产ETF'},
-            {'ts_code': '159366.SZ', 'name': '港股医疗ETF'},
-            {'ts_code': '159542.SZ', 'name': '工程机械ETF'},
-            {'ts_code': '159936.SZ', 'name': '可选消费ETF'},
-            {'ts_code': '159698.SZ', 'name': '粮食ETF'},
-            {'ts_code': '159205.SZ', 'name': '创业板ETF东财'},
-            {'ts_code': '159872.SZ', 'name': '智能网联汽车ETF'},
-            {'ts_code': '159581.SZ', 'name': '红利ETF基金'},
-            {'ts_code': '159335.SZ', 'name': '央企科创ETF'},
-            {'ts_code': '159827.SZ', 'name': '农业50ETF'},
-            {'ts_code': '159728.SZ', 'name': '在线消费ETF'},
-            {'ts_code': '159551.SZ', 'name': '机器人产业ETF'},
-            {'ts_code': '159515.SZ', 'name': '国企红利ETF'},
-            {'ts_code': '159793.SZ', 'name': '线上消费ETF基金'},
-            {'ts_code': '159526.SZ', 'name': '机器人ETF嘉实'},
-            {'ts_code': '159545.SZ', 'name': '恒生红利低波ETF'},
-            {'ts_code': '159589.SZ', 'name': '红利ETF广发'},
-            {'ts_code': '159372.SZ', 'name': '创业板50ETF万家'},
-            {'ts_code': '159770.SZ', 'name': '机器人ETF'},
-            {'ts_code': '159587.SZ', 'name': '粮食ETF广发'},
-            {'ts_code': '159998.SZ', 'name': '计算机ETF'},
-            {'ts_code': '159573.SZ', 'name': '创业板200ETF华夏'},
-            {'ts_code': '159619.SZ', 'name': '基建ETF'},
-            {'ts_code': '159825.SZ', 'name': '农业ETF'},
-            {'ts_code': '159572.SZ', 'name': '创业板200ETF易方达'},
-            {'ts_code': '159822.SZ', 'name': '新经济ETF'},
-            {'ts_code': '159635.SZ', 'name': '基建50ETF'},
-            {'ts_code': '159974.SZ', 'name': '央企创新ETF'},
-            {'ts_code': '159788.SZ', 'name': '港股通100ETF'},
-            {'ts_code': '159575.SZ', 'name': '创业板200ETF银华'},
-            {'ts_code': '159913.SZ', 'name': '深价值ETF'},
-            {'ts_code': '159302.SZ', 'name': '港股高股息ETF'},
-            {'ts_code': '159712.SZ', 'name': '港股通50ETF'},
-            {'ts_code': '159612.SZ', 'name': '标普500ETF'},
-            {'ts_code': '159331.SZ', 'name': '红利港股ETF'},
-            {'ts_code': '159856.SZ', 'name': '互联网龙头ETF'},
-            {'ts_code': '159571.SZ', 'name': '创业板200ETF富国'},
-            {'ts_code': '159766.SZ', 'name': '旅游ETF'},
-            {'ts_code': '159729.SZ', 'name': '互联网ETF'},
-            {'ts_code': '159725.SZ', 'name': '线上消费ETF'},
-            {'ts_code': '159385.SZ', 'name': '数字经济ETF富国'},
-            {'ts_code': '159549.SZ', 'name': '红利低波ETF天弘'},
-            {'ts_code': '159329.SZ', 'name': '沙特ETF'},
-            {'ts_code': '159883.SZ', 'name': '医疗器械ETF'},
-            {'ts_code': '159311.SZ', 'name': '数字经济ETF易方达'},
-            {'ts_code': '159920.SZ', 'name': '恒生ETF'},
-            {'ts_code': '159666.SZ', 'name': '交通运输ETF'},
-            {'ts_code': '159898.SZ', 'name': '医疗器械指数ETF'},
-            {'ts_code': '159742.SZ', 'name': '恒生科技指数ETF'},
-            {'ts_code': '159355.SZ', 'name': '800红利低波ETF'},
-            {'ts_code': '159797.SZ', 'name': '医疗器械ETF基金'},
-            {'ts_code': '159263.SZ', 'name': '价值ETF'},
-            {'ts_code': '159662.SZ', 'name': '交运ETF'},
-            {'ts_code': '159336.SZ', 'name': '央企红利50ETF'},
-            {'ts_code': '159613.SZ', 'name': '信息安全ETF'},
-            {'ts_code': '159389.SZ', 'name': '数字经济ETF嘉实'},
-            {'ts_code': '159907.SZ', 'name': '2000ETF'},
-            {'ts_code': '159312.SZ', 'name': '恒生ETF港股通'},
-            {'ts_code': '159993.SZ', 'name': '证券ETF龙头'},
-            {'ts_code': '159891.SZ', 'name': '医疗ETF基金'},
-            {'ts_code': '159318.SZ', 'name': '恒生港股通ETF'},
-            {'ts_code': '159001.SZ', 'name': '货币ETF'},
-            {'ts_code': '159719.SZ', 'name': '国企共赢ETF'},
-            {'ts_code': '159877.SZ', 'name': '医疗ETF南方'},
-            {'ts_code': '159520.SZ', 'name': '消费龙头ETF'},
-            {'ts_code': '159848.SZ', 'name': '证券ETF基金'},
-            {'ts_code': '159873.SZ', 'name': '医疗设备ETF'},
-            {'ts_code': '159842.SZ', 'name': '券商ETF'},
-            {'ts_code': '159607.SZ', 'name': '中概互联网ETF'},
-            {'ts_code': '159692.SZ', 'name': '证券ETF东财'},
-            {'ts_code': '159847.SZ', 'name': '医疗ETF易方达'},
-            {'ts_code': '159512.SZ', 'name': '汽车ETF'},
-            {'ts_code': '159530.SZ', 'name': '机器人ETF易方达'},
-            {'ts_code': '159954.SZ', 'name': 'H股ETF'},
-            {'ts_code': '159841.SZ', 'name': '证券ETF'},
-            {'ts_code': '159547.SZ', 'name': '红利低波ETF基金'},
-            {'ts_code': '159940.SZ', 'name': '金融地产ETF'},
-            {'ts_code': '159605.SZ', 'name': '中概互联ETF'},
-            {'ts_code': '159929.SZ', 'name': '医药ETF'},
-            {'ts_code': '159828.SZ', 'name': '医疗ETF'},
-            {'ts_code': '159559.SZ', 'name': '机器人50ETF'},
-            {'ts_code': '159838.SZ', 'name': '医药50ETF'},
-            {'ts_code': '159855.SZ', 'name': '影视ETF'},
-            {'ts_code': '159760.SZ', 'name': '医疗健康ETF泰康'},
-            {'ts_code': '159228.SZ', 'name': '红利低波ETF长城'},
-            {'ts_code': '159213.SZ', 'name': '机器人ETF基金'},
-            {'ts_code': '159850.SZ', 'name': '恒生国企ETF'},
-            {'ts_code': '159622.SZ', 'name': '创新药ETF沪港深'},
-            {'ts_code': '159938.SZ', 'name': '医药卫生ETF'},
-            {'ts_code': '159391.SZ', 'name': '大盘价值ETF'},
-            {'ts_code': '159688.SZ', 'name': '恒生互联网ETF'},
-            {'ts_code': '159931.SZ', 'name': '金融ETF'},
-            {'ts_code': '159202.SZ', 'name': '恒生互联网科技ETF'},
-            {'ts_code': '159837.SZ', 'name': '生物科技ETF'},
-            {'ts_code': '159303.SZ', 'name': '恒生医疗ETF基金'},
-            {'ts_code': '159740.SZ', 'name': '恒生科技ETF'},
-            {'ts_code': '159550.SZ', 'name': '互联网ETF沪港深'},
-            {'ts_code': '159849.SZ', 'name': '生物科技指数ETF'},
-            {'ts_code': '159525.SZ', 'name': '红利低波ETF'},
-            {'ts_code': '159859.SZ', 'name': '生物医药ETF'},
-            {'ts_code': '159741.SZ', 'name': '恒生科技ETF嘉实'},
-            {'ts_code': '159748.SZ', 'name': '创新药ETF富国'},
-            {'ts_code': '159365.SZ', 'name': '恒指ETF'},
-            {'ts_code': '159776.SZ', 'name': '港股通医药ETF'},
-            {'ts_code': '159718.SZ', 'name': '港股医药ETF'},
-            {'ts_code': '159839.SZ', 'name': '生物药ETF'},
-            {'ts_code': '159858.SZ', 'name': '创新药ETF南方'},
-            {'ts_code': '159747.SZ', 'name': '香港科技ETF'},
-            {'ts_code': '159657.SZ', 'name': '疫苗ETF鹏华'},
-            {'ts_code': '159636.SZ', 'name': '港股通科技30ETF'},
-            {'ts_code': '159933.SZ', 'name': '国投金融地产ETF'},
-            {'ts_code': '159751.SZ', 'name': '港股科技ETF'},
-            {'ts_code': '159382.SZ', 'name': '创业板人工智能ETF南方'},
-            {'ts_code': '159323.SZ', 'name': '港股通汽车ETF'},
-            {'ts_code': '159246.SZ', 'name': '创业板人工智能ETF富国'},
-            {'ts_code': '159508.SZ', 'name': '生物医药ETF基金'},
-            {'ts_code': '159670.SZ', 'name': '消费ETF基金'},
-            {'ts_code': '159378.SZ', 'name': '通用航空ETF'},
-            {'ts_code': '159787.SZ', 'name': '建材ETF易方达'},
-            {'ts_code': '159852.SZ', 'name': '软件ETF'},
-            {'ts_code': '159557.SZ', 'name': '恒生医疗ETF'},
-            {'ts_code': '159899.SZ', 'name': '软件龙头ETF'},
-            {'ts_code': '159867.SZ', 'name': '畜牧ETF'},
-            {'ts_code': '159992.SZ', 'name': '创新药ETF'},
-            {'ts_code': '159835.SZ', 'name': '创新药50ETF'},
-            {'ts_code': '159262.SZ', 'name': '港股通科技ETF'},
-            {'ts_code': '159798.SZ', 'name': '消费ETF易方达'},
-            {'ts_code': '159750.SZ', 'name': '港股科技50ETF'},
-            {'ts_code': '159865.SZ', 'name': '养殖ETF'},
-            {'ts_code': '159892.SZ', 'name': '恒生医药ETF'},
-            {'ts_code': '159643.SZ', 'name': '疫苗ETF'},
-            {'ts_code': '159645.SZ', 'name': '疫苗ETF富国'},
-            {'ts_code': '159377.SZ', 'name': '创业板医药ETF国泰'},
-            {'ts_code': '159745.SZ', 'name': '建材ETF'},
-            {'ts_code': '159960.SZ', 'name': '恒生中国企业ETF'},
-            {'ts_code': '159590.SZ', 'name': '软件50ETF'},
-            {'ts_code': '159647.SZ', 'name': '中药ETF'},
-            {'ts_code': '159568.SZ', 'name': '港股互联网ETF'},
-            {'ts_code': '159586.SZ', 'name': '计算机ETF南方'},
-            {'ts_code': '159239.SZ', 'name': '港股通汽车ETF富国'},
-            {'ts_code': '159735.SZ', 'name': '港股消费ETF'},
-            {'ts_code': '159561.SZ', 'name': '德国ETF'},
-            {'ts_code': '159689.SZ', 'name': '消费ETF南方'},
-            {'ts_code': '159615.SZ', 'name': '恒生生物科技ETF'},
-            {'ts_code': '159843.SZ', 'name': '食品饮料ETF'},
-            {'ts_code': '159736.SZ', 'name': '食品饮料ETF天弘'},
-            {'ts_code': '159672.SZ', 'name': '主要消费ETF'},
-            {'ts_code': '159928.SZ', 'name': '消费ETF'},
-            {'ts_code': '159269.SZ', 'name': '港股通科技ETF南方'},
-            {'ts_code': '159792.SZ', 'name': '港股通互联网ETF'},
-            {'ts_code': '159638.SZ', 'name': '高端装备ETF'},
-            {'ts_code': '159506.SZ', 'name': '港股通医疗ETF富国'},
-            {'ts_code': '159237.SZ', 'name': '港股汽车ETF基金'},
-            {'ts_code': '159265.SZ', 'name': '港股消费50ETF'},
-            {'ts_code': '159518.SZ', 'name': '标普油气ETF'},
-            {'ts_code': '159985.SZ', 'name': '豆粕ETF'},
-            {'ts_code': '159230.SZ', 'name': '通用航空ETF基金'},
-            {'ts_code': '159862.SZ', 'name': '食品ETF'},
-            {'ts_code': '159231.SZ', 'name': '通用航空ETF华宝'},
-            {'ts_code': '159268.SZ', 'name': '港股通消费50ETF'},
-            {'ts_code': '159245.SZ', 'name': '港股通消费ETF'},
-            {'ts_code': '159210.SZ', 'name': '港股汽车ETF'},
-            {'ts_code': '159887.SZ', 'name': '银行ETF'},
-            {'ts_code': '159392.SZ', 'name': '航空ETF'},
-            {'ts_code': '159699.SZ', 'name': '恒生消费ETF'},
-            {'ts_code': '159241.SZ', 'name': '航空航天ETF天弘'},
-            {'ts_code': '159227.SZ', 'name': '航空航天ETF'},
-            {'ts_code': '159208.SZ', 'name': '航天航空ETF'},
-            {'ts_code': '159570.SZ', 'name': '港股通创新药ETF'},
-            {'ts_code': '159316.SZ', 'name': '恒生创新药ETF'},
-            {'ts_code': '159217.SZ', 'name': '港股通创新药ETF工银'},
-            {'ts_code': '159567.SZ', 'name': '港股创新药ETF'},
-            {'ts_code': '159981.SZ', 'name': '能源化工ETF'},
-            {'ts_code': '159851.SZ', 'name': '金融科技ETF'},
-            {'ts_code': '159529.SZ', 'name': '标普消费ETF'},
-            {'ts_code': '159876.SZ', 'name': '有色龙头ETF'},
-            {'ts_code': '159977.SZ', 'name': '创业板ETF天弘'},
-            
-            # 补充一些重要的上海交易所ETF
-            {'ts_code': '510300.SH', 'name': '沪深300ETF'},
-            {'ts_code': '510050.SH', 'name': '上证50ETF'},
-            {'ts_code': '510500.SH', 'name': '中证500ETF'},
-            {'ts_code': '512880.SH', 'name': '证券ETF'},
-            {'ts_code': '518880.SH', 'name': '黄金ETF'},
-            {'ts_code': '513100.SH', 'name': '纳斯达克ETF'},
-            {'ts_code': '513500.SH', 'name': '标普500ETF'},
-            {'ts_code': '513050.SH', 'name': '中概互联网ETF'},
-            {'ts_code': '512000.SH', 'name': '券商ETF'},
-            {'ts_code': '588000.SH', 'name': '科创50ETF'},
-            {'ts_code': '512010.SH', 'name': '医药ETF'},
-            {'ts_code': '512480.SH', 'name': '半导体ETF'},
-            {'ts_code': '512760.SH', 'name': '芯片ETF'},
-            {'ts_code': '512800.SH', 'name': '银行ETF'},
-            {'ts_code': '512660.SH', 'name': '军工ETF'},
-            {'ts_code': '512400.SH', 'name': '有色金属ETF'},
-            {'ts_code': '512690.SH', 'name': '酒ETF'},
-            {'ts_code': '515030.SH', 'name': '新能源汽车ETF'},
-            {'ts_code': '513660.SH', 'name': '恒生ETF'},
-            {'ts_code': '510900.SH', 'name': 'H股ETF'},
-            {'ts_code': '513130.SH', 'name': '恒生科技ETF'},
-            {'ts_code': '511260.SH', 'name': '国债ETF'},
-            {'ts_code': '511380.SH', 'name': '可转债ETF'}
-        ]
-        full_etf_list = complete_etfs
+        full_etf_list = self.universe.to_frame()
         
         print(f"📊 ETF总数: {len(full_etf_list)}")
-        return pd.DataFrame(full_etf_list)
+        return full_etf_list
+    
+    def plan_lookback_bars(self):
+        """所有因子中最长的K线需求，加上缺失K线的预留"""
+        return max(self.factor_bar_requirements.values()) + self.lookback_buffer_bars
+    
+    def lookback_start(self, bars):
+        """覆盖最近 bars 个交易日所需的最早自然日"""
+        last_session = self.calendar.last_session(exchange_now(), self.market_close_time)
+        return self.calendar.shift(last_session, -(bars - 1))
+    
+    def last_market_close(self, now):
+        """最近一次已收盘的时间（按交易日历）"""
+        close_hour, close_minute = self.market_close_time
+        session = self.calendar.last_session(now, self.market_close_time)
+        return session + pd.Timedelta(hours=close_hour, minutes=close_minute)
+    
+    def plan_fetch(self, ts_code, bars):
+        """
+        规划单只ETF需要下载的区间
+        
+        返回 (本地数据, 下载起点, 覆盖起点)；下载起点为None表示本地数据已是最新
+        """
+        end_date = exchange_now()
+        window_start = self.lookback_start(bars or self.lookback_bars)
+        
+        checked_at = self.store.checked_at(ts_code)
+        refreshed = checked_at is not None and self.refresh and checked_at >= self.refresh_started
+        cached = None if self.refresh and not refreshed else self.store.load(ts_code)
+        coverage_start = self.store.coverage_start(ts_code)
+        if self.provider.offline:
+            # 离线数据源：本地行情库有什么用什么
+            return cached, None, coverage_start
+        if cached is None or cached.empty or coverage_start is None or coverage_start > window_start:
+            # 本地没有或覆盖不足：全量下载
+            return None, window_start, window_start
+        
+        # 收盘后检查过即为最新（停牌ETF也不会反复下载）
+        if checked_at is not None and checked_at >= self.last_market_close(end_date):
+            return cached, None, coverage_start
+        
+        # 从最后一根K线当天开始下载：盘中抓到的未收盘K线会被收盘数据覆盖
+        return cached, cached['trade_date'].iloc[-1], coverage_start
+    
+    def window_daily_data(self, df, bars):
+        """截取最近 bars 个交易日的数据，不足 min_required_days 时返回None"""
+        if df is None or df.empty:
+            return None
+        window_start = self.lookback_start(bars or self.lookback_bars)
+        df = df[df['trade_date'] >= window_start].reset_index(drop=True)
+        if len(df) < self.min_required_days:
+            return None
+        return df
     
-    def get_etf_daily_data(self, ts_code, days=250):
+    def get_etf_daily_data(self, ts_code, bars=None):
         """
-        使用yfinance获取ETF日线数据
+        获取ETF日线数据：优先读取本地行情库，只从数据源下载缺失的区间
         """
+        cached, start_date, coverage_start = self.plan_fetch(ts_code, bars)
+        if start_date is None:
+            return self.window_daily_data(cached, bars)
+        
         try:
-            # 添加随机延迟，避免请求过快
-            time.sleep(random.uniform(0.3, 0.8))
-            
-            # 转换代码格式
-            code_clean = ts_code.split('.')[0]
-            if ts_code.endswith('.SH'):
-                yf_code = f"{code_clean}.SS"
-            else:
-                yf_code = f"{code_clean}.SZ"
-            
-            # 计算日期范围
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # 使用yfinance获取数据
-            stock = yf.Ticker(yf_code)
-            df = stock.history(start=start_date, end=end_date)
-            
-            if df.empty or len(df) < self.min_required_days:
+            checked_at = exchange_now()
+            new_df = self.provider.fetch(ts_code, start_date, checked_at)
+            if cached is None and new_df is None:
                 return None
-            
-            # 重置索引并规范列名
-            df = df.reset_index()
-            df = df.rename(columns={
-                'Date': 'trade_date', 
-                'Open': 'open', 
-                'High': 'high', 
-                'Low': 'low', 
-                'Close': 'close', 
-                'Volume': 'volume'
-            })
-            df['trade_date'] = pd.to_datetime(df['trade_date'])
-            return df
+            merged = self.store.append(ts_code, cached, new_df, coverage_start, checked_at)
+            return self.window_daily_data(merged, bars)
         except Exception as e:
             print(f"  ❌ 数据获取失败 {ts_code}: {e}")
-            return None
+            # 网络失败时退回本地已有数据
+            return self.window_daily_data(cached, bars)
+    
+    def get_etf_daily_data_batch(self, plans, bars=None):
+        """
+        批量获取同一下载起点的多只ETF，plans 为 {ts_code: (本地数据, 下载起点, 覆盖起点)}
+        
+        返回 {ts_code: DataFrame或None}，None 表示该ETF需要逐只重试
+        """
+        ts_codes = list(plans)
+        start_date = plans[ts_codes[0]][1]
+        checked_at = exchange_now()
+        downloaded = self.provider.fetch_batch(ts_codes, start_date, checked_at)
+        
+        results = {}
+        for ts_code in ts_codes:
+            cached, _, coverage_start = plans[ts_code]
+            new_df = downloaded.get(ts_code)
+            if new_df is None:
+                # 有本地数据时视为暂无新K线，否则交给逐只重试
+                results[ts_code] = self.window_daily_data(cached, bars) if cached is not None else None
+                continue
+            merged = self.store.append(ts_code, cached, new_df, coverage_start, checked_at)
+            results[ts_code] = self.window_daily_data(merged, bars)
+        return results
+    
+    def iter_etf_daily_data(self, ts_codes, bars=None):
+        """
+        并发抓取多只ETF的日线数据，按完成顺序逐个返回 (ts_code, DataFrame或None)
+        """
+        # 本地已是最新的直接返回，其余按下载起点分组后再按数据源的批量上限分批
+        groups = {}
+        for ts_code in ts_codes:
+            plan = self.plan_fetch(ts_code, bars)
+            cached, start_date, _ = plan
+            if start_date is None:
+                yield ts_code, self.window_daily_data(cached, bars)
+            else:
+                groups.setdefault(start_date, {})[ts_code] = plan
+        
+        chunks = []
+        for group in groups.values():
+            group_codes = list(group)
+            chunk_size = self.provider.max_batch_size or len(group_codes)
+            for i in range(0, len(group_codes), chunk_size):
+                chunks.append({ts_code: group[ts_code] for ts_code in group_codes[i:i + chunk_size]})
+        
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            futures = {executor.submit(self.get_etf_daily_data_batch, chunk, bars): chunk
+                       for chunk in chunks}
+            retry_codes = []
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    chunk_results = future.result()
+                except Exception as e:
+                    if len(chunk) == 1:
+                        ts_code = next(iter(chunk))
+                        print(f"  ❌ 数据获取失败 {ts_code}: {e}")
+                        yield ts_code, self.window_daily_data(chunk[ts_code][0], bars)
+                        continue
+                    print(f"  ⚠️ 批量下载失败 ({next(iter(chunk))} 等{len(chunk)}只)，改为逐只下载: {e}")
+                    retry_codes.extend(chunk)
+                    continue
+                for ts_code, df in chunk_results.items():
+                    if df is None and chunk[ts_code][0] is None and len(chunk) > 1:
+                        # 单只缺失可能是临时错误，稍后逐只重试一次
+                        retry_codes.append(ts_code)
+                    else:
+                        yield ts_code, df
+            
+            futures = {executor.submit(self.get_etf_daily_data, ts_code, bars): ts_code
+                       for ts_code in retry_codes}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        
+        if self.refresh:
+            # 全部ETF都已处理完，本轮刷新结束，下次 --refresh 重新开始
+            self.store.finish_refresh()
+    
+    def build_price_panel(self, ts_codes, bars=None, root=None, frames=None):
+        """
+        构建对齐面板并落盘，返回内存映射打开的面板；frames 中没有的ETF从本地行情库读取
+        """
+        frames = dict(frames or {})
+        for ts_code in ts_codes:
+            if ts_code not in frames:
+                frames[ts_code] = self.window_daily_data(self.store.load(ts_code), bars)
+        panel = PricePanel.from_frames(frames, symbols=[ts_code for ts_code in ts_codes
+                                                        if frames.get(ts_code) is not None])
+        root = root or self.panel_folder
+        panel.save(root)
+        return PricePanel.open(root)
+    
+    def check_data_quality(self, panel):
+        """
+        对面板做向量化数据质量检查，打印汇总并保存每只ETF的问题计数
+        """
+        start = time.perf_counter()
+        clean_panel, report = clean_price_panel(panel, max_abs_return=self.max_abs_daily_return,
+                                                stale_days=self.stale_close_days)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        report.to_csv(os.path.join(self.panel_folder, 'quality_report.csv'), encoding='utf-8-sig')
+        
+        totals = report.drop(columns='valid_bars').sum()
+        flagged = int((report.drop(columns='valid_bars').sum(axis=1) > 0).sum())
+        print(f"🩺 数据质量检查 ({elapsed_ms:.1f}ms): 非正价格 {totals['non_positive']} | "
+              f"高低价异常 {totals['bad_high_low']} | 停牌填充 {totals['suspended']} | "
+              f"收盘价长期不变 {totals['stale_close']} | 异常收益 {totals['outlier_return']} "
+              f"(剔除尖峰 {totals['spike_removed']}) | 涉及ETF {flagged}只")
+        return clean_panel, report
     
     # ==================== 技术指标计算函数 ====================
     
@@ -671,14 +2248,9 @@ class CompleteETFDailyRating:
         if len(prices) < period:
             return np.nan
         
-        log_prices = np.log(prices.iloc[-period:].values)
-        x = np.arange(len(log_prices))
-        
-        try:
-            slope, _, _, _, _ = linregress(x, log_prices)
-            return slope
-        except:
-            return np.nan
+        log_prices = np.log(np.asarray(prices.iloc[-period:].values, dtype=np.float64))
+        slope, _ = ols_slope(log_prices[np.newaxis, :], period)
+        return slope[0]
     
     def calculate_volatility(self, returns, period=60):
         """计算年化波动率"""
@@ -702,11 +2274,15 @@ class CompleteETFDailyRating:
     
     def calculate_adx(self, high, low, close, period=14):
         """
-        计算平均趋向指数ADX - 使用ta库版本
+        计算平均趋向指数ADX - 使用ta库版本，未安装ta时使用 wilder_adx_atr
         """
         if len(close) < period + 10:
             return np.nan
         
+        if ta is None:
+            return wilder_adx_atr(high.values[np.newaxis, :], low.values[np.newaxis, :],
+                                  close.values[np.newaxis, :], period)['adx'][0]
+        
         try:
             # 使用ta库计算ADX
             adx_indicator = ta.trend.ADXIndicator(
@@ -731,11 +2307,15 @@ class CompleteETFDailyRating:
     
     def calculate_atr(self, high, low, close, period=14):
         """
-        计算平均真实波幅ATR - 使用ta库版本
+        计算平均真实波幅ATR - 使用ta库版本，未安装ta时使用 wilder_adx_atr
         """
         if len(close) < period + 1:
             return np.nan
         
+        if ta is None:
+            return wilder_adx_atr(high.values[np.newaxis, :], low.values[np.newaxis, :],
+                                  close.values[np.newaxis, :], period)['atr'][0]
+        
         try:
             # 使用ta库计算ATR
             atr_indicator = ta.volatility.AverageTrueRange(
@@ -749,37 +2329,250 @@ class CompleteETFDailyRating:
         except Exception as e:
             return np.nan
     
-    def cross_sectional_zscores(self, factor_values):
-        """截面标准化"""
-        valid_values = [v for v in factor_values if not np.isnan(v)]
+    def compute_etf_factors(self, ts_code, name, daily_data):
+        """
+        计算单只ETF的全部因子，数据不足时返回None
+        """
+        if daily_data is None or len(daily_data) < self.min_required_days:
+            return None
+        
+        # 准备数据
+        close_prices = daily_data['close']
+        current_price = close_prices.iloc[-1]
+        prev_close = close_prices.iloc[-2] if len(close_prices) >= 2 else current_price
+        
+        # 计算收益率
+        returns = close_prices.pct_change().dropna()
+        if len(returns) < self.min_required_days:
+            return None
+        
+        # 计算各因子
+        # 1. 动量因子
+        mom_1m, mom_3m, mom_6m = self.calculate_momentum(close_prices)
+        
+        if np.isnan(mom_1m) or np.isnan(mom_3m) or np.isnan(mom_6m):
+            momentum_combo = np.nan
+        else:
+            momentum_combo = (self.weight_mom_1m * mom_1m +
+                             self.weight_mom_3m * mom_3m +
+                             self.weight_mom_6m * mom_6m)
+        
+        # 计算趋势斜率
+        slope = self.calculate_slope(close_prices)
+        
+        # 计算动量得分
+        if np.isnan(momentum_combo) or np.isnan(slope):
+            momentum_score = np.nan
+        else:
+            momentum_score = 0.7 * momentum_combo + 0.3 * slope
+        
+        # 2. 波动率因子
+        volatility = self.calculate_volatility(returns)
+        
+        # 3. 夏普比率
+        sharpe = self.calculate_sharpe(returns)
+        
+        # 4. 趋势质量因子
+        adx = self.calculate_adx(daily_data['high'], daily_data['low'], daily_data['close'])
+        ma200_filter = self.calculate_ma200_filter(daily_data['close'])
+        
+        if np.isnan(adx) or np.isnan(ma200_filter):
+            trend_quality_score = np.nan
+        else:
+            trend_quality_score = self.weight_adx * adx + self.weight_ma200 * ma200_filter
+        
+        # 计算ATR用于挂单建议
+        atr = self.calculate_atr(daily_data['high'], daily_data['low'], daily_data['close'])
+        
+        return {
+            'ts_code': ts_code,
+            'name': name,
+            'current_price': current_price,
+            'prev_close': prev_close,
+            'price_change_pct': (current_price - prev_close) / prev_close if prev_close > 0 else 0,
+            'momentum_score': momentum_score if not np.isnan(momentum_score) else 0,
+            'volatility': volatility if not np.isnan(volatility) else 0,
+            'sharpe': sharpe if not np.isnan(sharpe) else 0,
+            'trend_quality': trend_quality_score if not np.isnan(trend_quality_score) else 0,
+            'atr': atr if not np.isnan(atr) else 0,
+            'mom_1m': mom_1m if not np.isnan(mom_1m) else 0,
+            'mom_3m': mom_3m if not np.isnan(mom_3m) else 0,
+            'mom_6m': mom_6m if not np.isnan(mom_6m) else 0
+        }
+    
+    def compute_factor_table(self, panel, ts_codes):
+        """
+        在行情面板上批量计算多只ETF的因子，结果与逐只调用 compute_etf_factors 一致
         
-        if len(valid_values) < 2:
-            return factor_values
+        全部因子由 PanelFactorEngine 一次向量化完成，直接组成 RatingTable，数据不足的ETF不出现在结果中
+        """
+        ts_codes = [ts_code for ts_code in ts_codes if ts_code in panel.symbol_index]
+        if not ts_codes:
+            return RatingTable.empty(self.universe)
+        kept, columns = self.compute_factor_columns(panel, ts_codes)
+        return RatingTable(self.universe, self.universe.positions_of(kept), columns)
+    
+    def compute_factor_columns(self, panel, ts_codes):
+        """面板上计算给定ETF（须都在面板中）的因子，返回 (数据充足的 ts_code 数组, 因子列)"""
+        rows = np.array([panel.symbol_index[ts_code] for ts_code in ts_codes])
+        close, order = right_align_panel(np.asarray(panel['close'][rows], dtype=np.float64))
+        high, _ = right_align_panel(np.asarray(panel['high'][rows], dtype=np.float64), order)
+        low, _ = right_align_panel(np.asarray(panel['low'][rows], dtype=np.float64), order)
+        n_bars = (~np.isnan(close)).sum(axis=1)
         
-        # 去极值
+        factors = self.factor_engine.latest(close, high, low)
+        eligible, columns = self.factor_columns(factors, close[:, -1], close[:, -2], n_bars)
+        return np.asarray(ts_codes, dtype=str)[eligible], columns
+    
+    def factor_settings(self):
+        """因子计算依赖的参数，传给工作进程重建轻量评级对象"""
+        keys = ['min_required_days', 'lookback_bars', 'factor_engine', 'weight_mom_1m', 'weight_mom_3m',
+                'weight_mom_6m', 'weight_adx', 'weight_ma200']
+        return {key: getattr(self, key) for key in keys}
+    
+    def start_factor_pool(self, shared, processes, settings=None):
+        """启动挂载共享内存面板的进程池，每个进程持有只带 settings（默认因子参数）的轻量评级对象"""
+        # Linux 默认 fork，子进程继承已初始化的BLAS线程池，环境变量不再起作用，线程数由 threadpoolctl 在初始化时限制；
+        # 环境变量只对 spawn 方式（Windows / macOS）有效
+        if threadpool_limits is None:
+            print("⚠️ 未安装 threadpoolctl，--blas-threads 在 fork 启动的进程中不生效（pip install threadpoolctl）")
+        saved_env = {key: os.environ.get(key) for key in BLAS_THREAD_ENV}
+        os.environ.update({key: str(self.blas_threads) for key in BLAS_THREAD_ENV})
         try:
-            winsorized = winsorize(valid_values, limits=[0.05, 0.05])
-        except:
-            winsorized = valid_values
-        
-        # 标准化
-        mean = np.mean(winsorized)
-        std = np.std(winsorized)
-        
-        if std == 0:
-            return [0] * len(factor_values)
-        
-        # 将原始因子值替换为标准化后的值
-        z_scores = []
-        valid_index = 0
-        for v in factor_values:
-            if np.isnan(v):
-                z_scores.append(np.nan)
-            else:
-                z_scores.append((winsorized[valid_index] - mean) / std)
-                valid_index += 1
+            return multiprocessing.Pool(processes, initializer=_factor_worker_init,
+                                        initargs=(shared.spec, settings or self.factor_settings(),
+                                                  self.blas_threads))
+        finally:
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+    
+    def compute_factor_table_parallel(self, panel, ts_codes, processes=None):
+        """
+        多进程版 compute_factor_table：面板放入共享内存，ETF按分片交给进程池，各片的因子列按分片顺序拼接，与单进程一致
+        """
+        processes = processes or self.factor_processes
+        ts_codes = [ts_code for ts_code in ts_codes if ts_code in panel.symbol_index]
+        if not ts_codes:
+            return RatingTable.empty(self.universe)
+        # 每个进程分到若干片，耗时不均时可互相补位
+        shard_count = min(len(ts_codes), processes * 4)
+        shards = [list(shard) for shard in np.array_split(np.array(ts_codes, dtype=object), shard_count)]
+        
+        with SharedPricePanel(panel) as shared:
+            with self.start_factor_pool(shared, processes) as pool:
+                jobs = [pool.apply_async(_factor_worker_run, (shard,)) for shard in shards]
+                results = [job.get() for job in jobs]
+        kept = np.concatenate([codes for codes, _ in results])
+        columns = {key: np.concatenate([shard_columns[key] for _, shard_columns in results])
+                   for key in RATING_COLUMNS}
+        return RatingTable(self.universe, self.universe.positions_of(kept), columns)
+    
+    def composite_factors(self, factors):
+        """由基础因子组合出参与打分的四个因子（动量得分、波动率、夏普、趋势质量），缺失仍为NaN"""
+        momentum_combo = (self.weight_mom_1m * factors['mom_1m'] +
+                          self.weight_mom_3m * factors['mom_3m'] +
+                          self.weight_mom_6m * factors['mom_6m'])
+        return {
+            'momentum_score': 0.7 * momentum_combo + 0.3 * factors['slope'],
+            'volatility': factors['volatility'],
+            'sharpe': factors['sharpe'],
+            'trend_quality': self.weight_adx * factors['adx'] + self.weight_ma200 * factors['ma200_filter'],
+        }
+    
+    def score_weights(self):
+        """综合得分权重，顺序对应 [动量得分, -波动率, 夏普, 趋势质量]"""
+        return np.array([self.weight_momentum, self.weight_volatility,
+                         self.weight_risk_adjusted, self.weight_trend_quality])
+    
+    def factor_columns(self, factors, current_price, prev_close, n_bars):
+        """
+        由因子数组组装评级结果列（与 compute_etf_factors 的字段和缺失值处理一致）
+        
+        返回 (数据充足的行掩码, 按 RATING_COLUMNS 定类型且只含这些行的列)
+        """
+        # 收益率个数为K线数减一，两者都需满足最少天数
+        eligible = (n_bars >= self.min_required_days) & (n_bars - 1 >= self.min_required_days)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            price_change_pct = np.where(prev_close > 0, (current_price - prev_close) / prev_close, 0)
+        factor_values = {
+            **self.composite_factors(factors),
+            'atr': factors['atr'],
+            'mom_1m': factors['mom_1m'],
+            'mom_3m': factors['mom_3m'],
+            'mom_6m': factors['mom_6m'],
+        }
+        columns = {
+            'current_price': current_price,
+            'prev_close': prev_close,
+            'price_change_pct': price_change_pct,
+            **{key: np.nan_to_num(values, nan=0.0) for key, values in factor_values.items()},
+        }
+        return eligible, {key: np.asarray(columns[key][eligible], dtype=dtype) for key, dtype in RATING_COLUMNS.items()}
+    
+    def update_factor_state(self, panel, ts_codes):
+        """
+        用面板中的新K线增量更新持久化的因子状态，并据此给出评级结果表
+        
+        首次出现、截至上次K线的最近数据与上次不一致（数据修正）或要求重建的ETF，清空后用面板全部K线重建；
+        其余ETF只推进上次之后的新K线
+        """
+        params = {
+            'momentum_periods': self.factor_engine.momentum_periods,
+            'vol_period': self.factor_engine.vol_period,
+            'slope_period': self.factor_engine.slope_period,
+            'ma_period': self.factor_engine.ma_period,
+            'adx_period': self.factor_engine.adx_period,
+            'annualization': self.factor_engine.annualization,
+        }
+        state = None if self.rebuild_factor_state else FactorState.load(self.factor_state_file, **params)
+        if state is None:
+            state = FactorState([], **params)
+        ts_codes = [ts_code for ts_code in ts_codes if ts_code in panel.symbol_index]
+        if not ts_codes:
+            return RatingTable.empty(self.universe)
+        state.add_symbols(ts_codes)
+        rows = np.array([state.symbol_index[ts_code] for ts_code in ts_codes])
+        panel_rows = np.array([panel.symbol_index[ts_code] for ts_code in ts_codes])
         
-        return z_scores
+        last_dates = state.arrays['last_date'][rows]
+        rebuild = np.array([
+            pd.isna(last_date) or
+            panel.row_digest(ts_code, end=last_date, bars=self.state_check_bars) != state.arrays['check_digest'][row]
+            for ts_code, row, last_date in zip(ts_codes, rows, last_dates)
+        ], dtype=bool)
+        state.reset(rows[rebuild])
+        # 重建的ETF从面板第一根K线灌入，其余只推进上次之后的K线
+        start_dates = np.where(rebuild, np.datetime64('NaT'), last_dates)
+        
+        dates = panel.dates.values.astype('datetime64[D]')
+        n = len(state.symbols)
+        for t, date in enumerate(dates):
+            feed = np.isnat(start_dates) | (date > start_dates)
+            if not feed.any():
+                continue
+            bars = {}
+            for field in ['high', 'low', 'close']:
+                values = np.full(n, np.nan)
+                values[rows[feed]] = panel[field][panel_rows[feed], t]
+                bars[field] = values
+            state.update(bars['high'], bars['low'], bars['close'], date)
+        
+        for ts_code, row in zip(ts_codes, rows):
+            last_date = state.arrays['last_date'][row]
+            if not pd.isna(last_date):
+                state.arrays['check_digest'][row] = panel.row_digest(ts_code, end=last_date, bars=self.state_check_bars)
+        state.save(self.factor_state_file)
+        if rebuild.any():
+            print(f"🔁 因子状态重建 {int(rebuild.sum())}只ETF，增量更新 {int((~rebuild).sum())}只ETF")
+        
+        factors = state.values(rows)
+        eligible, columns = self.factor_columns(factors, factors['current_price'], factors['prev_close'],
+                                                factors['n_bars'])
+        return RatingTable(self.universe, self.universe.positions_of(np.asarray(ts_codes, dtype=str)[eligible]),
+                           columns)
     
     def generate_complete_rating(self):
         """
@@ -791,130 +2584,105 @@ class CompleteETFDailyRating:
         # 获取全市场ETF列表
         etf_list = self.get_all_etf_list()
         
-        # 存储ETF详细数据
-        etf_details = []
-        successful_count = 0
+        # 中断后重跑由本地行情库续传：已写入行情库且收盘后检查过的ETF不会重新下载，
+        # 行情未变的ETF再由因子缓存直接复用结果
+        pending_codes = list(etf_list['ts_code'])
         total_count = len(etf_list)
         
-        print(f"📊 开始分析 {total_count} 只ETF...")
+        print(f"📊 开始分析 {total_count} 只ETF (并发线程: {self.fetch_workers}, 限速: {self.fetch_rate}次/秒)...")
         
-        # 对每个ETF计算因子
-        for idx, row in etf_list.iterrows():
-            ts_code = row['ts_code']
-            name = row['name']
-            
+        # 并发获取历史数据（写入本地行情库）
+        frames = {}
+        for idx, (ts_code, daily_data) in enumerate(self.iter_etf_daily_data(pending_codes, self.lookback_bars)):
             # 每20个ETF显示一次进度
             if idx % 20 == 0:
                 elapsed_time = time.time() - start_time
                 etf_per_second = idx / elapsed_time if elapsed_time > 0 else 0
-                remaining_etfs = total_count - idx
+                remaining_etfs = len(pending_codes) - idx
                 estimated_remaining = remaining_etfs / etf_per_second if etf_per_second > 0 else 0
+                done_count = total_count - remaining_etfs
                 
-                print(f"⏳ 进度: {idx}/{total_count} ({idx/total_count*100:.1f}%) - "
-                      f"成功: {successful_count} - "
+                print(f"⏳ 进度: {done_count}/{total_count} ({done_count/total_count*100:.1f}%) - "
+                      f"已获取: {len(frames)} - "
                       f"预计剩余: {estimated_remaining/60:.1f}分钟")
-            
-            # 获取历史数据
-            daily_data = self.get_etf_daily_data(ts_code, self.max_days)
-            if daily_data is None or len(daily_data) < self.min_required_days:
-                continue
-            
-            # 准备数据
-            close_prices = daily_data['close']
-            current_price = close_prices.iloc[-1]
-            prev_close = close_prices.iloc[-2] if len(close_prices) >= 2 else current_price
-            
-            # 计算收益率
-            returns = close_prices.pct_change().dropna()
-            if len(returns) < self.min_required_days:
-                continue
-            
-            # 计算各因子
-            # 1. 动量因子
-            mom_1m, mom_3m, mom_6m = self.calculate_momentum(close_prices)
-            
-            if np.isnan(mom_1m) or np.isnan(mom_3m) or np.isnan(mom_6m):
-                momentum_combo = np.nan
-            else:
-                momentum_combo = (self.weight_mom_1m * mom_1m +
-                                 self.weight_mom_3m * mom_3m +
-                                 self.weight_mom_6m * mom_6m)
-            
-            # 计算趋势斜率
-            slope = self.calculate_slope(close_prices)
-            
-            # 计算动量得分
-            if np.isnan(momentum_combo) or np.isnan(slope):
-                momentum_score = np.nan
-            else:
-                momentum_score = 0.7 * momentum_combo + 0.3 * slope
-            
-            # 2. 波动率因子
-            volatility = self.calculate_volatility(returns)
-            
-            # 3. 夏普比率
-            sharpe = self.calculate_sharpe(returns)
-            
-            # 4. 趋势质量因子
-            adx = self.calculate_adx(daily_data['high'], daily_data['low'], daily_data['close'])
-            ma200_filter = self.calculate_ma200_filter(daily_data['close'])
-            
-            if np.isnan(adx) or np.isnan(ma200_filter):
-                trend_quality_score = np.nan
-            else:
-                trend_quality_score = self.weight_adx * adx + self.weight_ma200 * ma200_filter
-            
-            # 计算ATR用于挂单建议
-            atr = self.calculate_atr(daily_data['high'], daily_data['low'], daily_data['close'])
-            
-            # 存储ETF数据
-            etf_details.append({
-                'ts_code': ts_code,
-                'name': name,
-                'current_price': current_price,
-                'prev_close': prev_close,
-                'price_change_pct': (current_price - prev_close) / prev_close if prev_close > 0 else 0,
-                'momentum_score': momentum_score if not np.isnan(momentum_score) else 0,
-                'volatility': volatility if not np.isnan(volatility) else 0,
-                'sharpe': sharpe if not np.isnan(sharpe) else 0,
-                'trend_quality': trend_quality_score if not np.isnan(trend_quality_score) else 0,
-                'atr': atr if not np.isnan(atr) else 0,
-                'mom_1m': mom_1m if not np.isnan(mom_1m) else 0,
-                'mom_3m': mom_3m if not np.isnan(mom_3m) else 0,
-                'mom_6m': mom_6m if not np.isnan(mom_6m) else 0
-            })
-            
-            successful_count += 1
+            frames[ts_code] = daily_data
+        
+        # 构建对齐的行情面板并落盘，其他进程可零拷贝内存映射读取
+        self.price_panel = self.build_price_panel(etf_list['ts_code'], frames=frames)
+        print(f"🧮 行情面板: {self.price_panel.shape[0]}只ETF × {self.price_panel.shape[1]}个交易日 -> {self.panel_folder}/")
+        
+        # 数据质量检查与修复（整个面板一次向量化完成）
+        clean_panel, quality_report = self.check_data_quality(self.price_panel)
+        
+        # 按清洗后的数据计算因子，输入未变的ETF复用上次结果；缓存和结果都是列，按位置合并
+        factor_cache = self.load_factor_cache()
+        config_key = self.factor_config_key()
+        codes = np.array([ts_code for ts_code in pending_codes if ts_code in clean_panel.symbol_index], dtype=str)
+        digests = np.array([clean_panel.row_digest(ts_code) for ts_code in codes], dtype=str)
+        cached = pd.Index(factor_cache['ts_code']).get_indexer(codes)
+        reuse = cached >= 0
+        reuse[reuse] = ((factor_cache['digest'][cached[reuse]] == digests[reuse])
+                        & (factor_cache['config'][cached[reuse]] == config_key))
+        stale_codes = list(codes[~reuse])
+        # 需要重算的ETF在面板上一次批量计算，或由增量因子状态推进新K线得到
+        if self.incremental_factors:
+            computed = self.update_factor_state(clean_panel, stale_codes)
+        elif self.factor_processes > 1:
+            computed = self.compute_factor_table_parallel(clean_panel, stale_codes)
+        else:
+            computed = self.compute_factor_table(clean_panel, stale_codes)
+        computed_codes = computed.ts_codes
+        computed_at = pd.Index(codes).get_indexer(computed_codes)
+        
+        # 恢复ETF列表原有顺序，保证结果可复现：复用的行取自缓存，重算的行按位置写入；之后的打分、排序与输出都在列上进行
+        found = reuse.copy()
+        found[computed_at] = True
+        columns = {}
+        for key, dtype in RATING_COLUMNS.items():
+            values = np.zeros(len(codes), dtype=dtype)
+            values[reuse] = factor_cache[key][cached[reuse]]
+            values[computed_at] = computed[key]
+            columns[key] = values[found]
+        etf_details = RatingTable(self.universe, self.universe.positions_of(codes[found]), columns)
+        
+        # 重算的ETF替换缓存中的同代码记录，其余记录（包括本次未参与的ETF）原样保留
+        valid = ~np.isnan(np.asarray(clean_panel['close'])[[clean_panel.symbol_index[ts_code]
+                                                           for ts_code in computed_codes]])
+        last_bar = len(clean_panel.dates) - 1 - np.argmax(valid[:, ::-1], axis=1)
+        keep = ~np.isin(factor_cache['ts_code'], computed_codes)
+        self.save_factor_cache({
+            'ts_code': np.concatenate([factor_cache['ts_code'][keep], computed_codes]),
+            'last_date': np.concatenate([factor_cache['last_date'][keep],
+                                         clean_panel.dates.values[last_bar].astype('datetime64[D]')]),
+            'digest': np.concatenate([factor_cache['digest'][keep], digests[computed_at]]),
+            'config': np.concatenate([factor_cache['config'][keep], np.full(len(computed_codes), config_key)]),
+            **{key: np.concatenate([factor_cache[key][keep], computed[key]]) for key in RATING_COLUMNS},
+        })
+        reused_count = int(reuse.sum())
+        if reused_count:
+            print(f"♻️ {reused_count}只ETF行情无变化，复用上次因子结果")
         
         total_time = time.time() - start_time
-        print(f"✅ 数据处理完成! 有效ETF数量: {successful_count}/{total_count}")
+        print(f"✅ 数据处理完成! 有效ETF数量: {len(etf_details)}/{total_count}")
         print(f"⏱️ 总耗时: {total_time/60:.2f}分钟")
         
-        if not etf_details:
+        if not len(etf_details):
             print("❌ 没有足够的有效ETF数据")
             return
         
-        # 因子标准化
-        momentum_scores = [etf['momentum_score'] for etf in etf_details]
-        volatility_scores = [-etf['volatility'] for etf in etf_details]  # 波动率取负值
-        sharpe_scores = [etf['sharpe'] for etf in etf_details]
-        trend_quality_scores = [etf['trend_quality'] for etf in etf_details]
-        
-        z_momentum = self.cross_sectional_zscores(momentum_scores)
-        z_volatility = self.cross_sectional_zscores(volatility_scores)
-        z_sharpe = self.cross_sectional_zscores(sharpe_scores)
-        z_trend_quality = self.cross_sectional_zscores(trend_quality_scores)
+        # 因子标准化（ETF × 因子矩阵一次完成，波动率取负值）
+        factor_matrix = np.column_stack([etf_details['momentum_score'], -etf_details['volatility'],
+                                         etf_details['sharpe'], etf_details['trend_quality']])
+        z_scores = cross_sectional_normalize(factor_matrix)
         
-        # 计算综合得分
-        for i, etf in enumerate(etf_details):
-            total_score = (self.weight_momentum * z_momentum[i] +
-                          self.weight_volatility * z_volatility[i] +
-                          self.weight_risk_adjusted * z_sharpe[i] +
-                          self.weight_trend_quality * z_trend_quality[i])
-            etf_details[i]['total_score'] = total_score
+        # 计算综合得分并排序
+        etf_details['total_score'] = z_scores @ self.score_weights()
+        etf_details = etf_details.sort_by('total_score')
         
-        # 按得分排序
-        etf_details.sort(key=lambda x: x['total_score'], reverse=True)
+        # 收益率高度相关的ETF归为同一簇，推荐持仓时去重（无行情的ETF记为-1）
+        clusters = self.load_correlation_clusters(clean_panel)
+        etf_details['cluster'] = np.array([clusters.get(ts_code, -1) for ts_code in etf_details.ts_codes],
+                                          dtype=np.int32)
         
         # 输出完整排名
         self.print_complete_ranking(etf_details)
@@ -924,6 +2692,403 @@ class CompleteETFDailyRating:
         
         return etf_details
     
+    def historical_scores(self, panel):
+        """
+        在整个面板上计算每个交易日全部ETF的综合得分与名次
+        
+        返回 (scores, ranks, factor_zscores, score_factors)：前两者形状为 ETF × 交易日，
+        factor_zscores 为 BASE_FACTORS 各自逐日标准化后的 ETF × 交易日 × 因子 张量（供权重扫描使用），
+        score_factors 为 SCORE_FACTORS 的原始值（供因子IC分析使用）
+        因子按每只ETF自己的K线序列滚动计算（停牌日跳过，与逐日运行时去掉缺失日一致），停牌日沿用最近一根K线的因子，
+        但与逐日运行相同，回看窗口（lookback_bars 个交易日）内K线不足 min_required_days 时不再评级（长期停牌或已退市）；
+        ADX/ATR 从面板第一根K线起持续平滑，与按固定回看窗口每日重算仅有极小差异
+        """
+        close = np.asarray(panel['close'], dtype=np.float64)
+        n, t_len = close.shape
+        # 每行有效K线移到左侧，在K线序号轴上滚动计算后再放回原日期
+        order = np.argsort(np.isnan(close), axis=1, kind='stable')
+        aligned = {field: np.take_along_axis(np.asarray(panel[field], dtype=np.float64), order, axis=1)
+                   for field in ['high', 'low', 'close']}
+        factors = self.factor_engine.history(aligned['close'], aligned['high'], aligned['low'])
+        composite = self.composite_factors(factors)
+        
+        n_bars = np.arange(1, t_len + 1)[np.newaxis, :]
+        eligible = ((n_bars >= self.min_required_days) & (n_bars - 1 >= self.min_required_days)
+                    & ~np.isnan(aligned['close']))
+        # 每个交易日往前 lookback_bars 个交易日内的K线数，即逐日运行时能取到的K线数
+        counts = np.zeros((n, t_len + 1), dtype=np.int64)
+        np.cumsum(~np.isnan(close), axis=1, out=counts[:, 1:])
+        window_start = np.maximum(np.arange(1, t_len + 1) - self.lookback_bars, 0)
+        window_bars = counts[:, 1:] - counts[:, window_start]
+        in_window = (window_bars >= self.min_required_days) & (window_bars - 1 >= self.min_required_days)
+        
+        def by_date(columns):
+            """K线序号轴上的因子放回日期轴，数据不足处为NaN，停牌日沿用上一根K线直到回看窗口内K线不足"""
+            matrix = np.empty((n, t_len, len(columns)))
+            for k, values in enumerate(columns):
+                values = np.where(eligible, np.nan_to_num(values, nan=0.0), np.nan)
+                placed = np.empty((n, t_len))
+                np.put_along_axis(placed, order, values, axis=1)
+                matrix[:, :, k] = np.where(in_window, _ffill_2d(placed), np.nan)
+            return matrix
+        
+        # 逐日截面标准化后加权
+        matrix = by_date([composite['momentum_score'], -composite['volatility'],
+                          composite['sharpe'], composite['trend_quality']])
+        scores = cross_sectional_normalize(matrix, axis=0) @ self.score_weights()
+        ranking = np.argsort(-scores, axis=0, kind='stable')
+        ranks = np.empty((n, t_len), dtype=np.int64)
+        np.put_along_axis(ranks, ranking, np.arange(1, n + 1)[:, np.newaxis], axis=0)
+        ranks[np.isnan(scores)] = 0
+        
+        base = by_date([-factors[name] if name == 'volatility' else factors[name] for name in BASE_FACTORS])
+        factor_zscores = cross_sectional_normalize(base, axis=0)
+        score_factors = matrix * np.array([1, -1, 1, 1])
+        return scores, ranks, factor_zscores, score_factors
+    
+    def load_history_panel(self, etf_list, start, last_session):
+        """加载覆盖 start 至最近交易日（含首日回看窗口）的清洗后价格面板"""
+        bars = len(self.calendar.trading_days(start, last_session)) + self.lookback_bars
+        print(f"📥 加载价格面板: 每只ETF约{bars}根K线")
+        frames = dict(self.iter_etf_daily_data(list(etf_list['ts_code']), bars))
+        panel = PricePanel.from_frames(frames, symbols=[ts_code for ts_code in etf_list['ts_code']
+                                                        if frames.get(ts_code) is not None])
+        clean_panel, _ = clean_price_panel(panel, max_abs_return=self.max_abs_daily_return,
+                                           stale_days=self.stale_close_days)
+        return clean_panel
+    
+    def backfill_ratings(self, start=None, end=None, years=5, catch_up=False):
+        """
+        回填历史评级：一次加载覆盖整个区间（含回看窗口）的面板，滚动算出每个交易日的得分与名次
+        
+        catch_up=True 时从已保存的历史评级最后一天之后补到最近交易日（用于补上漏跑的日子）
+        """
+        print("🕰️ 开始回填历史评级...")
+        start_time = time.time()
+        last_session = self.calendar.last_session(exchange_now(), self.market_close_time)
+        end = min(pd.Timestamp(end), last_session) if end else last_session
+        
+        history = None
+        if catch_up and os.path.exists(os.path.join(self.rating_history_folder, 'meta.json')):
+            history = RatingHistory.open(self.rating_history_folder)
+            start = history.last_date + pd.Timedelta(days=1)
+        elif start is None:
+            start = end - pd.Timedelta(days=round(years * 365.25))
+        start = pd.Timestamp(start)
+        sessions = self.calendar.trading_days(start, end)
+        if len(sessions) == 0:
+            print("✅ 历史评级已是最新")
+            return history
+        
+        etf_list = self.get_all_etf_list()
+        print(f"📊 回填区间 {sessions[0]:%Y-%m-%d} ~ {sessions[-1]:%Y-%m-%d} ({len(sessions)}个交易日)，"
+              f"{len(etf_list)}只ETF")
+        clean_panel = self.load_history_panel(etf_list, start, last_session)
+        
+        scores, ranks, factor_zscores, score_factors = self.historical_scores(clean_panel)
+        close = np.asarray(clean_panel['close'], dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = close / _prev_valid(close) - 1
+        keep = (clean_panel.dates >= start) & (clean_panel.dates <= end)
+        result = RatingHistory(clean_panel.dates[keep], clean_panel.symbols,
+                               scores[:, keep].T.astype(np.float32), ranks[:, keep].T.astype(np.int16),
+                               returns[:, keep].T.astype(np.float32),
+                               factor_zscores[:, keep].transpose(1, 0, 2).astype(np.float32),
+                               score_factors[:, keep].transpose(1, 0, 2).astype(np.float32))
+        if history is not None:
+            result = history.merge(result)
+        result.save(self.rating_history_folder)
+        
+        print(f"✅ 回填完成: {len(result.dates)}个交易日 × {len(result.symbols)}只ETF -> "
+              f"{self.rating_history_folder}/ (耗时 {time.time() - start_time:.1f}秒)")
+        etf_names = dict(zip(etf_list['ts_code'], etf_list['name']))
+        for date in result.dates[-min(5, len(result.dates)):]:
+            top = result.top(date, self.recommend_n)
+            print(f"   {date:%Y-%m-%d}: " + ", ".join(f"{etf_names.get(ts_code, ts_code)}({score:.2f})"
+                                                   for ts_code, score in top))
+        return result
+    
+    def run_backtest(self, top_n=None, rebalance_days=None, cost=None, history=None, verbose=True):
+        """
+        用历史评级矩阵回测前N名等权轮动策略，返回 (指标dict, 逐日净值DataFrame)
+        """
+        top_n = top_n or self.recommend_n
+        rebalance_days = rebalance_days or self.rebalance_days
+        cost = self.transaction_cost if cost is None else cost
+        if history is None:
+            history = RatingHistory.open(self.rating_history_folder)
+        scores = np.asarray(history.scores, dtype=np.float64)
+        returns = np.asarray(history.returns, dtype=np.float64)
+        
+        signal_idx, trade_idx = self.rebalance_schedule(scores, top_n, rebalance_days)
+        if signal_idx is None:
+            print("❌ 历史评级中没有足够的ETF")
+            return None, None
+        selected, weights = select_top_n(scores[signal_idx], top_n, self.max_position_weight)
+        result = simulate_rotation(returns, trade_idx, selected, weights, cost)
+        
+        start = trade_idx[0] + 1
+        metrics = rotation_metrics(result['daily'][start:], result['turnover'])
+        metrics = {key: float(value) for key, value in metrics.items()}
+        nav = pd.DataFrame({
+            'trade_date': history.dates[start:],
+            'nav': result['nav'][start:] / result['nav'][start - 1],
+            'daily_return': result['daily'][start:],
+        })
+        if verbose:
+            print(f"📈 轮动回测 {history.dates[start]:%Y-%m-%d} ~ {history.dates[-1]:%Y-%m-%d}: "
+                  f"前{top_n}名等权(单只≤{self.max_position_weight:.0%}) | 每{rebalance_days}个交易日调仓 | "
+                  f"单边成本 {cost * 10000:.0f}bp")
+            print(f"   累计收益: {metrics['total_return']:.2%} | 年化收益: {metrics['annual_return']:.2%} | "
+                  f"年化波动: {metrics['annual_volatility']:.2%} | 夏普: {metrics['sharpe']:.2f}")
+            print(f"   最大回撤: {metrics['max_drawdown']:.2%} | 平均单次换手: {metrics['avg_turnover']:.2f} | "
+                  f"年化换手: {metrics['annual_turnover']:.1f}倍")
+        return metrics, nav
+    
+    def rebalance_schedule(self, scores, top_n, rebalance_days):
+        """从首个有足够ETF参与评级的交易日开始，每 rebalance_days 天一个信号日；返回 (信号日位置, 成交日位置)"""
+        rated = (~np.isnan(scores)).sum(axis=1) >= top_n
+        if not rated.any():
+            return None, None
+        signal_idx = np.arange(int(np.argmax(rated)), len(scores) - self.execution_lag, rebalance_days)
+        return signal_idx, signal_idx + self.execution_lag
+    
+    def run_weight_sweep(self, n_configs=10000, seed=0, workers=4, top_n=None, rebalance_days=None, cost=None,
+                         history=None):
+        """
+        在历史标准化因子上批量扫描权重配置，按夏普（高）和换手（低）排序，返回结果DataFrame
+        
+        第0组为当前 weight_* 属性；扫描得分为基础因子标准化值的线性加权，
+        与正式评级（先组合再标准化）略有差别，用于比较配置之间的相对优劣
+        """
+        top_n = top_n or self.recommend_n
+        rebalance_days = rebalance_days or self.rebalance_days
+        cost = self.transaction_cost if cost is None else cost
+        if history is None:
+            history = RatingHistory.open(self.rating_history_folder)
+        signal_idx, trade_idx = self.rebalance_schedule(np.asarray(history.scores), top_n, rebalance_days)
+        if signal_idx is None:
+            print("❌ 历史评级中没有足够的ETF")
+            return None
+        
+        baseline = [getattr(self, name) for name in SWEEP_WEIGHT_NAMES]
+        configs = sample_weight_configs(n_configs, seed=seed, baseline=baseline)
+        print(f"🔬 权重扫描: {len(configs)}组配置 × {len(signal_idx)}个调仓日 × {len(history.symbols)}只ETF "
+              f"(线程: {workers})...")
+        start_time = time.time()
+        metrics = sweep_weight_configs(np.asarray(history.factor_zscores)[signal_idx],
+                                       np.asarray(history.returns, dtype=np.float64), trade_idx, configs,
+                                       top_n=top_n, max_weight=self.max_position_weight, cost_rate=cost,
+                                       eval_start=trade_idx[0] + 1, workers=workers)
+        results = pd.DataFrame(configs, columns=SWEEP_WEIGHT_NAMES)
+        for key, values in metrics.items():
+            results[key] = values
+        results['baseline'] = results.index == 0
+        results = results.sort_values(['sharpe', 'avg_turnover'], ascending=[False, True]).reset_index(drop=True)
+        print(f"✅ 扫描完成，耗时 {time.time() - start_time:.1f}秒")
+        
+        baseline_rank = int(np.flatnonzero(results['baseline'])[0]) + 1
+        print(f"📊 当前权重排名: 第{baseline_rank}/{len(results)}名")
+        print(f"{'排名':<4} {'动量':<6} {'波动':<6} {'夏普权重':<8} {'趋势':<6} {'夏普':<6} {'年化收益':<8} "
+              f"{'最大回撤':<8} {'年化换手':<6}")
+        for i, row in results.head(10).iterrows():
+            print(f"{i + 1:<4} {row['weight_momentum']:<6.2f} {row['weight_volatility']:<6.2f} "
+                  f"{row['weight_risk_adjusted']:<8.2f} {row['weight_trend_quality']:<6.2f} {row['sharpe']:<6.2f} "
+                  f"{row['annual_return']:<8.2%} {row['max_drawdown']:<8.2%} {row['annual_turnover']:<6.1f}")
+        return results
+    
+    def walk_forward_fold(self, panel, lo, hi, train_trades, test_trades, windows, n_configs=500, seed=0, top_n=3,
+                          max_weight=0.35, cost=0.001):
+        """
+        滚动验证的单个折：在训练段上为每组因子窗口扫描权重，取训练期夏普最高的组合，
+        再用历史评级引擎按选定参数给测试段各调仓日打分并选股
+        
+        面板只截取 [lo, hi)（含因子回看窗口），调仓日位置均为完整面板上的位置；
+        训练段的权重扫描用基础因子的线性加权近似正式得分，测试段使用正式得分
+        """
+        sub = panel.slice_dates(lo, hi)
+        close = np.asarray(sub['close'], dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = (close / _prev_valid(close) - 1).T
+        # 训练收益只到测试段第一次调仓的信号日，选参时不会看到之后的行情
+        train_trade = np.asarray(train_trades) - lo
+        train_end = test_trades[0] - self.execution_lag - lo
+        configs = sample_weight_configs(n_configs, seed=seed,
+                                        baseline=[getattr(self, name) for name in SWEEP_WEIGHT_NAMES])
+        
+        best = None
+        for w, window in enumerate(windows):
+            candidate = copy.copy(self)
+            candidate.factor_engine = PanelFactorEngine(**window)
+            _, _, factor_zscores, _ = candidate.historical_scores(sub)
+            metrics = sweep_weight_configs(factor_zscores[:, train_trade - self.execution_lag].transpose(1, 0, 2),
+                                           returns[:train_end + 1], train_trade, configs, top_n=top_n,
+                                           max_weight=max_weight, cost_rate=cost, eval_start=train_trade[0] + 1,
+                                           workers=1)
+            sharpe = np.nan_to_num(metrics['sharpe'], nan=-np.inf)
+            c = int(np.argmax(sharpe))
+            if best is None or sharpe[c] > best['train_sharpe']:
+                best = {'window': w, 'config': configs[c], 'train_sharpe': float(sharpe[c]),
+                        'train_return': float(metrics['annual_return'][c])}
+        
+        chosen = copy.copy(self)
+        chosen.factor_engine = PanelFactorEngine(**windows[best['window']])
+        for name, value in zip(SWEEP_WEIGHT_NAMES, best['config']):
+            setattr(chosen, name, float(value))
+        scores, _, _, _ = chosen.historical_scores(sub)
+        best['selected'], best['weights'] = select_top_n(
+            scores[:, np.asarray(test_trades) - self.execution_lag - lo].T, top_n, max_weight)
+        return best
+    
+    def run_walk_forward(self, folds=20, years=5, train_days=252, n_configs=500, seed=0, processes=None,
+                         top_n=None, rebalance_days=None, cost=None, windows=None):
+        """
+        滚动训练/测试验证：最近 years 年中，首个 train_days 个交易日之后的调仓日依次分成 folds 个测试段，
+        每段用其之前 train_days 个交易日选取因子窗口与权重，各折在进程池中并行（共享只读价格面板），
+        最后把各测试段的选股拼接成一条连续的样本外净值
+        
+        返回 (样本外指标, 当前参数同期指标, 各折明细DataFrame, 逐日净值DataFrame)
+        """
+        top_n = top_n or self.recommend_n
+        rebalance_days = rebalance_days or self.rebalance_days
+        cost = self.transaction_cost if cost is None else cost
+        windows = windows or WALK_FORWARD_WINDOWS
+        lag = self.execution_lag
+        
+        print("🧭 开始滚动验证...")
+        start_time = time.time()
+        last_session = self.calendar.last_session(exchange_now(), self.market_close_time)
+        start = last_session - pd.Timedelta(days=round(years * 365.25))
+        panel = self.load_history_panel(self.get_all_etf_list(), start, last_session)
+        t_len = len(panel.dates)
+        
+        # 测试段从首个完整训练窗口之后开始，调仓日按折数切分
+        test_start = int(np.searchsorted(panel.dates, start)) + train_days + lag
+        trade_idx = np.arange(test_start, t_len - 1, rebalance_days)
+        if len(trade_idx) < folds:
+            print(f"❌ 历史数据不足以切分{folds}个测试段")
+            return None
+        tasks = []
+        for test_trades in np.array_split(trade_idx, folds):
+            train_trades = np.arange(test_trades[0] - lag - train_days, test_trades[0] - lag, rebalance_days)
+            tasks.append({
+                'lo': max(0, int(train_trades[0]) - lag - self.lookback_bars),
+                'hi': int(test_trades[-1]) - lag + 1,
+                'train_trades': train_trades, 'test_trades': test_trades, 'windows': windows,
+                'n_configs': n_configs, 'seed': seed, 'top_n': top_n,
+                'max_weight': self.max_position_weight, 'cost': cost,
+            })
+        
+        processes = min(processes or self.factor_processes or os.cpu_count() or 1, folds)
+        print(f"⚙️ {folds}折 × {len(windows)}组因子窗口 × {n_configs}组权重，训练窗口{train_days}个交易日，"
+              f"进程数: {processes}")
+        if processes > 1:
+            settings = {**self.factor_settings(), 'execution_lag': lag,
+                        **{name: getattr(self, name) for name in SWEEP_WEIGHT_NAMES}}
+            with SharedPricePanel(panel) as shared:
+                with self.start_factor_pool(shared, processes, settings) as pool:
+                    results = pool.map(_walk_forward_worker_run, tasks)
+        else:
+            results = [self.walk_forward_fold(panel, **task) for task in tasks]
+        
+        # 各折选股拼接后整体模拟，折与折之间的换手按实际持仓变化计算
+        close = np.asarray(panel['close'], dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = (close / _prev_valid(close) - 1).T
+        selected = np.concatenate([result['selected'] for result in results])
+        weights = np.concatenate([result['weights'] for result in results])
+        oos = simulate_rotation(returns, trade_idx, selected, weights, cost)
+        eval_start = trade_idx[0] + 1
+        metrics = {key: float(value) for key, value in
+                   rotation_metrics(oos['daily'][eval_start:], oos['turnover']).items()}
+        
+        # 同一测试区间上沿用当前参数的对照
+        scores, _, _, _ = self.historical_scores(panel)
+        base_selected, base_weights = select_top_n(scores[:, trade_idx - lag].T, top_n, self.max_position_weight)
+        base = simulate_rotation(returns, trade_idx, base_selected, base_weights, cost)
+        baseline = {key: float(value) for key, value in
+                    rotation_metrics(base['daily'][eval_start:], base['turnover']).items()}
+        
+        rows = []
+        for k, (task, result) in enumerate(zip(tasks, results)):
+            first = task['test_trades'][0]
+            last = tasks[k + 1]['test_trades'][0] if k + 1 < len(tasks) else t_len - 1
+            window = windows[result['window']]
+            rows.append({
+                'fold': k + 1,
+                'test_start': panel.dates[first + 1],
+                'test_end': panel.dates[last],
+                'factor_window': f"{'-'.join(map(str, window['momentum_periods']))}/{window['vol_period']}/"
+                                 f"{window['slope_period']}",
+                **dict(zip(SWEEP_WEIGHT_NAMES, result['config'])),
+                'train_sharpe': result['train_sharpe'],
+                'test_return': float(np.prod(1 + oos['daily'][first + 1:last + 1]) - 1),
+                'baseline_return': float(np.prod(1 + base['daily'][first + 1:last + 1]) - 1),
+            })
+        fold_table = pd.DataFrame(rows)
+        nav = pd.DataFrame({
+            'trade_date': panel.dates[eval_start:],
+            'nav': oos['nav'][eval_start:] / oos['nav'][eval_start - 1],
+            'baseline_nav': base['nav'][eval_start:] / base['nav'][eval_start - 1],
+        })
+        
+        print(f"✅ 滚动验证完成，耗时 {time.time() - start_time:.1f}秒")
+        print(f"{'折':<4} {'测试区间':<24} {'因子窗口':<16} {'训练夏普':<8} {'测试收益':<8} {'对照收益':<8}")
+        for row in rows:
+            print(f"{row['fold']:<4} {row['test_start']:%Y-%m-%d} ~ {row['test_end']:%Y-%m-%d}  "
+                  f"{row['factor_window']:<16} {row['train_sharpe']:<8.2f} {row['test_return']:<8.2%} "
+                  f"{row['baseline_return']:<8.2%}")
+        print(f"📈 样本外拼接 {panel.dates[eval_start]:%Y-%m-%d} ~ {panel.dates[-1]:%Y-%m-%d}: "
+              f"年化收益 {metrics['annual_return']:.2%} | 夏普 {metrics['sharpe']:.2f} | "
+              f"最大回撤 {metrics['max_drawdown']:.2%} | 年化换手 {metrics['annual_turnover']:.1f}倍")
+        print(f"   当前参数同期: 年化收益 {baseline['annual_return']:.2%} | 夏普 {baseline['sharpe']:.2f} | "
+              f"最大回撤 {baseline['max_drawdown']:.2%} | 年化换手 {baseline['annual_turnover']:.1f}倍")
+        return metrics, baseline, fold_table, nav
+    
+    def run_factor_analytics(self, history=None):
+        """
+        用历史评级计算各组合因子及综合得分的 rank IC、IC衰减、IC信息比率和分组收益，
+        增量更新 factor_analytics/ 并写出汇总报告，返回报告DataFrame
+        """
+        if history is None:
+            history = RatingHistory.open(self.rating_history_folder)
+        score_factors = np.asarray(history.score_factors, dtype=np.float64)
+        if np.isnan(score_factors).all():
+            print("⚠️ 历史评级中没有组合因子数据（请重新 --backfill），仅分析综合得分")
+            factors = {}
+        else:
+            factors = {name: score_factors[:, :, k] for k, name in enumerate(SCORE_FACTORS)}
+        factors['total_score'] = np.asarray(history.scores, dtype=np.float64)
+        
+        previous = None
+        if os.path.exists(os.path.join(self.analytics_folder, 'meta.json')):
+            previous = FactorAnalytics.open(self.analytics_folder)
+        start_time = time.time()
+        analytics, start = FactorAnalytics.update(previous, history.dates, factors, history.returns,
+                                                  horizons=self.ic_horizons, lag=self.execution_lag,
+                                                  quantiles=self.ic_quantiles)
+        analytics.save(self.analytics_folder)
+        report = analytics.summary()
+        report.to_csv(os.path.join(self.analytics_folder, 'ic_report.csv'), index=False, encoding='utf-8-sig')
+        print(f"🔎 因子IC分析 {history.dates[0]:%Y-%m-%d} ~ {history.dates[-1]:%Y-%m-%d}: "
+              f"重算{len(history.dates) - start}个交易日，耗时 {time.time() - start_time:.1f}秒")
+        
+        horizons = self.ic_horizons
+        print(f"{'因子':<16} " + " ".join(f"{f'IC{h}日':<8}" for h in horizons) + " " +
+              " ".join(f"{f'IR{h}日':<8}" for h in horizons) + f" {'多空年化':<8}")
+        for _, row in report.iterrows():
+            print(f"{row['factor']:<16} " + " ".join(f"{row[f'ic_{h}d']:<8.4f}" for h in horizons) + " " +
+                  " ".join(f"{row[f'ic_ir_{h}d']:<8.3f}" for h in horizons) + f" {row['long_short_annual']:<8.2%}")
+        print(f"💾 报告已保存至: {self.analytics_folder}/ic_report.csv")
+        return report
+    
+    def save_backtest(self, metrics, nav, top_n=None):
+        os.makedirs(self.backtest_folder, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+        filename = os.path.join(self.backtest_folder, f'rotation_top{top_n or self.recommend_n}_{timestamp}.csv')
+        nav.to_csv(filename, index=False, encoding='utf-8-sig')
+        print(f"💾 回测净值已保存至: {filename}")
+    
     def print_complete_ranking(self, etf_details):
         """打印完整排名报告"""
         print("\n" + "="*120)
@@ -937,64 +3102,110 @@ class CompleteETFDailyRating:
         print(f"{'排名':<4} {'代码':<12} {'名称':<20} {'当前价':<8} {'涨跌幅':<8} {'综合得分':<10} {'动量':<8} {'波动率':<8} {'夏普':<8} {'趋势质量':<10}")
         print("-" * 120)
         
-        for i, etf in enumerate(etf_details[:self.top_n]):
-            print(f"{i+1:<4} {etf['ts_code']:<12} {etf['name']:<20} {etf['current_price']:<8.3f} "
-                  f"{etf['price_change_pct']:<8.2%} {etf['total_score']:<10.3f} "
-                  f"{etf['momentum_score']:<8.3f} {etf['volatility']:<8.3f} "
-                  f"{etf['sharpe']:<8.3f} {etf['trend_quality']:<10.3f}")
+        top = etf_details[:self.top_n]
+        for i, (ts_code, name, current_price, change, total_score, momentum, volatility, sharpe, trend) in enumerate(
+                zip(top.ts_codes, top.names, top['current_price'], top['price_change_pct'], top['total_score'],
+                    top['momentum_score'], top['volatility'], top['sharpe'], top['trend_quality'])):
+            print(f"{i+1:<4} {ts_code:<12} {name:<20} {current_price:<8.3f} "
+                  f"{change:<8.2%} {total_score:<10.3f} "
+                  f"{momentum:<8.3f} {volatility:<8.3f} "
+                  f"{sharpe:<8.3f} {trend:<10.3f}")
         
         # 显示排名分布统计
         print(f"\n📈 排名分布统计:")
-        scores = [etf['total_score'] for etf in etf_details]
-        print(f"   最高分: {max(scores):.3f}")
-        print(f"   最低分: {min(scores):.3f}")
+        scores = etf_details['total_score']
+        print(f"   最高分: {scores.max():.3f}")
+        print(f"   最低分: {scores.min():.3f}")
         print(f"   平均分: {np.mean(scores):.3f}")
         print(f"   中位数: {np.median(scores):.3f}")
         
         # 按类别显示前几名
         self.print_category_ranking(etf_details)
     
-    def print_category_ranking(self, etf_details):
-        """按类别显示排名"""
-        # 简单的类别分类（根据名称关键词）
-        categories = {
-            '宽基指数': ['300', '50', '500', '1000', '创业板', '科创'],
-            '行业主题': ['医药', '医疗', '半导体', '芯片', '新能源', '电池', '消费', '酒', '券商', '证券', '银行', '军工', '有色金属', '黄金'],
-            '跨境QDII': ['纳指', '标普', '恒生', '港股', '中概', '德国', '日经'],
-            '商品债券': ['国债', '黄金', '豆粕', '可转债']
-        }
-        
-        print(f"\n🏷️  按类别排名 (各类别前5名):")
+    def print_category_ranking(self, etf_details, top_k=5):
+        """按类别显示排名（etf_details 已按得分排序，类别取自注册表的整数类别列）"""
+        print(f"\n🏷️  按类别排名 (各类别前{top_k}名):")
         print("-" * 80)
         
-        for category, keywords in categories.items():
-            category_etfs = []
-            for etf in etf_details:
-                if any(keyword in etf['name'] for keyword in keywords):
-                    category_etfs.append(etf)
-            
-            if category_etfs:
-                category_etfs.sort(key=lambda x: x['total_score'], reverse=True)
-                print(f"\n📊 {category} ({len(category_etfs)}只):")
-                for i, etf in enumerate(category_etfs[:5]):
-                    print(f"   {i+1}. {etf['name']} - 得分: {etf['total_score']:.3f} (排名: {etf_details.index(etf)+1})")
+        # 名次即排序后的位置；按类别稳定排序一次，各组内仍是名次顺序
+        codes = self.universe.category_codes[etf_details.positions]
+        order = np.argsort(codes, kind='stable')
+        group_codes, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+        groups = dict(zip(group_codes.tolist(), zip(starts.tolist(), counts.tolist())))
+        
+        for code, category in enumerate(self.universe.categories):
+            if category == DEFAULT_CATEGORY or code not in groups:
+                continue
+            start, count = groups[code]
+            print(f"\n📊 {category} ({count}只):")
+            positions = order[start:start + min(count, top_k)]
+            names = etf_details.names[positions]
+            for i, (position, name, score) in enumerate(zip(positions, names, etf_details['total_score'][positions])):
+                print(f"   {i+1}. {name} - 得分: {score:.3f} (排名: {position+1})")
+    
+    def load_correlation_clusters(self, panel):
+        """
+        计算相关矩阵并给出 {ts_code: 簇编号}；ETF集合和参数不变、矩阵相对缓存的均方根变化不超过
+        correlation_drift 时沿用缓存的聚类结果，否则重新聚类并写入 cluster_file
+        """
+        corr, usable = correlation_matrix(panel['close'], self.correlation_window)
+        params = np.array([self.correlation_window, self.correlation_threshold])
+        labels = None
+        if os.path.exists(self.cluster_file):
+            cached = np.load(self.cluster_file, allow_pickle=False)
+            if (list(cached['symbols']) == panel.symbols and np.array_equal(cached['params'], params)
+                    and np.array_equal(cached['usable'], usable)):
+                drift = float(np.sqrt(np.mean((cached['corr'] - corr) ** 2)))
+                if drift <= self.correlation_drift:
+                    labels = cached['labels']
+                    print(f"♻️ 相关矩阵变化 {drift:.4f}，沿用缓存的聚类结果")
+        if labels is None:
+            labels = correlation_clusters(corr, usable, self.correlation_threshold)
+            np.savez(self.cluster_file, symbols=np.array(panel.symbols), params=params, usable=usable,
+                     corr=corr, labels=labels)
+        sizes = np.bincount(labels)
+        print(f"🧬 相关性聚类: {len(labels)}只ETF -> {len(sizes)}个簇，其中{int((sizes > 1).sum())}个簇含多只ETF"
+              f"（阈值 {self.correlation_threshold}，{self.correlation_window}日收益率）")
+        return dict(zip(panel.symbols, labels.tolist()))
+    
+    def deduplicate_recommendations(self, etf_details, n=None):
+        """
+        按得分顺序每个相关簇只保留第一只（得分最高的代表），取前 n 只
+        
+        返回 (代表子表, 被跳过的同簇ETF位置, 对应代表的位置)，位置均为 etf_details 中的行号
+        """
+        n = n or self.recommend_n
+        rows = np.arange(len(etf_details))
+        cluster = etf_details.columns.get('cluster', np.full(len(etf_details), -1))
+        # 未聚类（-1）的ETF各自成簇
+        cluster = np.where(cluster >= 0, cluster, cluster.max(initial=0) + 1 + rows)
+        _, first, inverse = np.unique(cluster, return_index=True, return_inverse=True)
+        chosen = np.sort(first)[:n]
+        leader = first[inverse]
+        # 凑满 n 只时只列出最后一只代表之前跳过的ETF，凑不满时为全部同簇ETF
+        limit = chosen[-1] if len(chosen) == n else len(rows)
+        skipped = rows[(rows < limit) & (leader != rows)]
+        return etf_details[chosen], skipped, leader[skipped]
     
     def generate_rebalancing_suggestions(self, etf_details):
         """生成调仓建议"""
-        print(f"\n💡 推荐持仓 (前{self.recommend_n}名):")
-        recommended_etfs = etf_details[:self.recommend_n]
+        print(f"\n💡 推荐持仓 (前{self.recommend_n}名，同类高相关ETF只取得分最高的一只):")
+        recommended_etfs, skipped, leaders = self.deduplicate_recommendations(etf_details)
+        names = recommended_etfs.names
         
-        for i, etf in enumerate(recommended_etfs):
-            print(f"{i+1}. {etf['name']} ({etf['ts_code']}) - 得分: {etf['total_score']:.3f}")
+        for i, (name, ts_code, total_score) in enumerate(zip(names, recommended_etfs.ts_codes,
+                                                             recommended_etfs['total_score'])):
+            print(f"{i+1}. {name} ({ts_code}) - 得分: {total_score:.3f}")
+        if len(skipped):
+            all_names = etf_details.names
+            print("   已跳过的同类ETF: " + ", ".join(f"{all_names[row]}(同 {all_names[leader]})"
+                                              for row, leader in zip(skipped, leaders)))
         
         # 挂单价格建议
         print(f"\n💰 挂单价格建议 (基于ATR波动率):")
         print("-" * 80)
         
-        for etf in recommended_etfs:
-            current_price = etf['current_price']
-            atr = etf['atr']
-            
+        for name, current_price, atr in zip(names, recommended_etfs['current_price'], recommended_etfs['atr']):
             if atr > 0:
                 # 买入建议区间
                 buy_low = current_price - atr * 0.8
@@ -1002,13 +3213,13 @@ class CompleteETFDailyRating:
                 # 保守买入价
                 buy_conservative = current_price - atr * 0.5
                 
-                print(f"📈 {etf['name']}:")
+                print(f"📈 {name}:")
                 print(f"   当前价: {current_price:.3f}")
                 print(f"   建议买入区间: {buy_low:.3f} - {buy_high:.3f}")
                 print(f"   保守买入价: {buy_conservative:.3f}")
                 print(f"   建议仓位: {100/self.recommend_n:.1f}% (等权重)")
             else:
-                print(f"📈 {etf['name']}:")
+                print(f"📈 {name}:")
                 print(f"   当前价: {current_price:.3f}")
                 print(f"   建议参考价: {current_price * 0.99:.3f} - {current_price * 1.01:.3f}")
         
@@ -1029,17 +3240,16 @@ class CompleteETFDailyRating:
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M")
         
-        # 保存完整排名到 complete_ratings 文件夹
-        df_results = pd.DataFrame(etf_details)
-        complete_filename = os.path.join(self.complete_ratings_folder, f'etf_complete_rating_{timestamp}.csv')
-        df_results.to_csv(complete_filename, index=False, encoding='utf-8-sig')
-        print(f"💾 完整排名已保存至: {complete_filename}")
-        
-        # 保存前100名到 top100_ratings 文件夹
-        df_top100 = pd.DataFrame(etf_details[:100])
-        top100_filename = os.path.join(self.top100_ratings_folder, f'etf_top100_rating_{timestamp}.csv')
-        df_top100.to_csv(top100_filename, index=False, encoding='utf-8-sig')
-        print(f"💾 前100名已保存至: {top100_filename}")
+        for ext in self.output_formats:
+            # 保存完整排名到 complete_ratings 文件夹
+            complete_filename = os.path.join(self.complete_ratings_folder, f'etf_complete_rating_{timestamp}.{ext}')
+            etf_details.write(complete_filename)
+            print(f"💾 完整排名已保存至: {complete_filename}")
+            
+            # 保存前100名到 top100_ratings 文件夹（已按得分排序，直接切片）
+            top100_filename = os.path.join(self.top100_ratings_folder, f'etf_top100_rating_{timestamp}.{ext}')
+            etf_details[:100].write(top100_filename)
+            print(f"💾 前100名已保存至: {top100_filename}")
         
         # 显示文件夹信息
         print(f"\n📁 文件分类保存完成:")
@@ -1047,11 +3257,117 @@ class CompleteETFDailyRating:
         print(f"   📂 {self.top100_ratings_folder}/ - 前100名文件")
 
 # 使用示例
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='完整版ETF每日评级系统')
+    parser.add_argument('--workers', type=int, default=8, help='并发抓取线程数 (默认8)')
+    parser.add_argument('--rate', type=float, default=3.0,
+                        help='全局每秒请求数上限，每只待下载ETF计一次；默认3.0时全部513只约需170秒 (默认3.0)')
+    parser.add_argument('--batch-size', type=int, default=50, help='每次批量下载调用的ETF数量，1为逐只下载；限流仍按ETF个数计 (默认50)')
+    parser.add_argument('--refresh', action='store_true', help='忽略本地行情库，强制全量重新下载')
+    parser.add_argument('--provider', choices=['yfinance', 'async', 'store', 'replay'], default='yfinance',
+                        help='行情数据源：yfinance / async（aiohttp直连chart接口）/ store（仅本地行情库）/ replay（回放录制数据）')
+    parser.add_argument('--chart-url', default=YAHOO_CHART_URL, help='async数据源的chart接口地址，可指向本地桩服务器')
+    parser.add_argument('--timeout', type=float, default=10, help='async数据源单请求超时秒数 (默认10)')
+    parser.add_argument('--record-charts', metavar='DIR', help='async数据源保存原始响应到该目录')
+    parser.add_argument('--record', metavar='DIR', help='录制数据源返回的行情到该目录，供 replay 回放')
+    parser.add_argument('--replay-dir', metavar='DIR', help='replay数据源读取的录制目录')
+    parser.add_argument('--replay-latency', type=float, default=0.0, help='replay数据源每次请求的人为延迟秒数')
+    parser.add_argument('--store-dir', default='ohlcv_store', help='本地行情库目录 (默认 ohlcv_store)')
+    parser.add_argument('--exchange', nargs='+', choices=['SSE', 'SZSE'], help='只评级指定交易所的ETF')
+    parser.add_argument('--category', nargs='+', help='只评级注册表中指定类别的ETF')
+    parser.add_argument('--watchlist', nargs='+', metavar='TS_CODE', help='只评级自选列表中的ETF')
+    parser.add_argument('--incremental', action='store_true', help='使用持久化的增量因子状态，每天只推进新K线')
+    parser.add_argument('--rebuild-state', action='store_true', help='丢弃增量因子状态，用当前面板全量重建')
+    parser.add_argument('--processes', type=int, default=0, help='因子计算的进程数，大于1时启用共享内存进程池 (默认0=单进程)')
+    parser.add_argument('--blas-threads', type=int, default=1, help='每个因子进程的BLAS线程数 (默认1)')
+    parser.add_argument('--backfill', action='store_true', help='回填历史评级（每个交易日的得分与名次）后退出')
+    parser.add_argument('--backfill-years', type=float, default=5, help='回填的年数 (默认5)')
+    parser.add_argument('--backfill-start', help='回填起始日期，如 2021-01-01（优先于 --backfill-years）')
+    parser.add_argument('--backfill-end', help='回填截止日期 (默认最近交易日)')
+    parser.add_argument('--catch-up', action='store_true', help='从已保存的历史评级最后一天补到最近交易日后退出')
+    parser.add_argument('--backtest', action='store_true', help='用 rating_history/ 回测前N名轮动策略后退出')
+    parser.add_argument('--top', type=int, help='回测持有的ETF数量 (默认与推荐数量相同)')
+    parser.add_argument('--rebalance-days', type=int, default=5, help='回测调仓间隔交易日数 (默认5)')
+    parser.add_argument('--cost-bps', type=float, default=10, help='回测单边交易成本，基点 (默认10)')
+    parser.add_argument('--sweep', type=int, metavar='N', help='在 rating_history/ 上扫描N组因子权重后退出')
+    parser.add_argument('--sweep-seed', type=int, default=0, help='权重扫描的随机种子 (默认0)')
+    parser.add_argument('--sweep-workers', type=int, default=4, help='权重扫描的并行线程数 (默认4)')
+    parser.add_argument('--walk-forward', type=int, metavar='FOLDS',
+                        help='滚动训练/测试验证，最近 --backfill-years 年切分为FOLDS个测试段后退出')
+    parser.add_argument('--train-days', type=int, default=252, help='滚动验证的训练窗口交易日数 (默认252)')
+    parser.add_argument('--wf-configs', type=int, default=500, help='滚动验证每折每组因子窗口扫描的权重组数 (默认500)')
+    parser.add_argument('--factor-ic', action='store_true',
+                        help='用 rating_history/ 增量更新因子IC与分组收益分析 (factor_analytics/) 后退出')
+    parser.add_argument('--corr-threshold', type=float, default=0.9,
+                        help='推荐持仓去重的收益率相关系数阈值，高于阈值的ETF视为同一敞口 (默认0.9，设为1关闭)')
+    parser.add_argument('--output-format', choices=['csv', 'parquet', 'both'], default='csv',
+                        help='评级结果文件格式 (默认csv)')
+    parser.add_argument('--serve-charts', metavar='DIR', help='启动本地桩服务器回放该目录中的录制响应')
+    parser.add_argument('--port', type=int, default=8765, help='桩服务器端口 (默认8765)')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.serve_charts:
+        serve_recorded_charts(args.serve_charts, port=args.port)
+        return
+    
     print("🚀 启动完整版ETF每日评级系统...")
     
     # 创建评级系统
-    rating_system = CompleteETFDailyRating()
+    rating_system = CompleteETFDailyRating(fetch_workers=args.workers, fetch_rate=args.rate,
+                                           batch_size=args.batch_size, refresh=args.refresh,
+                                           provider=args.provider, chart_url=args.chart_url,
+                                           fetch_timeout=args.timeout, record_charts=args.record_charts,
+                                           replay_dir=args.replay_dir, replay_latency=args.replay_latency,
+                                           record_dir=args.record, store_folder=args.store_dir,
+                                           exchange=args.exchange,
+                                           category=args.category, watchlist=args.watchlist,
+                                           incremental=args.incremental, rebuild_state=args.rebuild_state,
+                                           processes=args.processes, blas_threads=args.blas_threads,
+                                           correlation_threshold=args.corr_threshold,
+                                           output_format=args.output_format)
+    
+    if args.backfill or args.catch_up:
+        rating_system.backfill_ratings(start=args.backfill_start, end=args.backfill_end,
+                                       years=args.backfill_years, catch_up=args.catch_up)
+        return
+    if args.sweep:
+        results = rating_system.run_weight_sweep(n_configs=args.sweep, seed=args.sweep_seed,
+                                                 workers=args.sweep_workers, top_n=args.top,
+                                                 rebalance_days=args.rebalance_days, cost=args.cost_bps / 10000)
+        if results is not None:
+            os.makedirs(rating_system.backtest_folder, exist_ok=True)
+            filename = os.path.join(rating_system.backtest_folder,
+                                    f'weight_sweep_{datetime.now().strftime("%Y%m%d_%H%M")}.csv')
+            results.to_csv(filename, index=False, encoding='utf-8-sig')
+            print(f"💾 扫描结果已保存至: {filename}")
+        return
+    if args.walk_forward:
+        result = rating_system.run_walk_forward(folds=args.walk_forward, years=args.backfill_years,
+                                                train_days=args.train_days, n_configs=args.wf_configs,
+                                                seed=args.sweep_seed, processes=args.processes, top_n=args.top,
+                                                rebalance_days=args.rebalance_days, cost=args.cost_bps / 10000)
+        if result is not None:
+            _, _, fold_table, nav = result
+            os.makedirs(rating_system.backtest_folder, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            fold_table.to_csv(os.path.join(rating_system.backtest_folder, f'walk_forward_folds_{timestamp}.csv'),
+                              index=False, encoding='utf-8-sig')
+            nav.to_csv(os.path.join(rating_system.backtest_folder, f'walk_forward_nav_{timestamp}.csv'),
+                       index=False, encoding='utf-8-sig')
+            print(f"💾 滚动验证结果已保存至: {rating_system.backtest_folder}/walk_forward_*_{timestamp}.csv")
+        return
+    if args.factor_ic:
+        rating_system.run_factor_analytics()
+        return
+    if args.backtest:
+        metrics, nav = rating_system.run_backtest(top_n=args.top, rebalance_days=args.rebalance_days,
+                                                  cost=args.cost_bps / 10000)
+        if nav is not None:
+            rating_system.save_backtest(metrics, nav, top_n=args.top)
+        return
     
     try:
         # 生成完整评级
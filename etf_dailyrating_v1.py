@@ -65,530 +65,13 @@ class CompleteETFDailyRating:
     
     def get_complete_etf_list(self):
         """
-        完整的ETF列表 - 包含所有提供的ETF
+        完整的ETF列表 - 来自注册表 etf_universe.csv（与完整版共用）
         """
-        complete_etfs = [
-            {'ts_code': '159994.SZ', 'name': '5GETF'},
-            {'ts_code': '159509.SZ', 'name': '纳指科技ETF'},
-            {'ts_code': '159796.SZ', 'name': '电池50ETF'},
-            {'ts_code': '159583.SZ', 'name': '通信设备ETF'},
-            {'ts_code': '159783.SZ', 'name': '科创创业50ETF'},
-            {'ts_code': '159781.SZ', 'name': '科创创业ETF'},
-            {'ts_code': '159603.SZ', 'name': '双创龙头ETF'},
-            {'ts_code': '159811.SZ', 'name': '5G50ETF'},
-            {'ts_code': '159780.SZ', 'name': '双创ETF'},
-            {'ts_code': '159782.SZ', 'name': '双创50ETF'},
-            {'ts_code': '159368.SZ', 'name': '创业板新能源ETF华夏'},
-            {'ts_code': '159383.SZ', 'name': '创业板50ETF华泰柏瑞'},
-            {'ts_code': '159566.SZ', 'name': '储能电池ETF'},
-            {'ts_code': '159305.SZ', 'name': '储能电池ETF广发'},
-            {'ts_code': '159773.SZ', 'name': '创业板科技ETF'},
-            {'ts_code': '159652.SZ', 'name': '有色50ETF'},
-            {'ts_code': '159375.SZ', 'name': '创业板50ETF国泰'},
-            {'ts_code': '159370.SZ', 'name': '创50ETF工银'},
-            {'ts_code': '159777.SZ', 'name': '创科技ETF'},
-            {'ts_code': '159373.SZ', 'name': '创业板50ETF嘉实'},
-            {'ts_code': '159681.SZ', 'name': '创50ETF'},
-            {'ts_code': '159779.SZ', 'name': '消费电子50ETF'},
-            {'ts_code': '159371.SZ', 'name': '创业板50ETF富国'},
-            {'ts_code': '159682.SZ', 'name': '创业50ETF'},
-            {'ts_code': '159949.SZ', 'name': '创业板50ETF'},
-            {'ts_code': '159752.SZ', 'name': '新能源龙头ETF'},
-            {'ts_code': '159597.SZ', 'name': '创业板成长ETF易方达'},
-            {'ts_code': '159320.SZ', 'name': '电网ETF'},
-            {'ts_code': '159880.SZ', 'name': '有色ETF基金'},
-            {'ts_code': '159690.SZ', 'name': '矿业ETF'},
-            {'ts_code': '159367.SZ', 'name': '创业板50ETF华夏'},
-            {'ts_code': '159676.SZ', 'name': '创业板增强ETF富国'},
-            {'ts_code': '159881.SZ', 'name': '有色60ETF'},
-            {'ts_code': '159814.SZ', 'name': '创业大盘ETF'},
-            {'ts_code': '159871.SZ', 'name': '有色金属ETF'},
-            {'ts_code': '159675.SZ', 'name': '创业板增强ETF'},
-            {'ts_code': '159502.SZ', 'name': '标普生物科技ETF'},
-            {'ts_code': '159381.SZ', 'name': '创业板人工智能ETF华夏'},
-            {'ts_code': '159507.SZ', 'name': '通信ETF广发'},
-            {'ts_code': '159363.SZ', 'name': '创业板人工智能ETF华宝'},
-            {'ts_code': '159991.SZ', 'name': '创大盘ETF'},
-            {'ts_code': '159755.SZ', 'name': '电池ETF'},
-            {'ts_code': '159767.SZ', 'name': '电池龙头ETF'},
-            {'ts_code': '159808.SZ', 'name': '创100ETF融通'},
-            {'ts_code': '159819.SZ', 'name': '人工智能ETF'},
-            {'ts_code': '159909.SZ', 'name': 'TMT50ETF'},
-            {'ts_code': '159757.SZ', 'name': '电池ETF景顺'},
-            {'ts_code': '159388.SZ', 'name': '创业板人工智能ETF国泰'},
-            {'ts_code': '159840.SZ', 'name': '锂电池ETF'},
-            {'ts_code': '159695.SZ', 'name': '通信ETF'},
-            {'ts_code': '159906.SZ', 'name': '深成长龙头ETF'},
-            {'ts_code': '159958.SZ', 'name': '创业板ETF工银'},
-            {'ts_code': '159964.SZ', 'name': '创业板ETF平安'},
-            {'ts_code': '159511.SZ', 'name': '通信ETF南方'},
-            {'ts_code': '159861.SZ', 'name': '碳中和50ETF'},
-            {'ts_code': '159956.SZ', 'name': '创业板ETF建信'},
-            {'ts_code': '159875.SZ', 'name': '新能源ETF'},
-            {'ts_code': '159824.SZ', 'name': '新能车ETF'},
-            {'ts_code': '159821.SZ', 'name': 'BOCI创业板ETF'},
-            {'ts_code': '159810.SZ', 'name': '创业板ETF浦银'},
-            {'ts_code': '159948.SZ', 'name': '创业板ETF南方'},
-            {'ts_code': '159915.SZ', 'name': '创业板ETF'},
-            {'ts_code': '159908.SZ', 'name': '创业板ETF博时'},
-            {'ts_code': '159709.SZ', 'name': '物联网ETF工银'},
-            {'ts_code': '159640.SZ', 'name': '碳中和龙头ETF'},
-            {'ts_code': '159885.SZ', 'name': '碳中和ETF基金'},
-            {'ts_code': '159957.SZ', 'name': '创业板ETF华夏'},
-            {'ts_code': '159896.SZ', 'name': '物联网ETF南方'},
-            {'ts_code': '159952.SZ', 'name': '创业板ETF广发'},
-            {'ts_code': '159806.SZ', 'name': '新能源车ETF'},
-            {'ts_code': '159895.SZ', 'name': '物联网ETF易方达'},
-            {'ts_code': '159831.SZ', 'name': '上海金ETF嘉实'},
-            {'ts_code': '159671.SZ', 'name': '稀有金属ETF基金'},
-            {'ts_code': '159834.SZ', 'name': '金ETF'},
-            {'ts_code': '159934.SZ', 'name': '黄金ETF'},
-            {'ts_code': '159830.SZ', 'name': '上海金ETF'},
-            {'ts_code': '159812.SZ', 'name': '黄金基金ETF'},
-            {'ts_code': '159637.SZ', 'name': '新能源车龙头ETF'},
-            {'ts_code': '159997.SZ', 'name': '电子ETF'},
-            {'ts_code': '159937.SZ', 'name': '黄金ETF基金'},
-            {'ts_code': '159790.SZ', 'name': '碳中和ETF'},
-            {'ts_code': '159641.SZ', 'name': '双碳ETF'},
-            {'ts_code': '159639.SZ', 'name': '碳中和ETF南方'},
-            {'ts_code': '159807.SZ', 'name': '科技ETF'},
-            {'ts_code': '159602.SZ', 'name': '中国A50ETF'},
-            {'ts_code': '159701.SZ', 'name': '物联网ETF招商'},
-            {'ts_code': '159716.SZ', 'name': '深证100ETF华宝'},
-            {'ts_code': '159642.SZ', 'name': '碳中和100ETF'},
-            {'ts_code': '159601.SZ', 'name': 'A50ETF'},
-            {'ts_code': '159608.SZ', 'name': '稀有金属ETF'},
-            {'ts_code': '159582.SZ', 'name': '半导体产业ETF'},
-            {'ts_code': '159501.SZ', 'name': '纳指ETF嘉实'},
-            {'ts_code': '159973.SZ', 'name': '民企ETF'},
-            {'ts_code': '159941.SZ', 'name': '纳指ETF'},
-            {'ts_code': '159944.SZ', 'name': '材料ETF'},
-            {'ts_code': '159665.SZ', 'name': '半导体龙头ETF'},
-            {'ts_code': '159721.SZ', 'name': '深证100ETF永赢'},
-            {'ts_code': '159836.SZ', 'name': '创业板300ETF天弘'},
-            {'ts_code': '159660.SZ', 'name': '纳指100ETF'},
-            {'ts_code': '159713.SZ', 'name': '稀土ETF'},
-            {'ts_code': '159715.SZ', 'name': '稀土ETF易方达'},
-            {'ts_code': '159995.SZ', 'name': '芯片ETF'},
-            {'ts_code': '159310.SZ', 'name': '芯片ETF天弘'},
-            {'ts_code': '159886.SZ', 'name': '机械ETF'},
-            {'ts_code': '159599.SZ', 'name': '芯片ETF基金'},
-            {'ts_code': '159212.SZ', 'name': '深100ETF南方'},
-            {'ts_code': '159738.SZ', 'name': '云计算ETF华泰柏瑞'},
-            {'ts_code': '159211.SZ', 'name': '深证100ETF富国'},
-            {'ts_code': '159813.SZ', 'name': '半导体ETF'},
-            {'ts_code': '159720.SZ', 'name': '智能车ETF泰康'},
-            {'ts_code': '159961.SZ', 'name': '深100ETF方正富邦'},
-            {'ts_code': '159656.SZ', 'name': '300成长ETF'},
-            {'ts_code': '159775.SZ', 'name': '电池ETF基金'},
-            {'ts_code': '159912.SZ', 'name': '深300ETF'},
-            {'ts_code': '159576.SZ', 'name': '深证100ETF广发'},
-            {'ts_code': '159801.SZ', 'name': '芯片ETF龙头'},
-            {'ts_code': '159560.SZ', 'name': '芯片ETF景顺'},
-            {'ts_code': '159696.SZ', 'name': '纳指ETF易方达'},
-            {'ts_code': '159939.SZ', 'name': '信息技术ETF'},
-            {'ts_code': '159546.SZ', 'name': '集成电路ETF'},
-            {'ts_code': '159325.SZ', 'name': '半导体ETF南方'},
-            {'ts_code': '159706.SZ', 'name': '深证100ETF华安'},
-            {'ts_code': '159969.SZ', 'name': '深100ETF银华'},
-            {'ts_code': '159975.SZ', 'name': '深100ETF招商'},
-            {'ts_code': '159150.SZ', 'name': '深证50ETF易方达'},
-            {'ts_code': '159632.SZ', 'name': '纳斯达克ETF'},
-            {'ts_code': '159513.SZ', 'name': '纳斯达克100指数ETF'},
-            {'ts_code': '159659.SZ', 'name': '纳斯达克100ETF'},
-            {'ts_code': '159350.SZ', 'name': '深证50ETF富国'},
-            {'ts_code': '159763.SZ', 'name': '新材料ETF基金'},
-            {'ts_code': '159901.SZ', 'name': '深证100ETF'},
-            {'ts_code': '159653.SZ', 'name': 'ESG300ETF'},
-            {'ts_code': '159216.SZ', 'name': '深证100ETF大成'},
-            {'ts_code': '159631.SZ', 'name': '中证A100ETF'},
-            {'ts_code': '159609.SZ', 'name': '光伏龙头ETF'},
-            {'ts_code': '159362.SZ', 'name': 'A500ETF工银'},
-            {'ts_code': '159553.SZ', 'name': '2000ETF增强'},
-            {'ts_code': '159685.SZ', 'name': '1000增强ETF天弘'},
-            {'ts_code': '159943.SZ', 'name': '深证成指ETF'},
-            {'ts_code': '159380.SZ', 'name': 'A500ETF东财'},
-            {'ts_code': '159386.SZ', 'name': 'A500ETF永赢'},
-            {'ts_code': '159717.SZ', 'name': 'ESGETF'},
-            {'ts_code': '159778.SZ', 'name': '工业互联ETF'},
-            {'ts_code': '159703.SZ', 'name': '新材料ETF'},
-            {'ts_code': '159970.SZ', 'name': '深100ETF工银'},
-            {'ts_code': '159866.SZ', 'name': '日经ETF'},
-            {'ts_code': '159627.SZ', 'name': 'A100ETF'},
-            {'ts_code': '159215.SZ', 'name': '中证A500ETF指数基金'},
-            {'ts_code': '159903.SZ', 'name': '深成ETF'},
-            {'ts_code': '159360.SZ', 'name': '中证A500ETF天弘'},
-            {'ts_code': '159863.SZ', 'name': '光伏ETF基金'},
-            {'ts_code': '159661.SZ', 'name': 'A100ETF嘉实'},
-            {'ts_code': '159356.SZ', 'name': 'A500ETF基金'},
-            {'ts_code': '159339.SZ', 'name': 'A500ETF'},
-            {'ts_code': '159376.SZ', 'name': 'A500ETF指数基金'},
-            {'ts_code': '159923.SZ', 'name': '中证A100ETF基金'},
-            {'ts_code': '159864.SZ', 'name': '光伏50ETF'},
-            {'ts_code': '159351.SZ', 'name': 'A500ETF嘉实'},
-            {'ts_code': '159379.SZ', 'name': 'A500ETF融通'},
-            {'ts_code': '159678.SZ', 'name': '中证500增强ETF'},
-            {'ts_code': '159577.SZ', 'name': '美国50ETF'},
-            {'ts_code': '159358.SZ', 'name': '中证A500ETF基金'},
-            {'ts_code': '159610.SZ', 'name': '500ETF增强'},
-            {'ts_code': '159618.SZ', 'name': '光伏ETF指数基金'},
-            {'ts_code': '159761.SZ', 'name': '新材料50ETF'},
-            {'ts_code': '159393.SZ', 'name': '沪深300指数ETF'},
-            {'ts_code': '159353.SZ', 'name': '中证A500ETF景顺'},
-            {'ts_code': '159330.SZ', 'name': '沪深300ETF基金'},
-            {'ts_code': '159902.SZ', 'name': '中小100ETF'},
-            {'ts_code': '159359.SZ', 'name': '中证A500ETF华安'},
-            {'ts_code': '159563.SZ', 'name': '创业板综ETF华夏'},
-            {'ts_code': '159686.SZ', 'name': 'A100ETF易方达'},
-            {'ts_code': '159630.SZ', 'name': 'A100ETF基金'},
-            {'ts_code': '159732.SZ', 'name': '消费电子ETF'},
-            {'ts_code': '159673.SZ', 'name': '沪深300ETF鹏华'},
-            {'ts_code': '159357.SZ', 'name': '中证A500指数ETF'},
-            {'ts_code': '159857.SZ', 'name': '光伏ETF'},
-            {'ts_code': '159361.SZ', 'name': 'A500ETF易方达'},
-            {'ts_code': '159352.SZ', 'name': 'A500ETF南方'},
-            {'ts_code': '159982.SZ', 'name': '中证500ETF鹏华'},
-            {'ts_code': '159338.SZ', 'name': '中证A500ETF'},
-            {'ts_code': '159326.SZ', 'name': '电网设备ETF'},
-            {'ts_code': '159606.SZ', 'name': '中证500成长ETF'},
-            {'ts_code': '159562.SZ', 'name': '黄金股ETF'},
-            {'ts_code': '159300.SZ', 'name': '300ETF'},
-            {'ts_code': '159523.SZ', 'name': '沪深300成长ETF'},
-            {'ts_code': '159925.SZ', 'name': '沪深300ETF南方'},
-            {'ts_code': '159558.SZ', 'name': '半导体设备ETF易方达'},
-            {'ts_code': '159327.SZ', 'name': '半导体设备ETF基金'},
-            {'ts_code': '159596.SZ', 'name': 'A50ETF华宝'},
-            {'ts_code': '159919.SZ', 'name': '沪深300ETF'},
-            {'ts_code': '159315.SZ', 'name': '黄金股ETF基金'},
-            {'ts_code': '159968.SZ', 'name': '中证500ETF博时'},
-            {'ts_code': '159621.SZ', 'name': 'MSCIESGETF'},
-            {'ts_code': '159967.SZ', 'name': '创业板成长ETF'},
-            {'ts_code': '159655.SZ', 'name': '标普ETF'},
-            {'ts_code': '159516.SZ', 'name': '半导体设备ETF'},
-            {'ts_code': '159322.SZ', 'name': '黄金股票ETF基金'},
-            {'ts_code': '159623.SZ', 'name': '成渝经济圈ETF'},
-            {'ts_code': '159540.SZ', 'name': '信创ETF易方达'},
-            {'ts_code': '159791.SZ', 'name': '300ESGETF'},
-            {'ts_code': '159800.SZ', 'name': '中证800ETF'},
-            {'ts_code': '159820.SZ', 'name': '中证500ETF天弘'},
-            {'ts_code': '159935.SZ', 'name': '中证500ETF景顺'},
-            {'ts_code': '159922.SZ', 'name': '中证500ETF'},
-            {'ts_code': '159966.SZ', 'name': '创业板价值ETF'},
-            {'ts_code': '159552.SZ', 'name': '中证2000增强ETF'},
-            {'ts_code': '159337.SZ', 'name': '中证500ETF基金'},
-            {'ts_code': '159537.SZ', 'name': '信创ETF'},
-            {'ts_code': '159658.SZ', 'name': '数字经济ETF'},
-            {'ts_code': '159222.SZ', 'name': '自由现金流ETF易方达'},
-            {'ts_code': '159538.SZ', 'name': '信创ETF富国'},
-            {'ts_code': '159663.SZ', 'name': '机床ETF'},
-            {'ts_code': '159541.SZ', 'name': '创业板综ETF万家'},
-            {'ts_code': '159201.SZ', 'name': '自由现金流ETF'},
-            {'ts_code': '159890.SZ', 'name': '云计算ETF'},
-            {'ts_code': '159687.SZ', 'name': '亚太精选ETF'},
-            {'ts_code': '159539.SZ', 'name': '信创ETF广发'},
-            {'ts_code': '159691.SZ', 'name': '港股红利ETF'},
-            {'ts_code': '159667.SZ', 'name': '工业母机ETF'},
-            {'ts_code': '159617.SZ', 'name': '500价值ETF'},
-            {'ts_code': '159739.SZ', 'name': '大数据ETF'},
-            {'ts_code': '159225.SZ', 'name': '现金流ETF基金'},
-            {'ts_code': '159565.SZ', 'name': '汽车零部件ETF'},
-            {'ts_code': '159591.SZ', 'name': '中证A50ETF'},
-            {'ts_code': '159321.SZ', 'name': '黄金股票ETF'},
-            {'ts_code': '159588.SZ', 'name': '石油天然气ETF'},
-            {'ts_code': '159592.SZ', 'name': 'A50ETF基金'},
-            {'ts_code': '159521.SZ', 'name': '国证2000ETF指数基金'},
-            {'ts_code': '159543.SZ', 'name': '国证2000ETF基金'},
-            {'ts_code': '159390.SZ', 'name': 'A50指数ETF'},
-            {'ts_code': '159697.SZ', 'name': '油气ETF'},
-            {'ts_code': '159532.SZ', 'name': '中证2000ETF易方达'},
-            {'ts_code': '159593.SZ', 'name': '中证A50指数ETF'},
-            {'ts_code': '159595.SZ', 'name': '中证A50ETF基金'},
-            {'ts_code': '159306.SZ', 'name': '汽车零件ETF'},
-            {'ts_code': '159555.SZ', 'name': '2000增强ETF'},
-            {'ts_code': '159309.SZ', 'name': '油气资源ETF'},
-            {'ts_code': '159976.SZ', 'name': '湾创ETF'},
-            {'ts_code': '159527.SZ', 'name': '云计算ETF广发'},
-            {'ts_code': '159620.SZ', 'name': '500成长ETF'},
-            {'ts_code': '159679.SZ', 'name': '中证1000增强ETF'},
-            {'ts_code': '159870.SZ', 'name': '化工ETF'},
-            {'ts_code': '159910.SZ', 'name': '基本面120ETF'},
-            {'ts_code': '159510.SZ', 'name': '沪深300价值ETF'},
-            {'ts_code': '159677.SZ', 'name': '1000增强ETF'},
-            {'ts_code': '159519.SZ', 'name': '港股国企ETF'},
-            {'ts_code': '159505.SZ', 'name': '国证2000指数ETF'},
-            {'ts_code': '159249.SZ', 'name': 'A500增强ETF工银'},
-            {'ts_code': '159517.SZ', 'name': '800增强ETF'},
-            {'ts_code': '159945.SZ', 'name': '能源ETF广发'},
-            {'ts_code': '159930.SZ', 'name': '能源ETF'},
-            {'ts_code': '159209.SZ', 'name': '中证红利质量ETF'},
-            {'ts_code': '159680.SZ', 'name': '1000ETF增强'},
-            {'ts_code': '159723.SZ', 'name': '科技龙头ETF'},
-            {'ts_code': '159535.SZ', 'name': '中证2000ETF嘉实'},
-            {'ts_code': '159633.SZ', 'name': '中证1000ETF易方达'},
-            {'ts_code': '159328.SZ', 'name': '家电ETF易方达'},
-            {'ts_code': '159786.SZ', 'name': 'VRETF'},
-            {'ts_code': '159731.SZ', 'name': '石化ETF'},
-            {'ts_code': '159918.SZ', 'name': '中创400ETF'},
-            {'ts_code': '159536.SZ', 'name': '中证2000指数ETF'},
-            {'ts_code': '159533.SZ', 'name': '中证2000ETF基金'},
-            {'ts_code': '159203.SZ', 'name': '大盘成长ETF'},
-            {'ts_code': '159528.SZ', 'name': '国企改革ETF'},
-            {'ts_code': '159207.SZ', 'name': '高股息ETF'},
-            {'ts_code': '159845.SZ', 'name': '中证1000ETF'},
-            {'ts_code': '159399.SZ', 'name': '现金流ETF'},
-            {'ts_code': '159629.SZ', 'name': '1000ETF'},
-            {'ts_code': '159758.SZ', 'name': '红利质量ETF'},
-            {'ts_code': '159980.SZ', 'name': '有色ETF'},
-            {'ts_code': '159240.SZ', 'name': '中证A500增强ETF天弘'},
-            {'ts_code': '159888.SZ', 'name': '智能车ETF'},
-            {'ts_code': '159730.SZ', 'name': '龙头家电ETF'},
-            {'ts_code': '159889.SZ', 'name': '智能汽车ETF'},
-            {'ts_code': '159805.SZ', 'name': '传媒ETF'},
-            {'ts_code': '159611.SZ', 'name': '电力ETF'},
-            {'ts_code': '159726.SZ', 'name': '恒生红利ETF'},
-            {'ts_code': '159301.SZ', 'name': '公用事业ETF'},
-            {'ts_code': '159795.SZ', 'name': '智能汽车ETF基金'},
-            {'ts_code': '159226.SZ', 'name': '中证A500增强ETF'},
-            {'ts_code': '159236.SZ', 'name': '自由现金流ETF工银'},
-            {'ts_code': '159959.SZ', 'name': '央企ETF'},
-            {'ts_code': '159238.SZ', 'name': '300ETF增强'},
-            {'ts_code': '159531.SZ', 'name': '中证2000ETF'},
-            {'ts_code': '159916.SZ', 'name': '深F60ETF'},
-            {'ts_code': '159869.SZ', 'name': '游戏ETF'},
-            {'ts_code': '159333.SZ', 'name': '港股央企红利ETF'},
-            {'ts_code': '159578.SZ', 'name': '深证主板50ETF南方'},
-            {'ts_code': '159743.SZ', 'name': '湖北ETF'},
-            {'ts_code': '159556.SZ', 'name': '中证2000ETF增强'},
-            {'ts_code': '159235.SZ', 'name': '中证现金流ETF'},
-            {'ts_code': '159708.SZ', 'name': '红利ETF'},
-            {'ts_code': '159996.SZ', 'name': '家电ETF'},
-            {'ts_code': '159628.SZ', 'name': '国证2000ETF'},
-            {'ts_code': '159219.SZ', 'name': '深证100ETF融通'},
-            {'ts_code': '159616.SZ', 'name': '农牧ETF'},
-            {'ts_code': '159232.SZ', 'name': '现金流ETF南方'},
-            {'ts_code': '159669.SZ', 'name': '绿电ETF'},
-            {'ts_code': '159905.SZ', 'name': '深红利ETF'},
-            {'ts_code': '159625.SZ', 'name': '绿色电力ETF'},
-            {'ts_code': '159804.SZ', 'name': '创中盘88ETF'},
-            {'ts_code': '159221.SZ', 'name': '现金流ETF嘉实'},
-            {'ts_code': '159233.SZ', 'name': '自由现金流ETF基金'},
-            {'ts_code': '159965.SZ', 'name': '央视50ETF'},
-            {'ts_code': '159223.SZ', 'name': '现金流ETF永赢'},
-            {'ts_code': '159332.SZ', 'name': '央企红利ETF'},
-            {'ts_code': '159220.SZ', 'name': '港股通红利ETF'},
-            {'ts_code': '159206.SZ', 'name': '卫星ETF'},
-            {'ts_code': '159229.SZ', 'name': '自由现金流ETF广发'},
-            {'ts_code': '159707.SZ', 'name': '地产ETF'},
-            {'ts_code': '159261.SZ', 'name': '创业板新能源ETF鹏华'},
-            {'ts_code': '159387.SZ', 'name': '创业板新能源ETF国泰'},
-            {'ts_code': '159768.SZ', 'name': '房地产ETF'},
-            {'ts_code': '159366.SZ', 'name': '港股医疗ETF'},
-            {'ts_code': '159542.SZ', 'name': '工程机械ETF'},
-            {'ts_code': '159936.SZ', 'name': '可选消费ETF'},
-            {'ts_code': '159698.SZ', 'name': '粮食ETF'},
-            {'ts_code': '159205.SZ', 'name': '创业板ETF东财'},
-            {'ts_code': '159872.SZ', 'name': '智能网联汽车ETF'},
-            {'ts_code': '159581.SZ', 'name': '红利ETF基金'},
-            {'ts_code': '159335.SZ', 'name': '央企科创ETF'},
-            {'ts_code': '159827.SZ', 'name': '农业50ETF'},
-            {'ts_code': '159728.SZ', 'name': '在线消费ETF'},
-            {'ts_code': '159551.SZ', 'name': '机器人产业ETF'},
-            {'ts_code': '159515.SZ', 'name': '国企红利ETF'},
-            {'ts_code': '159793.SZ', 'name': '线上消费ETF基金'},
-            {'ts_code': '159526.SZ', 'name': '机器人ETF嘉实'},
-            {'ts_code': '159545.SZ', 'name': '恒生红利低波ETF'},
-            {'ts_code': '159589.SZ', 'name': '红利ETF广发'},
-            {'ts_code': '159372.SZ', 'name': '创业板50ETF万家'},
-            {'ts_code': '159770.SZ', 'name': '机器人ETF'},
-            {'ts_code': '159587.SZ', 'name': '粮食ETF广发'},
-            {'ts_code': '159998.SZ', 'name': '计算机ETF'},
-            {'ts_code': '159573.SZ', 'name': '创业板200ETF华夏'},
-            {'ts_code': '159619.SZ', 'name': '基建ETF'},
-            {'ts_code': '159825.SZ', 'name': '农业ETF'},
-            {'ts_code': '159572.SZ', 'name': '创业板200ETF易方达'},
-            {'ts_code': '159822.SZ', 'name': '新经济ETF'},
-            {'ts_code': '159635.SZ', 'name': '基建50ETF'},
-            {'ts_code': '159974.SZ', 'name': '央企创新ETF'},
-            {'ts_code': '159788.SZ', 'name': '港股通100ETF'},
-            {'ts_code': '159575.SZ', 'name': '创业板200ETF银华'},
-            {'ts_code': '159913.SZ', 'name': '深价值ETF'},
-            {'ts_code': '159302.SZ', 'name': '港股高股息ETF'},
-            {'ts_code': '159712.SZ', 'name': '港股通50ETF'},
-            {'ts_code': '159612.SZ', 'name': '标普500ETF'},
-            {'ts_code': '159331.SZ', 'name': '红利港股ETF'},
-            {'ts_code': '159856.SZ', 'name': '互联网龙头ETF'},
-            {'ts_code': '159571.SZ', 'name': '创业板200ETF富国'},
-            {'ts_code': '159766.SZ', 'name': '旅游ETF'},
-            {'ts_code': '159729.SZ', 'name': '互联网ETF'},
-            {'ts_code': '159725.SZ', 'name': '线上消费ETF'},
-            {'ts_code': '159385.SZ', 'name': '数字经济ETF富国'},
-            {'ts_code': '159549.SZ', 'name': '红利低波ETF天弘'},
-            {'ts_code': '159329.SZ', 'name': '沙特ETF'},
-            {'ts_code': '159883.SZ', 'name': '医疗器械ETF'},
-            {'ts_code': '159311.SZ', 'name': '数字经济ETF易方达'},
-            {'ts_code': '159920.SZ', 'name': '恒生ETF'},
-            {'ts_code': '159666.SZ', 'name': '交通运输ETF'},
-            {'ts_code': '159898.SZ', 'name': '医疗器械指数ETF'},
-            {'ts_code': '159742.SZ', 'name': '恒生科技指数ETF'},
-            {'ts_code': '159355.SZ', 'name': '800红利低波ETF'},
-            {'ts_code': '159797.SZ', 'name': '医疗器械ETF基金'},
-            {'ts_code': '159263.SZ', 'name': '价值ETF'},
-            {'ts_code': '159662.SZ', 'name': '交运ETF'},
-            {'ts_code': '159336.SZ', 'name': '央企红利50ETF'},
-            {'ts_code': '159613.SZ', 'name': '信息安全ETF'},
-            {'ts_code': '159389.SZ', 'name': '数字经济ETF嘉实'},
-            {'ts_code': '159907.SZ', 'name': '2000ETF'},
-            {'ts_code': '159312.SZ', 'name': '恒生ETF港股通'},
-            {'ts_code': '159993.SZ', 'name': '证券ETF龙头'},
-            {'ts_code': '159891.SZ', 'name': '医疗ETF基金'},
-            {'ts_code': '159318.SZ', 'name': '恒生港股通ETF'},
-            {'ts_code': '159001.SZ', 'name': '货币ETF'},
-            {'ts_code': '159719.SZ', 'name': '国企共赢ETF'},
-            {'ts_code': '159877.SZ', 'name': '医疗ETF南方'},
-            {'ts_code': '159520.SZ', 'name': '消费龙头ETF'},
-            {'ts_code': '159848.SZ', 'name': '证券ETF基金'},
-            {'ts_code': '159873.SZ', 'name': '医疗设备ETF'},
-            {'ts_code': '159842.SZ', 'name': '券商ETF'},
-            {'ts_code': '159607.SZ', 'name': '中概互联网ETF'},
-            {'ts_code': '159692.SZ', 'name': '证券ETF东财'},
-            {'ts_code': '159847.SZ', 'name': '医疗ETF易方达'},
-            {'ts_code': '159512.SZ', 'name': '汽车ETF'},
-            {'ts_code': '159530.SZ', 'name': '机器人ETF易方达'},
-            {'ts_code': '159954.SZ', 'name': 'H股ETF'},
-            {'ts_code': '159841.SZ', 'name': '证券ETF'},
-            {'ts_code': '159547.SZ', 'name': '红利低波ETF基金'},
-            {'ts_code': '159940.SZ', 'name': '金融地产ETF'},
-            {'ts_code': '159605.SZ', 'name': '中概互联ETF'},
-            {'ts_code': '159929.SZ', 'name': '医药ETF'},
-            {'ts_code': '159828.SZ', 'name': '医疗ETF'},
-            {'ts_code': '159559.SZ', 'name': '机器人50ETF'},
-            {'ts_code': '159838.SZ', 'name': '医药50ETF'},
-            {'ts_code': '159855.SZ', 'name': '影视ETF'},
-            {'ts_code': '159760.SZ', 'name': '医疗健康ETF泰康'},
-            {'ts_code': '159228.SZ', 'name': '红利低波ETF长城'},
-            {'ts_code': '159213.SZ', 'name': '机器人ETF基金'},
-            {'ts_code': '159850.SZ', 'name': '恒生国企ETF'},
-            {'ts_code': '159622.SZ', 'name': '创新药ETF沪港深'},
-            {'ts_code': '159938.SZ', 'name': '医药卫生ETF'},
-            {'ts_code': '159391.SZ', 'name': '大盘价值ETF'},
-            {'ts_code': '159688.SZ', 'name': '恒生互联网ETF'},
-            {'ts_code': '159931.SZ', 'name': '金融ETF'},
-            {'ts_code': '159202.SZ', 'name': '恒生互联网科技ETF'},
-            {'ts_code': '159837.SZ', 'name': '生物科技ETF'},
-            {'ts_code': '159303.SZ', 'name': '恒生医疗ETF基金'},
-            {'ts_code': '159740.SZ', 'name': '恒生科技ETF'},
-            {'ts_code': '159550.SZ', 'name': '互联网ETF沪港深'},
-            {'ts_code': '159849.SZ', 'name': '生物科技指数ETF'},
-            {'ts_code': '159525.SZ', 'name': '红利低波ETF'},
-            {'ts_code': '159859.SZ', 'name': '生物医药ETF'},
-            {'ts_code': '159741.SZ', 'name': '恒生科技ETF嘉实'},
-            {'ts_code': '159748.SZ', 'name': '创新药ETF富国'},
-            {'ts_code': '159365.SZ', 'name': '恒指ETF'},
-            {'ts_code': '159776.SZ', 'name': '港股通医药ETF'},
-            {'ts_code': '159718.SZ', 'name': '港股医药ETF'},
-            {'ts_code': '159839.SZ', 'name': '生物药ETF'},
-            {'ts_code': '159858.SZ', 'name': '创新药ETF南方'},
-            {'ts_code': '159747.SZ', 'name': '香港科技ETF'},
-            {'ts_code': '159657.SZ', 'name': '疫苗ETF鹏华'},
-            {'ts_code': '159636.SZ', 'name': '港股通科技30ETF'},
-            {'ts_code': '159933.SZ', 'name': '国投金融地产ETF'},
-            {'ts_code': '159751.SZ', 'name': '港股科技ETF'},
-            {'ts_code': '159382.SZ', 'name': '创业板人工智能ETF南方'},
-            {'ts_code': '159323.SZ', 'name': '港股通汽车ETF'},
-            {'ts_code': '159246.SZ', 'name': '创业板人工智能ETF富国'},
-            {'ts_code': '159508.SZ', 'name': '生物医药ETF基金'},
-            {'ts_code': '159670.SZ', 'name': '消费ETF基金'},
-            {'ts_code': '159378.SZ', 'name': '通用航空ETF'},
-            {'ts_code': '159787.SZ', 'name': '建材ETF易方达'},
-            {'ts_code': '159852.SZ', 'name': '软件ETF'},
-            {'ts_code': '159557.SZ', 'name': '恒生医疗ETF'},
-            {'ts_code': '159899.SZ', 'name': '软件龙头ETF'},
-            {'ts_code': '159867.SZ', 'name': '畜牧ETF'},
-            {'ts_code': '159992.SZ', 'name': '创新药ETF'},
-            {'ts_code': '159835.SZ', 'name': '创新药50ETF'},
-            {'ts_code': '159262.SZ', 'name': '港股通科技ETF'},
-            {'ts_code': '159798.SZ', 'name': '消费ETF易方达'},
-            {'ts_code': '159750.SZ', 'name': '港股科技50ETF'},
-            {'ts_code': '159865.SZ', 'name': '养殖ETF'},
-            {'ts_code': '159892.SZ', 'name': '恒生医药ETF'},
-            {'ts_code': '159643.SZ', 'name': '疫苗ETF'},
-            {'ts_code': '159645.SZ', 'name': '疫苗ETF富国'},
-            {'ts_code': '159377.SZ', 'name': '创业板医药ETF国泰'},
-            {'ts_code': '159745.SZ', 'name': '建材ETF'},
-            {'ts_code': '159960.SZ', 'name': '恒生中国企业ETF'},
-            {'ts_code': '159590.SZ', 'name': '软件50ETF'},
-            {'ts_code': '159647.SZ', 'name': '中药ETF'},
-            {'ts_code': '159568.SZ', 'name': '港股互联网ETF'},
-            {'ts_code': '159586.SZ', 'name': '计算机ETF南方'},
-            {'ts_code': '159239.SZ', 'name': '港股通汽车ETF富国'},
-            {'ts_code': '159735.SZ', 'name': '港股消费ETF'},
-            {'ts_code': '159561.SZ', 'name': '德国ETF'},
-            {'ts_code': '159689.SZ', 'name': '消费ETF南方'},
-            {'ts_code': '159615.SZ', 'name': '恒生生物科技ETF'},
-            {'ts_code': '159843.SZ', 'name': '食品饮料ETF'},
-            {'ts_code': '159736.SZ', 'name': '食品饮料ETF天弘'},
-            {'ts_code': '159672.SZ', 'name': '主要消费ETF'},
-            {'ts_code': '159928.SZ', 'name': '消费ETF'},
-            {'ts_code': '159269.SZ', 'name': '港股通科技ETF南方'},
-            {'ts_code': '159792.SZ', 'name': '港股通互联网ETF'},
-            {'ts_code': '159638.SZ', 'name': '高端装备ETF'},
-            {'ts_code': '159506.SZ', 'name': '港股通医疗ETF富国'},
-            {'ts_code': '159237.SZ', 'name': '港股汽车ETF基金'},
-            {'ts_code': '159265.SZ', 'name': '港股消费50ETF'},
-            {'ts_code': '159518.SZ', 'name': '标普油气ETF'},
-            {'ts_code': '159985.SZ', 'name': '豆粕ETF'},
-            {'ts_code': '159230.SZ', 'name': '通用航空ETF基金'},
-            {'ts_code': '159862.SZ', 'name': '食品ETF'},
-            {'ts_code': '159231.SZ', 'name': '通用航空ETF华宝'},
-            {'ts_code': '159268.SZ', 'name': '港股通消费50ETF'},
-            {'ts_code': '159245.SZ', 'name': '港股通消费ETF'},
-            {'ts_code': '159210.SZ', 'name': '港股汽车ETF'},
-            {'ts_code': '159887.SZ', 'name': '银行ETF'},
-            {'ts_code': '159392.SZ', 'name': '航空ETF'},
-            {'ts_code': '159699.SZ', 'name': '恒生消费ETF'},
-            {'ts_code': '159241.SZ', 'name': '航空航天ETF天弘'},
-            {'ts_code': '159227.SZ', 'name': '航空航天ETF'},
-            {'ts_code': '159208.SZ', 'name': '航天航空ETF'},
-            {'ts_code': '159570.SZ', 'name': '港股通创新药ETF'},
-            {'ts_code': '159316.SZ', 'name': '恒生创新药ETF'},
-            {'ts_code': '159217.SZ', 'name': '港股通创新药ETF工银'},
-            {'ts_code': '159567.SZ', 'name': '港股创新药ETF'},
-            {'ts_code': '159981.SZ', 'name': '能源化工ETF'},
-            {'ts_code': '159851.SZ', 'name': '金融科技ETF'},
-            {'ts_code': '159529.SZ', 'name': '标普消费ETF'},
-            {'ts_code': '159876.SZ', 'name': '有色龙头ETF'},
-            {'ts_code': '159977.SZ', 'name': '创业板ETF天弘'},
-            
-            # 补充一些重要的上海交易所ETF
-            {'ts_code': '510300.SH', 'name': '沪深300ETF'},
-            {'ts_code': '510050.SH', 'name': '上证50ETF'},
-            {'ts_code': '510500.SH', 'name': '中证500ETF'},
-            {'ts_code': '512880.SH', 'name': '证券ETF'},
-            {'ts_code': '518880.SH', 'name': '黄金ETF'},
-            {'ts_code': '513100.SH', 'name': '纳斯达克ETF'},
-            {'ts_code': '513500.SH', 'name': '标普500ETF'},
-            {'ts_code': '513050.SH', 'name': '中概互联网ETF'},
-            {'ts_code': '512000.SH', 'name': '券商ETF'},
-            {'ts_code': '588000.SH', 'name': '科创50ETF'},
-            {'ts_code': '512010.SH', 'name': '医药ETF'},
-            {'ts_code': '512480.SH', 'name': '半导体ETF'},
-            {'ts_code': '512760.SH', 'name': '芯片ETF'},
-            {'ts_code': '512800.SH', 'name': '银行ETF'},
-            {'ts_code': '512660.SH', 'name': '军工ETF'},
-            {'ts_code': '512400.SH', 'name': '有色金属ETF'},
-            {'ts_code': '512690.SH', 'name': '酒ETF'},
-            {'ts_code': '515030.SH', 'name': '新能源汽车ETF'},
-            {'ts_code': '513660.SH', 'name': '恒生ETF'},
-            {'ts_code': '510900.SH', 'name': 'H股ETF'},
-            {'ts_code': '513130.SH', 'name': '恒生科技ETF'},
-            {'ts_code': '511260.SH', 'name': '国债ETF'},
-            {'ts_code': '511380.SH', 'name': '可转债ETF'}
-        ]
-        
-        full_etf_list = complete_etfs
+        universe_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etf_universe.csv')
+        full_etf_list = pd.read_csv(universe_file, dtype=str, usecols=['ts_code', 'name'])
         
         print(f"📊 ETF总数: {len(full_etf_list)}")
-        return pd.DataFrame(full_etf_list)
+        return full_etf_list
     
     def get_etf_daily_data(self, ts_code, days=250):
         """
@@ -0,0 +1,32 @@
+"""
+测试共用：主程序文件名带版本号（etf_dailyrating_v1.1.py）无法直接 import，整个测试会话只加载一次
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'etf_dailyrating_v1.1.py')
+
+
+def load_script(name='etf_dailyrating'):
+    # 注册到 sys.modules，进程池中的函数与对象才能按模块名 pickle
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope='session')
+def etf():
+    return load_script()
+
+
+@pytest.fixture
+def rating(etf, tmp_path, monkeypatch):
+    # 评级对象会在当前目录创建输出文件夹与状态文件
+    monkeypatch.chdir(tmp_path)
+    return etf.CompleteETFDailyRating(provider='store')
@@ -0,0 +1,31 @@
+"""
+ETF名称分类：同时命中多个类别时，跨境与行业关键词优先于宽基的数字/板块关键词
+"""
+import pytest
+
+@pytest.mark.parametrize('name, category', [
+    ('沪深300ETF', '宽基指数'),
+    ('中证A500ETF', '宽基指数'),
+    ('创业板ETF', '宽基指数'),
+    ('科创50ETF', '宽基指数'),
+    ('标普500ETF', '跨境QDII'),
+    ('港股消费50ETF', '跨境QDII'),
+    ('恒生医疗ETF', '跨境QDII'),
+    ('美国50ETF', '跨境QDII'),
+    ('电池50ETF', '行业主题'),
+    ('医药50ETF', '行业主题'),
+    ('消费电子50ETF', '行业主题'),
+    ('创业板新能源ETF华夏', '行业主题'),
+    ('创业板医药ETF国泰', '行业主题'),
+    ('黄金股ETF', '行业主题'),
+    ('国债ETF', '商品债券'),
+    ('红利ETF', '其他'),
+])
+def test_category_priority(etf, name, category):
+    matcher = etf.CategoryMatcher()
+    assert matcher.categories[matcher.match(name)] == category
+
+
+def test_category_codes_follow_display_order(etf):
+    matcher = etf.CategoryMatcher()
+    assert matcher.categories == list(etf.CATEGORY_KEYWORDS) + [etf.DEFAULT_CATEGORY]
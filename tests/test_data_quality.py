@@ -0,0 +1,67 @@
+"""
+行情数据质量检查：非正价格、高低价异常、停牌填充、单根尖峰与真实跳空的区分，以及逐只ETF的问题计数
+"""
+import numpy as np
+import pandas as pd
+
+
+def quality_panel(etf, n=6, t_len=20):
+    """逐日小幅上涨的干净面板（无重复收盘价），各行注入一种问题"""
+    close = 10 * (1 + 0.002 * np.arange(t_len))[np.newaxis, :] + np.arange(n)[:, np.newaxis]
+    volume = np.full((n, t_len), 1e6)
+    # 行0：收盘价为0的K线剔除
+    close[0, 5] = 0.0
+    # 行2：零成交量且收盘价不变的停牌填充剔除；零成交量但价格变化的K线保留
+    close[2, 6] = close[2, 5]
+    volume[2, [6, 12]] = 0.0
+    # 行3：次日回落的单根尖峰
+    close[3, 10] *= 1.5
+    # 行4：真实跳空，之后维持在新价位
+    close[4, 10:] *= 1.5
+    # 行5：收盘价连续6根不变（非停牌）
+    close[5, 12:18] = close[5, 12]
+    fields = {'open': close.copy(), 'high': close * 1.01, 'low': close * 0.99, 'close': close, 'volume': volume}
+    # 行0：开盘价为负用收盘价代替
+    fields['open'][0, 8] = -1.0
+    # 行1：最高价低于最低价
+    fields['high'][1, 4], fields['low'][1, 4] = 10.0, 12.0
+    return etf.PricePanel([f'{510000 + i}.SH' for i in range(n)], pd.bdate_range('2024-01-02', periods=t_len),
+                          {field: values.astype(np.float32) for field, values in fields.items()})
+
+
+def test_clean_price_panel(etf):
+    panel = quality_panel(etf)
+    clean, report = etf.clean_price_panel(panel, max_abs_return=0.25, stale_days=5)
+    close = np.asarray(clean['close'])
+
+    assert np.isnan(close[0, 5]) and clean['open'][0, 8] == panel['close'][0, 8]
+    assert clean['high'][1, 4] == 12.0 and clean['low'][1, 4] == 10.0
+    assert np.isnan(close[2, 6]) and not np.isnan(close[2, 12])
+    assert np.isnan(close[3, 10]) and np.isfinite(close[3, 11])
+    assert np.isfinite(close[4, 10:]).all()
+    assert np.isfinite(close[5]).all()
+    # 剔除的K线各字段一并置空
+    for field in etf.PANEL_FIELDS:
+        assert np.isnan(clean[field][0, 5]) and np.isnan(clean[field][2, 6]) and np.isnan(clean[field][3, 10])
+
+    expected = pd.DataFrame({
+        'non_positive': [2, 0, 0, 0, 0, 0],
+        'bad_high_low': [0, 1, 0, 0, 0, 0],
+        'suspended': [0, 0, 1, 0, 0, 0],
+        'stale_close': [0, 0, 0, 0, 0, 2],
+        'outlier_return': [0, 0, 0, 2, 1, 0],
+        'spike_removed': [0, 0, 0, 1, 0, 0],
+        'valid_bars': [19, 20, 19, 19, 20, 20],
+    }, index=pd.Index(panel.symbols, name='ts_code'))
+    pd.testing.assert_frame_equal(report, expected, check_dtype=False)
+
+
+def test_clean_price_panel_leaves_clean_data_untouched(etf):
+    panel = quality_panel(etf)
+    fields = {field: np.asarray(panel[field])[[1]] for field in etf.PANEL_FIELDS}
+    fields['high'][0, 4], fields['low'][0, 4] = fields['close'][0, 4] * 1.01, fields['close'][0, 4] * 0.99
+    panel = etf.PricePanel(panel.symbols[1:2], panel.dates, fields)
+    clean, report = etf.clean_price_panel(panel)
+    for field in etf.PANEL_FIELDS:
+        np.testing.assert_array_equal(clean[field], panel[field])
+    assert report.drop(columns='valid_bars').to_numpy().sum() == 0
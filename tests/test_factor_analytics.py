@@ -0,0 +1,51 @@
+"""
+因子IC增量更新：沿用的交易日必须与全量重算一致，历史评级改写后不得沿用旧结果
+"""
+import numpy as np
+import pandas as pd
+
+def synthetic_history(t_len=160, n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-02', periods=t_len)
+    returns = rng.normal(0, 0.01, (t_len, n))
+    factors = {'signal': np.roll(returns, -2, axis=0) + rng.normal(0, 0.02, (t_len, n)),
+               'noise': rng.normal(size=(t_len, n))}
+    factors['signal'][:, :3] = np.nan
+    return dates, factors, returns
+
+
+def head(factors, rows):
+    return {name: values[:rows] for name, values in factors.items()}
+
+
+def test_incremental_update_matches_full(etf, tmp_path):
+    dates, factors, returns = synthetic_history()
+    first, start = etf.FactorAnalytics.update(None, dates[:120], head(factors, 120), returns[:120])
+    assert start == 0
+    first.save(tmp_path)
+    previous = etf.FactorAnalytics.open(tmp_path)
+    assert previous.digest == first.digest
+
+    result, start = etf.FactorAnalytics.update(previous, dates, factors, returns)
+    full, _ = etf.FactorAnalytics.update(None, dates, factors, returns)
+    assert start == 120 - 1 - 20
+    np.testing.assert_array_equal(result.ic, full.ic)
+    np.testing.assert_array_equal(result.quantiles, full.quantiles)
+    assert result.digest == full.digest
+
+
+def test_rewritten_history_is_recomputed(etf):
+    dates, factors, returns = synthetic_history()
+    previous, _ = etf.FactorAnalytics.update(None, dates[:120], head(factors, 120), returns[:120])
+
+    # 同样的日期和因子名，但回填改写了早期的因子值
+    factors['noise'][10] = -factors['noise'][10]
+    result, start = etf.FactorAnalytics.update(previous, dates, factors, returns)
+    full, _ = etf.FactorAnalytics.update(None, dates, factors, returns)
+    assert start == 0
+    np.testing.assert_array_equal(result.ic, full.ic)
+
+    # 收益率被修正同样触发全量重算
+    returns = returns.copy()
+    returns[5, 0] += 0.01
+    assert etf.FactorAnalytics.update(previous, dates, factors, returns)[1] == 0
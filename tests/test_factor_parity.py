@@ -0,0 +1,191 @@
+"""
+因子内核一致性检查：面板批量、增量状态、历史滚动等向量化路径
+与逐只ETF的 compute_etf_factors、ta 库指标以及 scipy winsorize 的结果对齐
+
+运行: python -m pytest -q tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats.mstats import winsorize
+
+# 行号 -> 仅保留最后 k 根K线（上市不久 / 历史不足）
+SHORT_HISTORIES = {0: 170, 1: 70, 2: 30, 5: 25, 6: 28, 7: 61}
+# 行号 -> 停牌区间
+SUSPENSIONS = {3: slice(50, 55), 4: slice(-10, None), 8: slice(200, 230)}
+
+
+def synthetic_panel(etf, n=30, t_len=320, seed=0):
+    """随机游走的 ETF × 交易日 面板，含上市较晚、历史不足和停牌的ETF"""
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, (n, t_len)), axis=1))
+    high = close * (1 + np.abs(rng.normal(0, 0.01, (n, t_len))))
+    low = close * (1 - np.abs(rng.normal(0, 0.01, (n, t_len))))
+    fields = {
+        'open': (high + low) / 2,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': rng.integers(100000, 10000000, (n, t_len)).astype(np.float64),
+    }
+    missing = np.zeros((n, t_len), dtype=bool)
+    for row, bars in SHORT_HISTORIES.items():
+        missing[row, :t_len - bars] = True
+    for row, span in SUSPENSIONS.items():
+        missing[row, span] = True
+    for values in fields.values():
+        values[missing] = np.nan
+    # 评级结果表按注册表位置存 ts_code，取注册表中真实存在的代码
+    symbols = list(etf.load_universe().ts_codes[:n])
+    return etf.PricePanel(symbols, pd.bdate_range('2024-01-02', periods=t_len), fields)
+
+
+def column_rtol(values):
+    # 仅用于展示的列为 float32，按单精度比较
+    return 1e-9 if values.dtype == np.float64 else 1e-6
+
+
+def assert_table_matches_rows(expected, table):
+    """expected 为 compute_etf_factors 的 {ts_code: 结果行}，与评级结果表逐列比较"""
+    assert list(table.ts_codes) == list(expected)
+    for key, values in table.columns.items():
+        reference = np.array([row[key] for row in expected.values()])
+        np.testing.assert_allclose(values, reference, rtol=column_rtol(values), atol=column_rtol(values),
+                                   err_msg=key)
+
+
+def assert_tables_close(expected, actual):
+    np.testing.assert_array_equal(expected.positions, actual.positions)
+    for key, values in expected.columns.items():
+        assert actual[key].dtype == values.dtype, key
+        np.testing.assert_allclose(actual[key], values, rtol=column_rtol(values), atol=column_rtol(values),
+                                   err_msg=key)
+
+
+@pytest.fixture
+def panel(etf):
+    return synthetic_panel(etf)
+
+
+def test_panel_table_matches_per_etf(rating, panel):
+    expected = {}
+    for ts_code in panel.symbols:
+        row = rating.compute_etf_factors(ts_code, ts_code, panel.frame(ts_code))
+        if row:
+            expected[ts_code] = row
+    assert panel.symbols[2] not in expected
+    assert_table_matches_rows(expected, rating.compute_factor_table(panel, panel.symbols))
+
+
+def test_parallel_table_matches_serial(etf, rating, panel):
+    # 共享内存面板与落盘的行情面板一样按 float32 存放
+    panel = etf.PricePanel(panel.symbols, panel.dates,
+                           {field: values.astype(np.float32) for field, values in panel.fields.items()})
+    assert_tables_close(rating.compute_factor_table(panel, panel.symbols),
+                        rating.compute_factor_table_parallel(panel, panel.symbols, processes=2))
+
+
+def test_history_last_bar_matches_latest(etf, panel):
+    engine = etf.PanelFactorEngine()
+    full = [i for i in range(len(panel.symbols)) if not np.isnan(panel['close'][i]).any()]
+    close, high, low = (np.asarray(panel[field], dtype=np.float64)[full] for field in ['close', 'high', 'low'])
+    history = engine.history(close, high, low)
+    latest = engine.latest(close, high, low)
+    for key, values in latest.items():
+        np.testing.assert_allclose(history[key][:, -1], values, rtol=1e-10, atol=1e-12, err_msg=key)
+
+
+def test_wilder_matches_ta(etf, panel):
+    if etf.ta is None:
+        pytest.skip('ta 未安装')
+    # 右对齐后停牌日被压缩掉，与 ta 在有效K线序列上的计算口径一致
+    close, order = etf.right_align_panel(np.asarray(panel['close'], dtype=np.float64))
+    high, _ = etf.right_align_panel(np.asarray(panel['high'], dtype=np.float64), order)
+    low, _ = etf.right_align_panel(np.asarray(panel['low'], dtype=np.float64), order)
+    period = 14
+    latest = etf.wilder_adx_atr(high, low, close, period)
+    history = etf.wilder_adx_atr(high, low, close, period, history=True)
+    for i in range(len(close)):
+        ok = ~np.isnan(close[i])
+        h, l, c = (pd.Series(values[i, ok]) for values in (high, low, close))
+        if len(c) <= period:
+            assert np.isnan(latest['atr'][i])
+            continue
+        atr = etf.ta.volatility.AverageTrueRange(h, l, c, period).average_true_range().to_numpy()
+        np.testing.assert_allclose(latest['atr'][i], atr[-1], rtol=1e-12)
+        np.testing.assert_allclose(history['atr'][i, ok][period - 1:], atr[period - 1:], rtol=1e-12)
+        if len(c) < 2 * period:
+            assert np.isnan(latest['adx'][i])
+            continue
+        indicator = etf.ta.trend.ADXIndicator(h, l, c, period)
+        adx = indicator.adx().to_numpy()
+        np.testing.assert_allclose(latest['adx'][i], adx[-1], rtol=1e-10)
+        np.testing.assert_allclose(history['adx'][i, ok][2 * period - 1:], adx[2 * period - 1:], rtol=1e-10)
+        # ta 在平滑起点（第 period 根）给出0，之后一致
+        for key, values in [('plus_di', indicator.adx_pos()), ('minus_di', indicator.adx_neg())]:
+            np.testing.assert_allclose(history[key][i, ok][period + 1:], values.to_numpy()[period + 1:],
+                                       rtol=1e-10, err_msg=key)
+
+
+def test_incremental_state_matches_batch(rating, panel):
+    t_len = len(panel.dates)
+    rating.incremental_factors = True
+    rating.update_factor_state(panel.slice_dates(0, t_len - 5), panel.symbols)
+    for end in range(t_len - 4, t_len + 1):
+        table = rating.update_factor_state(panel.slice_dates(0, end), panel.symbols)
+    assert_tables_close(rating.compute_factor_table(panel, panel.symbols), table)
+
+    # 每天的回看窗口起点随之后移，结果不变
+    table = rating.update_factor_state(panel.slice_dates(3, t_len), panel.symbols)
+    assert_tables_close(rating.compute_factor_table(panel, panel.symbols), table)
+
+
+def test_history_scores_drop_delisted_etf(etf, rating, panel):
+    close = np.array(panel['close'])
+    close[10, 200:] = np.nan
+    panel = etf.PricePanel(panel.symbols, panel.dates, dict(panel.fields, close=close))
+    rating.lookback_bars = 120
+    scores = rating.historical_scores(panel)[0]
+    # 停牌期间沿用最近一根K线
+    assert np.isfinite(scores[8, 200:230]).all()
+    # 最后一根K线之后，回看窗口内K线不足 min_required_days 即不再评级
+    window_bars = 200 - (np.arange(200, len(panel.dates)) + 1 - rating.lookback_bars)
+    stale = window_bars - 1 < rating.min_required_days
+    assert stale.any() and not stale.all()
+    assert np.isfinite(scores[10, 200:][~stale]).all()
+    assert np.isnan(scores[10, 200:][stale]).all()
+
+
+def reference_zscores(column, limits=(0.05, 0.05)):
+    """逐列参考实现：有效值 winsorize 后按总体标准差标准化"""
+    valid = ~np.isnan(column)
+    if valid.sum() < 2:
+        return column
+    clipped = np.asarray(winsorize(column[valid], limits=limits), dtype=np.float64)
+    std = clipped.std()
+    if std == 0:
+        return np.zeros_like(column)
+    result = np.full_like(column, np.nan)
+    result[valid] = (clipped - clipped.mean()) / std
+    return result
+
+
+def test_normalize_matches_winsorize(etf):
+    rng = np.random.default_rng(1)
+    for trial in range(200):
+        n = int(rng.integers(1, 400))
+        values = rng.standard_t(3, size=(n, 4))
+        if trial % 3 == 0:
+            values[rng.random((n, 4)) < 0.2] = np.nan
+        if trial % 7 == 0:
+            values[:, 2] = 1.0
+        if trial % 11 == 0:
+            values = np.round(values, 1)
+        z = etf.cross_sectional_normalize(values)
+        for k in range(values.shape[1]):
+            np.testing.assert_allclose(z[:, k], reference_zscores(values[:, k]), rtol=1e-10, atol=1e-12)
+
+    # 历史面板按交易日逐列标准化，与单独处理某一天一致
+    panel_values = rng.normal(size=(50, 30, 4))
+    z = etf.cross_sectional_normalize(panel_values)
+    np.testing.assert_allclose(z[:, 17], etf.cross_sectional_normalize(panel_values[:, 17]), rtol=1e-12)
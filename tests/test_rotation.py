@@ -0,0 +1,104 @@
+"""
+轮动回测：选股边界情况与滚动验证的进程池路径
+"""
+import numpy as np
+import pandas as pd
+
+def test_select_top_n_fewer_etfs_than_slots(etf):
+    scores = np.array([[1.0, 2.0], [np.nan, 3.0], [np.nan, np.nan]])
+    selected, weights = etf.select_top_n(scores, top_n=3, max_weight=0.35)
+    np.testing.assert_array_equal(selected, [[1, 0, -1], [1, -1, -1], [-1, -1, -1]])
+    np.testing.assert_allclose(weights, [[1 / 3, 1 / 3, 0], [1 / 3, 0, 0], [0, 0, 0]])
+
+    # 批量配置的前导维同样补齐
+    selected, weights = etf.select_top_n(np.zeros((4, 5, 2)), top_n=3)
+    assert selected.shape == weights.shape == (4, 5, 3)
+    assert (selected[..., 2] == -1).all() and (weights[..., 2] == 0).all()
+
+
+def test_select_top_n_orders_by_score(etf):
+    selected, weights = etf.select_top_n(np.array([[3.0, 1.0, 2.0, 5.0]]), top_n=3, max_weight=0.2)
+    np.testing.assert_array_equal(selected, [[3, 0, 2]])
+    np.testing.assert_allclose(weights, [[0.2, 0.2, 0.2]])
+
+
+def reference_rotation(returns, trade_idx, selected, weights, cost_rate):
+    """逐日循环的参考实现：持仓按市值记账，调仓日收盘按目标权重再平衡，成本计入下一交易日收益"""
+    returns = np.nan_to_num(returns, nan=0.0)
+    positions, cash = {}, 1.0
+    pending_cost = 1.0
+    daily = np.zeros(returns.shape[0])
+    turnover = []
+    for t in range(returns.shape[0]):
+        before = sum(positions.values()) + cash
+        positions = {i: value * (1 + returns[t, i]) for i, value in positions.items()}
+        after = sum(positions.values()) + cash
+        daily[t] = pending_cost * after / before - 1
+        if pending_cost != 1.0:
+            positions = {i: value * pending_cost for i, value in positions.items()}
+            cash *= pending_cost
+            pending_cost = 1.0
+        if t in trade_idx:
+            k = list(trade_idx).index(t)
+            total = sum(positions.values()) + cash
+            drifted = {i: value / total for i, value in positions.items()}
+            target = {int(i): w for i, w in zip(selected[k], weights[k]) if i >= 0}
+            assets = set(drifted) | set(target)
+            traded = sum(abs(target.get(i, 0.0) - drifted.get(i, 0.0)) for i in assets)
+            turnover.append(traded)
+            pending_cost = 1 - cost_rate * traded
+            positions = {i: w * total for i, w in target.items()}
+            cash = total - sum(positions.values())
+    return daily, np.array(turnover)
+
+
+def test_simulate_rotation_matches_reference_loop(etf):
+    rng = np.random.default_rng(3)
+    t_len, n = 80, 7
+    returns = rng.normal(0.0005, 0.02, (t_len, n))
+    returns[rng.random((t_len, n)) < 0.1] = np.nan
+    trade_idx = np.array([4, 15, 16, 33, 50, 71])
+    scores = rng.normal(size=(len(trade_idx), n))
+    scores[1, 2:] = np.nan
+    scores[3, :] = np.nan
+    selected, weights = etf.select_top_n(scores, top_n=3, max_weight=0.3)
+    # 有空位（现金）、全部空仓和与上期重叠的持仓
+    assert (selected[1] == -1).any() and (selected[3] == -1).all()
+
+    result = etf.simulate_rotation(returns, trade_idx, selected, weights, cost_rate=0.0015)
+    daily, turnover = reference_rotation(returns, trade_idx, selected, weights, 0.0015)
+    np.testing.assert_allclose(result['daily'], daily, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(result['turnover'], turnover, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(result['nav'], np.cumprod(1 + daily), rtol=1e-12)
+
+    # 前导维批量模拟与逐组一致
+    other = etf.select_top_n(scores[:, ::-1], top_n=3, max_weight=0.3)
+    batch = etf.simulate_rotation(returns, trade_idx, np.stack([selected, other[0]]),
+                                  np.stack([weights, other[1]]), cost_rate=0.0015)
+    np.testing.assert_allclose(batch['daily'][0], result['daily'], rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(batch['daily'][1], reference_rotation(returns, trade_idx, *other, 0.0015)[0],
+                               rtol=1e-12, atol=1e-14)
+
+
+def walk_forward_panel(etf, last_session, n=12, t_len=420, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, (n, t_len)), axis=1))
+    fields = {'open': close, 'high': close * 1.01, 'low': close * 0.99, 'close': close,
+              'volume': np.full((n, t_len), 1e6)}
+    for values in fields.values():
+        values[3, :150] = np.nan
+        values[5, 200:210] = np.nan
+    dates = pd.bdate_range(end=last_session, periods=t_len)
+    return etf.PricePanel([f'{510000 + i}.SH' for i in range(n)], dates, fields)
+
+
+def test_walk_forward_pool_matches_serial(etf, rating, monkeypatch):
+    last_session = rating.calendar.last_session(etf.exchange_now(), rating.market_close_time)
+    panel = walk_forward_panel(etf, last_session)
+    monkeypatch.setattr(rating, 'load_history_panel', lambda etf_list, start, last: panel)
+    kwargs = dict(folds=3, years=1, train_days=60, n_configs=8, top_n=3)
+    serial = rating.run_walk_forward(processes=1, **kwargs)
+    pooled = rating.run_walk_forward(processes=2, **kwargs)
+    assert serial[0] == pooled[0] and serial[1] == pooled[1]
+    pd.testing.assert_frame_equal(serial[2], pooled[2])
+    pd.testing.assert_frame_equal(serial[3], pooled[3])
@@ -0,0 +1,106 @@
+"""
+本地行情库作为续传机制：原子写入，以及 --refresh 中断后重跑只下载本轮尚未刷新的ETF
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+CODES = [f'{510000 + i}.SH' for i in range(6)]
+
+
+class Interrupted(BaseException):
+    """模拟 Ctrl-C / 进程被杀"""
+
+
+def make_provider(etf, fail_after=None):
+    class SyntheticProvider(etf.MarketDataProvider):
+        name = 'synthetic'
+
+        def __init__(self):
+            self.fetched = []
+
+        def fetch(self, ts_code, start_date, end_date):
+            if fail_after is not None and len(self.fetched) >= fail_after:
+                raise Interrupted()
+            self.fetched.append(ts_code)
+            dates = pd.bdate_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize())
+            close = 10 + np.arange(len(dates)) * 0.01
+            return pd.DataFrame({'trade_date': dates, 'open': close, 'high': close, 'low': close,
+                                 'close': close, 'volume': 1e6})
+
+    return SyntheticProvider()
+
+
+def run_fetch(etf, provider, refresh):
+    rating = etf.CompleteETFDailyRating(provider=provider, refresh=refresh, fetch_workers=1)
+    dict(rating.iter_etf_daily_data(CODES))
+    return rating
+
+
+def test_interrupted_refresh_resumes(etf, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run_fetch(etf, make_provider(etf), refresh=False)
+
+    flaky = make_provider(etf, fail_after=2)
+    with pytest.raises(Interrupted):
+        run_fetch(etf, flaky, refresh=True)
+    assert os.path.exists(os.path.join('ohlcv_store', 'refresh_session.json'))
+
+    # 接续同一轮刷新：已重新下载的两只不再下载
+    provider = make_provider(etf)
+    run_fetch(etf, provider, refresh=True)
+    assert sorted(provider.fetched) == sorted(set(CODES) - set(flaky.fetched))
+    assert not os.path.exists(os.path.join('ohlcv_store', 'refresh_session.json'))
+
+    # 上一轮已完成，新的 --refresh 全部重新下载
+    provider = make_provider(etf)
+    run_fetch(etf, provider, refresh=True)
+    assert sorted(provider.fetched) == CODES
+
+
+def test_store_meta_is_replaced_atomically(etf, tmp_path):
+    store = etf.OHLCVStore(str(tmp_path))
+    df = pd.DataFrame({'trade_date': pd.bdate_range('2024-01-02', periods=3), 'open': 1.0, 'high': 1.0,
+                       'low': 1.0, 'close': 1.0, 'volume': 1.0})
+    store.save(CODES[0], df, pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-05 16:00'))
+    assert sorted(os.listdir(tmp_path)) == [f'{CODES[0]}.parquet', 'store_meta.json']
+    assert etf.OHLCVStore(str(tmp_path)).checked_at(CODES[0]) == pd.Timestamp('2024-01-05 16:00')
+
+    # 旧版本中途被杀留下的半截元数据不再让后续运行崩溃
+    with open(store.meta_file, 'w', encoding='utf-8') as f:
+        f.write('{"510000.SH": {"coverage_st')
+    assert etf.OHLCVStore(str(tmp_path)).meta == {}
+
+
+def test_exchange_clock_ignores_host_timezone(etf, monkeypatch):
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    try:
+        shanghai = pd.Timestamp.now(tz='UTC').tz_localize(None) + pd.Timedelta(hours=8)
+        assert abs(etf.exchange_now() - shanghai) < pd.Timedelta(minutes=1)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_evening_check_is_stale_after_next_close(etf, tmp_path, monkeypatch):
+    """UTC 主机上前一晚的检查，在次日北京时间15:00收盘后必须重新下载"""
+    monkeypatch.chdir(tmp_path)
+    provider = make_provider(etf)
+    rating = etf.CompleteETFDailyRating(provider=provider, fetch_workers=1)
+    session = rating.calendar.last_session(etf.exchange_now(), rating.market_close_time)
+    previous = rating.calendar.shift(session, -1)
+    df = provider.fetch(CODES[0], rating.lookback_start(rating.lookback_bars), previous)
+    # 前一交易日北京时间20:00检查过（UTC 12:00）
+    rating.store.save(CODES[0], df, df['trade_date'].iloc[0], previous + pd.Timedelta(hours=20))
+
+    after_close = session + pd.Timedelta(hours=15, minutes=30)
+    monkeypatch.setattr(etf, 'exchange_now', lambda: after_close)
+    _, start_date, _ = rating.plan_fetch(CODES[0], None)
+    assert start_date == previous
+
+    rating.store.save(CODES[0], df, df['trade_date'].iloc[0], after_close)
+    assert rating.plan_fetch(CODES[0], None)[1] is None